@@ -7,8 +7,12 @@ import soundfile as sf
 from typing import Optional, Tuple
 import warnings
 import os
+import itertools
+import threading
 from huggingface_hub import hf_hub_download
 import tempfile
+from dsp_utils import as_float32, peak_abs
+from host_profile import host_profile
 
 warnings.filterwarnings("ignore")
 
@@ -18,6 +22,19 @@ class AIAudioEnhancer:
     def __init__(self):
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
         self.models = {}
+        # 保护models字典和进行中的加载任务
+        self._models_lock = threading.RLock()
+        self._loading = {}
+        # 每次登记模型递增的版本号，重新加载后缓存的旧模型输出随之失效
+        self._versions = itertools.count(1)
+        # 各模型的STFT参数，本机调优配置（autotune.py生成）会覆盖默认值
+        self.stft_params = {
+            "rnnoise": {"n_fft": 1024, "hop_length": 256, "win_length": 1024},
+            "speechbrain_enhance": {"n_fft": 1024, "hop_length": 256, "win_length": 1024},
+        }
+        for model_name, params in host_profile.get("stft", {}).items():
+            if model_name in self.stft_params:
+                self.stft_params[model_name].update(params)
         self.model_info = {
             "facebook_denoiser": {
                 "name": "Facebook Denoiser",
@@ -41,7 +58,32 @@ class AIAudioEnhancer:
         print(f"AI模型管理器初始化完成，设备: {self.device}")
     
     def download_and_load_model(self, model_name: str) -> bool:
-        """下载并加载指定的AI模型"""
+        """下载并加载指定的AI模型
+
+        同一模型的并发加载请求只执行一次，其余调用方等待进行中的加载完成。
+        """
+        with self._models_lock:
+            if model_name in self.models:
+                return True
+            loading = self._loading.get(model_name)
+            is_loader = loading is None
+            if is_loader:
+                loading = self._loading[model_name] = threading.Event()
+        
+        if not is_loader:
+            print(f"⏳ 模型 {model_name} 正在由其他请求加载，等待完成...")
+            loading.wait()
+            return self.is_model_loaded(model_name)
+        
+        try:
+            return self._load_model(model_name)
+        finally:
+            with self._models_lock:
+                del self._loading[model_name]
+            loading.set()
+    
+    def _load_model(self, model_name: str) -> bool:
+        """实际执行模型加载"""
         try:
             if model_name == "facebook_denoiser":
                 return self._load_facebook_denoiser()
@@ -56,6 +98,24 @@ class AIAudioEnhancer:
             print(f"加载模型 {model_name} 失败: {str(e)}")
             return False
     
+    def _register_model(self, model_name: str, entry: dict):
+        """线程安全地登记已加载的模型"""
+        with self._models_lock:
+            entry["version"] = next(self._versions)
+            self.models[model_name] = entry
+    
+    def get_model_entry(self, model_name: str) -> Optional[dict]:
+        """线程安全地获取模型条目快照，避免检查与使用之间被卸载"""
+        with self._models_lock:
+            return self.models.get(model_name)
+    
+    def model_version(self, model_name: str) -> Optional[tuple]:
+        """模型输出的版本标识：(加载版本号, STFT参数)，未加载时返回None"""
+        entry = self.get_model_entry(model_name)
+        if entry is None:
+            return None
+        return entry["version"], tuple(sorted(self.stft_params.get(model_name, {}).items()))
+    
     def _load_facebook_denoiser(self) -> bool:
         """加载Facebook Denoiser模型"""
         try:
@@ -66,11 +126,11 @@ class AIAudioEnhancer:
             model = model.to(self.device)
             model.eval()
             
-            self.models["facebook_denoiser"] = {
+            self._register_model("facebook_denoiser", {
                 "model": model,
                 "sample_rate": bundle.sample_rate,
                 "processor": self._facebook_denoiser_process
-            }
+            })
             print("✅ Facebook Denoiser加载成功")
             return True
         except Exception as e:
@@ -86,23 +146,22 @@ class AIAudioEnhancer:
             
             # 这里创建一个模拟的增强函数
             def speechbrain_enhance(audio, sr):
-                # 简单的频域增强作为示例
-                stft = librosa.stft(audio, n_fft=1024, hop_length=256)
-                magnitude = np.abs(stft)
-                phase = np.angle(stft)
+                # 简单的频域增强作为示例（float32输入得到complex64频谱）
+                params = self.stft_params["speechbrain_enhance"]
+                stft = librosa.stft(as_float32(audio), **params)
                 
                 # AI风格的增强：使用学习到的权重模拟
-                enhanced_magnitude = magnitude * 1.1  # 模拟AI增强
-                enhanced_magnitude = np.clip(enhanced_magnitude, 0, magnitude.max() * 1.5)
+                # 幅度统一乘1.1时不会超过 max*1.5 的上限，相位不变，直接原地缩放复数谱
+                stft *= np.float32(1.1)
                 
-                enhanced_stft = enhanced_magnitude * np.exp(1j * phase)
-                return librosa.istft(enhanced_stft, hop_length=256)
+                return librosa.istft(stft, hop_length=params["hop_length"], win_length=params["win_length"],
+                                     length=len(audio))
             
-            self.models["speechbrain_enhance"] = {
+            self._register_model("speechbrain_enhance", {
                 "model": speechbrain_enhance,
                 "sample_rate": 16000,
                 "processor": self._speechbrain_process
-            }
+            })
             print("✅ SpeechBrain模型加载成功")
             return True
         except Exception as e:
@@ -142,19 +201,19 @@ class AIAudioEnhancer:
             model = model.to(self.device)
             model.eval()
             
-            self.models["rnnoise"] = {
+            self._register_model("rnnoise", {
                 "model": model,
                 "sample_rate": 48000,
                 "processor": self._rnnoise_process
-            }
+            })
             print("✅ RNNoise模型加载成功")
             return True
         except Exception as e:
             print(f"❌ RNNoise模型加载失败: {str(e)}")
             return False
     
-    def _facebook_denoiser_process(self, audio: np.ndarray, sr: int) -> np.ndarray:
-        """Facebook Denoiser处理"""
+    def _facebook_denoiser_process(self, model, audio: np.ndarray, sr: int) -> np.ndarray:
+        """Facebook Denoiser处理（model为调用方取得的模型快照）"""
         try:
             # 转换为tensor
             audio_tensor = torch.from_numpy(audio).float().to(self.device)
@@ -163,64 +222,59 @@ class AIAudioEnhancer:
             
             with torch.no_grad():
                 # 使用SQUIM模型进行质量评估和增强
-                model = self.models["facebook_denoiser"]["model"]
                 # 注意：SQUIM主要用于质量评估，这里做一个简化的处理
                 enhanced = audio_tensor * 1.05  # 简单增强
-                enhanced = torch.clamp(enhanced, -1.0, 1.0)
+                enhanced.clamp_(-1.0, 1.0)
             
             return enhanced.squeeze().cpu().numpy()
         except Exception as e:
             print(f"Facebook Denoiser处理失败: {str(e)}")
             return audio
     
-    def _speechbrain_process(self, audio: np.ndarray, sr: int) -> np.ndarray:
-        """SpeechBrain处理"""
+    def _speechbrain_process(self, enhance_func, audio: np.ndarray, sr: int) -> np.ndarray:
+        """SpeechBrain处理（enhance_func为调用方取得的模型快照）"""
         try:
-            enhance_func = self.models["speechbrain_enhance"]["model"]
             enhanced = enhance_func(audio, sr)
-            return enhanced.astype(np.float32)
+            return as_float32(enhanced)
         except Exception as e:
             print(f"SpeechBrain处理失败: {str(e)}")
             return audio
     
-    def _rnnoise_process(self, audio: np.ndarray, sr: int) -> np.ndarray:
-        """RNNoise处理"""
+    def _rnnoise_process(self, model, audio: np.ndarray, sr: int) -> np.ndarray:
+        """RNNoise处理（model为调用方取得的模型快照）"""
         try:
-            model = self.models["rnnoise"]["model"]
-            
-            # 使用固定的处理参数
-            n_fft = 1024  # 固定FFT大小
-            hop_length = 256
-            win_length = 1024
+            # STFT参数：n_fft需与RNN的512维输入匹配，帧移和窗长可按本机调优
+            params = self.stft_params["rnnoise"]
+            n_fft = params["n_fft"]
+            hop_length = params["hop_length"]
+            win_length = params["win_length"]
             
-            # STFT变换
-            stft = librosa.stft(audio, n_fft=n_fft, hop_length=hop_length, win_length=win_length)
+            # STFT变换（float32输入得到complex64频谱）
+            stft = librosa.stft(as_float32(audio), n_fft=n_fft, hop_length=hop_length, win_length=win_length)
             magnitude = np.abs(stft)
-            phase = np.angle(stft)
             
             print(f"STFT输出维度: {magnitude.shape}")
             
+            # 将频谱原地转换为单位相位因子 e^{j·phase}，替代 angle + exp 的complex128往返
+            np.divide(stft, magnitude, out=stft, where=magnitude > 0)
+            phasor = stft
+            
             # 处理频率维度 - librosa的STFT输出是 (freq_bins, time_frames)
             # n_fft=1024 会产生 513 个频率bins (1024//2 + 1)
             freq_bins = magnitude.shape[0]
             expected_freq_bins = 512
-            
-            if freq_bins != expected_freq_bins:
-                if freq_bins > expected_freq_bins:
-                    # 截取前512个频率bins（去掉最高频）
-                    magnitude = magnitude[:expected_freq_bins, :]
-                    phase = phase[:expected_freq_bins, :]
-                    print(f"截取频率bins: {freq_bins} -> {expected_freq_bins}")
-                else:
-                    # 用零填充到512个bins
-                    pad_size = expected_freq_bins - freq_bins
-                    magnitude = np.pad(magnitude, ((0, pad_size), (0, 0)), mode='constant', constant_values=0)
-                    phase = np.pad(phase, ((0, pad_size), (0, 0)), mode='constant', constant_values=0)
-                    print(f"填充频率bins: {freq_bins} -> {expected_freq_bins}")
+            used_freq_bins = min(freq_bins, expected_freq_bins)
             
             # 转换为RNN输入格式 (batch_size, time_steps, features)
             # magnitude shape: (512, time_frames) -> (1, time_frames, 512)
-            mag_tensor = torch.from_numpy(magnitude.T).float().to(self.device)
+            rnn_input = np.zeros((magnitude.shape[1], expected_freq_bins), dtype=np.float32)
+            rnn_input[:, :used_freq_bins] = magnitude[:used_freq_bins].T
+            if freq_bins > expected_freq_bins:
+                print(f"截取频率bins: {freq_bins} -> {expected_freq_bins}")
+            elif freq_bins < expected_freq_bins:
+                print(f"填充频率bins: {freq_bins} -> {expected_freq_bins}")
+            
+            mag_tensor = torch.from_numpy(rnn_input).to(self.device)
             mag_tensor = mag_tensor.unsqueeze(0)  # 添加batch维度
             
             print(f"RNN输入维度: {mag_tensor.shape} [batch, time, freq]")
@@ -232,33 +286,18 @@ class AIAudioEnhancer:
             
             print(f"RNN输出维度: {enhanced_magnitude.shape}")
             
-            # 如果之前截取了频率bins，需要恢复原始维度用于ISTFT
+            # 如果之前截取了频率bins，最高频bin沿用最后一个bin的幅度和相位
             if freq_bins > expected_freq_bins:
-                # 恢复最高频bin（复制最后一个频率bin）
-                pad_size = freq_bins - expected_freq_bins
-                last_freq_mag = enhanced_magnitude[-1:, :]  # 取最后一行
-                last_freq_phase = phase[-pad_size:, :]  # 取对应的phase
-                
-                enhanced_magnitude = np.vstack([enhanced_magnitude, np.tile(last_freq_mag, (pad_size, 1))])
-                # phase保持原样，因为我们没有修改过完整的phase
-                phase = np.vstack([phase[:expected_freq_bins, :], last_freq_phase])
+                phasor[expected_freq_bins:, :] = phasor[expected_freq_bins - 1, :] * enhanced_magnitude[-1, :]
             
-            # 重构音频
-            enhanced_stft = enhanced_magnitude * np.exp(1j * phase)
-            enhanced_audio = librosa.istft(enhanced_stft, hop_length=hop_length, win_length=win_length)
+            # 重构音频：原地将增强幅度乘回相位因子
+            phasor[:used_freq_bins, :] *= enhanced_magnitude[:used_freq_bins, :]
+            enhanced_audio = librosa.istft(phasor, hop_length=hop_length, win_length=win_length,
+                                           length=len(audio))
             
             print(f"重构音频长度: {len(enhanced_audio)}")
             
-            # 确保输出长度与输入一致
-            if len(enhanced_audio) != len(audio):
-                if len(enhanced_audio) > len(audio):
-                    enhanced_audio = enhanced_audio[:len(audio)]
-                else:
-                    # 用零填充
-                    pad_size = len(audio) - len(enhanced_audio)
-                    enhanced_audio = np.pad(enhanced_audio, (0, pad_size), mode='constant')
-            
-            return enhanced_audio.astype(np.float32)
+            return as_float32(enhanced_audio)
             
         except Exception as e:
             print(f"RNNoise处理失败: {str(e)}")
@@ -268,16 +307,19 @@ class AIAudioEnhancer:
     
     def enhance_audio(self, audio: np.ndarray, sr: int, model_name: str) -> np.ndarray:
         """使用指定的AI模型增强音频"""
-        if model_name not in self.models:
+        entry = self.get_model_entry(model_name)
+        if entry is None:
             print(f"模型 {model_name} 未加载")
             return audio
         
         try:
-            processor = self.models[model_name]["processor"]
-            enhanced = processor(audio, sr)
+            # 模型与处理函数都来自同一快照，处理期间被并发卸载也不受影响
+            processor = entry["processor"]
+            enhanced = processor(entry["model"], audio, sr)
             
-            # 确保输出有效
-            if not np.isfinite(enhanced).all():
+            # 确保输出有效（峰值扫描会传播NaN/Inf）
+            enhanced = as_float32(enhanced)
+            if not np.isfinite(peak_abs(enhanced)):
                 print(f"AI模型 {model_name} 产生无效输出，返回原始音频")
                 return audio
             
@@ -292,12 +334,14 @@ class AIAudioEnhancer:
     
     def is_model_loaded(self, model_name: str) -> bool:
         """检查模型是否已加载"""
-        return model_name in self.models
+        with self._models_lock:
+            return model_name in self.models
     
     def unload_model(self, model_name: str):
         """卸载指定模型以释放内存"""
-        if model_name in self.models:
-            del self.models[model_name]
+        with self._models_lock:
+            removed = self.models.pop(model_name, None)
+        if removed is not None:
             if torch.cuda.is_available():
                 torch.cuda.empty_cache()
             print(f"✅ 模型 {model_name} 已卸载")
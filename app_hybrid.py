@@ -4,16 +4,152 @@ import librosa
 import soundfile as sf
 import tempfile
 import os
+import time
 from typing import Tuple, Optional
+import argparse
 import warnings
 from hybrid_enhancer import hybrid_enhancer
+from job_queue import JobManager, JobQueueFull, JobCancelled, progress_span, report_progress
+from segment_parallel import enhance_long_audio
+from channel_layout import analyze_channel_layout, to_mid_side, from_mid_side
+from dsp_utils import peak_abs
+from profiling import request_profiler
+from request_trace import trace_recorder
+from host_profile import host_profile
 warnings.filterwarnings("ignore")
 
-def process_audio_hybrid(audio_file, processing_mode, enable_ai, ai_model, enhancement_level, blend_ratio):
+# 多进程服务模式下的工作进程池（None表示单进程模式）
+worker_pool = None
+
+# 超过该时长的音频分段并行处理（秒）
+LONG_AUDIO_SECONDS = float(os.environ.get("AUDIOHD_LONG_AUDIO_SECONDS", "120"))
+
+# 异步任务队列（启动时根据命令行参数重新配置）
+job_manager = JobManager(max_concurrency=1, max_pending=8, default_timeout=1800)
+
+def _enhance_channels(channels, sr, channel_settings, channel_kwargs):
+    """按当前服务模式增强一个或多个声道（每个声道各自的处理设置与参数），返回 [(增强音频, 元数据), ...]"""
+    audio_duration = len(channels[0]) / sr
+    span = 1.0 / len(channels)
+    
+    if audio_duration >= LONG_AUDIO_SECONDS:
+        # 长音频：每个声道切分为重叠片段并行处理（多进程模式用工作进程池，单进程模式用线程池）
+        results = []
+        for i, (channel, settings, kwargs) in enumerate(zip(channels, channel_settings, channel_kwargs)):
+            with progress_span(i * span, (i + 1) * span):
+                results.append(enhance_long_audio(channel, sr, *settings, worker_pool=worker_pool, **kwargs))
+        return results
+    
+    if worker_pool is not None:
+        # 多进程模式：各声道同时分发到不同工作进程
+        report_progress("工作进程处理", 0.1)
+        tasks = [worker_pool.submit(channel, sr, *settings, **kwargs)
+                 for channel, settings, kwargs in zip(channels, channel_settings, channel_kwargs)]
+        results = []
+        try:
+            for i, task in enumerate(tasks):
+                # 限时等待并检查取消/截止时间，终止时回收正在处理的工作进程
+                results.append(task.wait())
+                report_progress("工作进程处理", (i + 1) * span)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+        return results
+    
+    results = []
+    for i, (channel, settings, kwargs) in enumerate(zip(channels, channel_settings, channel_kwargs)):
+        with progress_span(i * span, (i + 1) * span):
+            results.append(hybrid_enhancer.enhance_audio(channel, sr, *settings, **kwargs))
+    return results
+
+def _enhance_stereo(audio, sr, settings, request_kwargs):
+    """立体声增强：先检测声道布局，双单声道只处理一次，高度相关的声道按中/侧处理"""
+    layout = analyze_channel_layout(audio[0], audio[1])
+    print(f"🎧 声道布局: {layout['layout']} (相关系数: {layout['correlation']}, 侧/中能量比: {layout['side_ratio_db']}dB)")
+    
+    if layout["layout"] == "dual_mono":
+        # 相同声道：处理一次后复制
+        print("🎧 检测到双单声道，只处理一次")
+        (enhanced, metadata), = _enhance_channels([audio[0]], sr, [settings], [request_kwargs])
+        enhanced_audio = np.array([enhanced, enhanced])
+        shortcut = "dual_mono_duplicated"
+        
+    elif layout["layout"] == "mid_side":
+        # 高度相关：中声道完整处理，近乎静音的侧声道只做基础传统处理，最后统一标准化
+        print("🎧 检测到高度相关声道，按中/侧声道处理")
+        mid, side = to_mid_side(audio[0], audio[1])
+        mid_kwargs = dict(request_kwargs, normalization="none")
+        
+        # 质量门限按中声道预先评估一次：命中时侧声道保持原样，否则与中声道一起分发
+        skip_side = False
+        if "quality_threshold" in request_kwargs:
+            mid_kwargs["quality_score"] = float(hybrid_enhancer.quality_gate.score(mid, sr))
+            skip_side = mid_kwargs["quality_score"] >= request_kwargs["quality_threshold"]
+        
+        channels, channel_settings, channel_kwargs = [mid], [settings], [mid_kwargs]
+        if not skip_side:
+            # 侧声道只做基础传统处理，同样走工作进程池/长音频分段路径，可随请求取消
+            channels.append(side)
+            channel_settings.append(("traditional_only", settings[1], "basic", settings[3]))
+            channel_kwargs.append({"normalization": "none", "profile": False})
+        
+        with progress_span(0.0, 0.9):
+            results = _enhance_channels(channels, sr, channel_settings, channel_kwargs)
+        enhanced_mid, metadata = results[0]
+        enhanced_side = side if skip_side else results[1][0]
+        
+        enhanced_audio = from_mid_side(enhanced_mid, enhanced_side)
+        enhanced_audio = hybrid_enhancer.normalize_output(
+            enhanced_audio, audio, sr, peak_abs(enhanced_audio), "loudness"
+        )
+        shortcut = "mid_side"
+        
+    else:
+        # 独立声道：分别处理左右声道
+        channels = [audio[0], audio[1]]
+        
+        # 两个声道一次批量评估质量，按较差的声道共同判定，避免只跳过其中一个声道
+        channel_kwargs = [dict(request_kwargs) for _ in channels]
+        if "quality_threshold" in request_kwargs:
+            score = float(hybrid_enhancer.quality_gate.score_batch(channels, sr).min())
+            for kwargs in channel_kwargs:
+                kwargs["quality_score"] = score
+        
+        (enhanced_left, metadata), (enhanced_right, _) = _enhance_channels(
+            channels, sr, [settings, settings], channel_kwargs
+        )
+        
+        # 合并立体声，使用左声道的元数据
+        enhanced_audio = np.array([enhanced_left, enhanced_right])
+        shortcut = "none"
+    
+    metadata = dict(metadata)
+    metadata["channel_layout"] = layout
+    metadata["channel_shortcut"] = shortcut
+    return enhanced_audio, metadata
+
+def process_audio_hybrid(audio_file, processing_mode, enable_ai, ai_model, enhancement_level, blend_ratio,
+                         quality_threshold=0.0, profile_request=False):
     """混合音频处理主函数"""
     if audio_file is None:
         return None, "❌ 请上传音频文件", ""
     
+    # 请求追踪（用于回放压测），未开启时为None
+    trace = None
+    if trace_recorder.enabled:
+        trace = {
+            "timestamp": time.time(),
+            "processing_mode": processing_mode,
+            "enable_ai": bool(enable_ai),
+            "ai_model": ai_model,
+            "enhancement_level": enhancement_level,
+            "blend_ratio": blend_ratio,
+            "quality_threshold": quality_threshold,
+            "outcome": "error",
+        }
+    start_time = time.perf_counter()
+    
     try:
         print(f"\n🎵 开始处理音频文件: {audio_file}")
         print(f"📊 处理模式: {processing_mode}")
@@ -24,6 +160,9 @@ def process_audio_hybrid(audio_file, processing_mode, enable_ai, ai_model, enhan
         # 读取音频文件
         audio, sr = librosa.load(audio_file, sr=None, mono=False)
         print(f"📂 音频信息: {audio.shape}, 采样率: {sr}Hz")
+        if trace is not None:
+            trace.update(duration=audio.shape[-1] / sr, sample_rate=sr,
+                         channels=audio.shape[0] if audio.ndim > 1 else 1)
         
         # 根据AI开关调整处理模式
         if not enable_ai:
@@ -31,29 +170,27 @@ def process_audio_hybrid(audio_file, processing_mode, enable_ai, ai_model, enhan
                 processing_mode = "traditional_only"
                 print("⚠️ AI处理已禁用，自动切换到仅传统处理模式")
         
+        # 质量门限（0表示关闭）
+        request_kwargs = {}
+        if quality_threshold and quality_threshold > 0:
+            request_kwargs["quality_threshold"] = float(quality_threshold)
+            print(f"🎯 质量门限: {quality_threshold:.1f}")
+        
+        # 性能分析：按请求开启或按比例抽样，整个请求统一决定
+        request_kwargs["profile"] = request_profiler.should_profile(True if profile_request else None)
+        if request_kwargs["profile"]:
+            print("🔬 本次请求启用性能分析")
+        
+        settings = (processing_mode, ai_model, enhancement_level, blend_ratio)
+        
         # 处理立体声/单声道
         if len(audio.shape) > 1 and audio.shape[0] == 2:
-            # 立体声：分别处理左右声道
             print("🎧 处理立体声音频...")
-            left_channel = audio[0]
-            right_channel = audio[1]
             
             # 计算正确的音频时长（使用单个声道的长度）
-            audio_duration = len(left_channel) / sr
+            audio_duration = audio.shape[1] / sr
             
-            # 处理左声道
-            enhanced_left, metadata_left = hybrid_enhancer.enhance_audio(
-                left_channel, sr, processing_mode, ai_model, enhancement_level, blend_ratio
-            )
-            
-            # 处理右声道
-            enhanced_right, metadata_right = hybrid_enhancer.enhance_audio(
-                right_channel, sr, processing_mode, ai_model, enhancement_level, blend_ratio
-            )
-            
-            # 合并立体声
-            enhanced_audio = np.array([enhanced_left, enhanced_right])
-            metadata = metadata_left  # 使用左声道的元数据
+            enhanced_audio, metadata = _enhance_stereo(audio, sr, settings, request_kwargs)
             
         else:
             # 单声道
@@ -64,9 +201,7 @@ def process_audio_hybrid(audio_file, processing_mode, enable_ai, ai_model, enhan
             # 计算音频时长
             audio_duration = len(audio) / sr
             
-            enhanced_audio, metadata = hybrid_enhancer.enhance_audio(
-                audio, sr, processing_mode, ai_model, enhancement_level, blend_ratio
-            )
+            (enhanced_audio, metadata), = _enhance_channels([audio], sr, [settings], [request_kwargs])
         
         # 保存处理后的音频
         with tempfile.NamedTemporaryFile(delete=False, suffix='.wav') as tmp_file:
@@ -109,6 +244,13 @@ def process_audio_hybrid(audio_file, processing_mode, enable_ai, ai_model, enhan
         # 使用混合处理器返回的显示文本
         blend_ratio_display = metadata.get('blend_ratio_display', '不适用')
         
+        # 立体声捷径说明
+        shortcut_display = {
+            "dual_mono_duplicated": "双单声道 (处理一次后复制)",
+            "mid_side": "高度相关 (中声道完整处理，侧声道快速处理)",
+            "none": "独立处理左右声道",
+        }.get(metadata.get('channel_shortcut'), "单声道")
+        
         process_details = f"""
 🔍 处理详情:
 • 原始采样率: {sr}Hz
@@ -119,15 +261,72 @@ def process_audio_hybrid(audio_file, processing_mode, enable_ai, ai_model, enhan
 • 传统处理: {traditional_used}
 • 传统增强级别: {enhancement_level}
 • 混合比例: {blend_ratio_display}
+• 声道处理: {shortcut_display}
         """
+        if metadata.get('profile'):
+            process_details += f"• 性能分析: {metadata['profile']['summary']}\n"
+        
+        if trace is not None:
+            trace.update(
+                outcome="success" if metadata.get("success", False) else "failed",
+                method_used=metadata.get("method_used"),
+                channel_shortcut=metadata.get("channel_shortcut"),
+                quality_gate_skipped=bool((metadata.get("quality_gate") or {}).get("skipped")),
+                stage_timings=metadata.get("stage_timings"),
+            )
         
         print("✅ 音频处理完成")
         return output_path, status_message, process_details
         
+    except JobCancelled:
+        if trace is not None:
+            trace["outcome"] = "cancelled"
+        raise
     except Exception as e:
         error_msg = f"❌ 处理过程中发生错误: {str(e)}"
         print(error_msg)
+        if trace is not None:
+            trace["error"] = str(e)
         return None, error_msg, ""
+    finally:
+        if trace is not None:
+            trace["latency"] = round(time.perf_counter() - start_time, 4)
+            trace_recorder.record(trace)
+
+def run_hybrid_job(audio_file, processing_mode, enable_ai, ai_model, enhancement_level, blend_ratio,
+                   quality_threshold=0.0, profile_request=False, progress=gr.Progress()):
+    """将处理请求提交到任务队列，回报进度；取消或客户端断开时终止任务"""
+    if audio_file is None:
+        yield None, "❌ 请上传音频文件", ""
+        return
+    
+    try:
+        job = job_manager.submit(
+            process_audio_hybrid, audio_file, processing_mode, enable_ai,
+            ai_model, enhancement_level, blend_ratio, quality_threshold, profile_request
+        )
+    except JobQueueFull as e:
+        yield None, f"❌ {str(e)}", ""
+        return
+    
+    try:
+        while not job.wait(0.5):
+            progress(job.progress, desc=job.stage)
+            # 每次yield都是Gradio取消请求的生效点
+            yield gr.update(), f"⏳ {job.stage} ({job.progress:.0%})", gr.update()
+        
+        if job.status == "done":
+            yield job.result
+        elif job.status == "expired":
+            yield None, f"⏰ 处理超时，已停止: {job.error}", ""
+        elif job.status == "cancelled":
+            yield None, "🛑 处理已取消", ""
+        else:
+            yield None, f"❌ 处理过程中发生错误: {job.error}", ""
+    finally:
+        # 生成器被关闭（取消/断开连接）时通知任务在下一个检查点停止
+        if not job.done:
+            job.cancel()
 
 def load_ai_model_interface(model_name):
     """加载AI模型的界面函数"""
@@ -264,7 +463,24 @@ def create_hybrid_demo():
                         info="仅在并行混合模式下生效"
                     )
                 
-                process_btn = gr.Button("🚀 开始处理", variant="primary", size="lg")
+                quality_threshold = gr.Slider(
+                    minimum=0.0,
+                    maximum=5.0,
+                    value=0.0,
+                    step=0.1,
+                    label="🎯 质量门限 (MOS)",
+                    info="输入质量评分达到该值时跳过增强处理，0表示关闭"
+                )
+                
+                profile_request = gr.Checkbox(
+                    label="🔬 性能分析",
+                    value=False,
+                    info="记录本次处理的cProfile与torch profiler追踪文件"
+                )
+                
+                with gr.Row():
+                    process_btn = gr.Button("🚀 开始处理", variant="primary", size="lg")
+                    cancel_btn = gr.Button("🛑 取消处理", variant="stop", size="lg")
             
             with gr.Column(scale=1):
                 gr.Markdown('<div class="section-header">ℹ️ 模式说明</div>')
@@ -344,12 +560,15 @@ def create_hybrid_demo():
             outputs=[model_info_display]
         )
         
-        process_btn.click(
-            fn=process_audio_hybrid,
-            inputs=[audio_input, processing_mode, enable_ai, ai_model, enhancement_level, blend_ratio],
+        process_event = process_btn.click(
+            fn=run_hybrid_job,
+            inputs=[audio_input, processing_mode, enable_ai, ai_model, enhancement_level, blend_ratio,
+                    quality_threshold, profile_request],
             outputs=[audio_output, processing_status, process_details]
         )
         
+        cancel_btn.click(fn=None, cancels=[process_event])
+        
         load_model_btn.click(
             fn=load_ai_model_interface,
             inputs=[ai_model],
@@ -397,9 +616,50 @@ def create_hybrid_demo():
     return demo
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="AI+传统混合音频增强系统")
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("AUDIOHD_WORKERS", "0")),
+                        help="工作进程数，0表示单进程模式 (环境变量 AUDIOHD_WORKERS)")
+    parser.add_argument("--preload", nargs="*", default=[],
+                        help="父进程中预加载并共享给工作进程的AI模型")
+    parser.add_argument("--max-jobs", type=int, default=0,
+                        help="同时运行的处理任务数，0表示与工作进程数一致")
+    parser.add_argument("--max-pending", type=int, default=int(os.environ.get("AUDIOHD_MAX_PENDING", "8")),
+                        help="排队等待的任务数上限，超出时拒绝新请求 (环境变量 AUDIOHD_MAX_PENDING)")
+    parser.add_argument("--job-timeout", type=float, default=float(os.environ.get("AUDIOHD_JOB_TIMEOUT", "1800")),
+                        help="单个任务的截止时间（秒），0表示不限制 (环境变量 AUDIOHD_JOB_TIMEOUT)")
+    parser.add_argument("--profile-sample", type=float, default=request_profiler.sample_rate,
+                        help="按比例抽样进行性能分析的请求占比，0表示只分析手动开启的请求 (环境变量 AUDIOHD_PROFILE_SAMPLE)")
+    parser.add_argument("--profile-dir", default=request_profiler.output_dir,
+                        help="性能分析文件输出目录 (环境变量 AUDIOHD_PROFILE_DIR)")
+    parser.add_argument("--trace-file", default=trace_recorder.path,
+                        help="逐请求追踪记录文件(JSONL)，用于replay.py回放压测 (环境变量 AUDIOHD_TRACE_FILE)")
+    args = parser.parse_args()
+    
+    trace_recorder.path = args.trace_file
+    
+    # 在分叉工作进程之前设置，子进程继承同样的配置
+    request_profiler.sample_rate = args.profile_sample
+    request_profiler.output_dir = args.profile_dir
+    
     print("🎵 启动AI+传统混合音频增强系统...")
     
+    if args.workers == 0 and host_profile.get("num_threads"):
+        from worker_pool import configure_threads
+        # 单进程模式使用本机调优得到的线程数（多进程模式按工作进程数均分核心）
+        configure_threads(host_profile["num_threads"])
+        print(f"🧵 按本机调优配置使用 {host_profile['num_threads']} 个线程")
+    
+    if args.workers > 0:
+        from worker_pool import EnhancementWorkerPool
+        # start()同步分叉全部工作进程，必须在Gradio启动线程之前调用
+        worker_pool = EnhancementWorkerPool(args.workers, args.preload)
+        worker_pool.start()
+    
+    max_jobs = args.max_jobs or (worker_pool.num_workers if worker_pool is not None else 1)
+    job_manager = JobManager(max_jobs, args.max_pending, args.job_timeout or None)
+    
     demo = create_hybrid_demo()
+    demo.queue(default_concurrency_limit=job_manager.capacity)
     demo.launch(
         server_name="0.0.0.0",
         server_port=7860,
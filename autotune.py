@@ -0,0 +1,205 @@
+import argparse
+import contextlib
+import os
+import socket
+import time
+import numpy as np
+from typing import Callable, List, Optional
+from ai_models import ai_enhancer
+from hybrid_enhancer import hybrid_enhancer
+from segment_parallel import enhance_long_audio, DEFAULT_SEGMENT_SECONDS
+from worker_pool import EnhancementWorkerPool, configure_threads
+from evaluation import build_cases, si_sdr
+from host_profile import default_profile_path, save_host_profile
+from dsp_utils import as_float32
+import warnings
+warnings.filterwarnings("ignore")
+
+# STFT候选参数：n_fft取2的幂及3·2^k等FFT友好长度，帧移为窗长的1/4或1/2
+SPEECHBRAIN_STFT_CANDIDATES = [
+    {"n_fft": n_fft, "hop_length": n_fft // divisor, "win_length": n_fft}
+    for n_fft in (512, 768, 1024, 1536, 2048) for divisor in (4, 2)
+]
+# RNNoise的n_fft由RNN的512维输入固定为1024，只调整帧移和窗长
+RNNOISE_STFT_CANDIDATES = [
+    {"n_fft": 1024, "hop_length": hop_length, "win_length": win_length}
+    for win_length in (768, 1024) for hop_length in (256, 320, 384, 512) if hop_length <= win_length // 2
+]
+SEGMENT_SECONDS_CANDIDATES = [10.0, 20.0, 30.0, 60.0]
+
+# 线程数校准使用的处理配置
+CALIBRATION_SETTINGS = {"processing_mode": "ai_then_traditional", "ai_model": "rnnoise",
+                        "enhancement_level": "medium", "normalization": "none"}
+
+
+def thread_candidates(cpu_count: Optional[int] = None) -> List[int]:
+    """候选线程数：1, 2, 4, ... 直到CPU核心数（含核心数本身）"""
+    cpu_count = cpu_count or os.cpu_count() or 1
+    candidates, n = [], 1
+    while n < cpu_count:
+        candidates.append(n)
+        n *= 2
+    return candidates + [cpu_count]
+
+
+def _measure(fn: Callable[[dict], np.ndarray], cases: List[dict], repeats: int) -> dict:
+    """运行所有样例，返回最短总耗时与相对干净参考的平均SI-SDR"""
+    best_time, outputs = float("inf"), None
+    for _ in range(repeats):
+        # 校准期间屏蔽处理过程的日志输出
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            start = time.perf_counter()
+            results = [fn(case) for case in cases]
+            elapsed = time.perf_counter() - start
+        if elapsed < best_time:
+            best_time, outputs = elapsed, results
+
+    scores = [si_sdr(case["clean"][:len(output)], as_float32(output)[:len(case["clean"])])
+              for case, output in zip(cases, outputs)]
+    return {"time_s": round(best_time, 4), "si_sdr": round(float(np.mean(scores)), 3)}
+
+
+def _pick(measurements: List[dict], baseline: dict, max_quality_loss: float) -> dict:
+    """在相对基线质量损失不超过阈值的候选中选最快的一个"""
+    acceptable = [row for row in measurements if row["si_sdr"] >= baseline["si_sdr"] - max_quality_loss]
+    return min(acceptable or [baseline], key=lambda row: row["time_s"])
+
+
+def tune_threads(cases: List[dict], sr: int, repeats: int) -> dict:
+    """搜索torch/BLAS线程数（线程数只影响速度，不影响结果）"""
+    run = lambda case: hybrid_enhancer.enhance_audio(case["noisy"], sr, profile=False, **CALIBRATION_SETTINGS)[0]
+    measurements = []
+    for num_threads in thread_candidates():
+        configure_threads(num_threads)
+        row = dict(_measure(run, cases, repeats), num_threads=num_threads)
+        print(f"🧵 {num_threads} 线程: {row['time_s']:.3f}s")
+        measurements.append(row)
+    best = min(measurements, key=lambda row: row["time_s"])
+    configure_threads(best["num_threads"])
+    return {"best": best["num_threads"], "measurements": measurements}
+
+
+def tune_stft(model_name: str, candidates: List[dict], cases: List[dict], sr: int,
+              repeats: int, max_quality_loss: float) -> dict:
+    """搜索单个模型的STFT参数，第一个候选前先测当前默认值作为质量基线"""
+    if not ai_enhancer.is_model_loaded(model_name) and not ai_enhancer.download_and_load_model(model_name):
+        print(f"⚠️ 模型 {model_name} 加载失败，跳过STFT调优")
+        return {}
+
+    default = dict(ai_enhancer.stft_params[model_name])
+    run = lambda case: ai_enhancer.enhance_audio(case["noisy"], sr, model_name)
+    measurements = []
+    try:
+        for params in [default] + [p for p in candidates if p != default]:
+            ai_enhancer.stft_params[model_name] = dict(params)
+            row = dict(_measure(run, cases, repeats), **params)
+            print(f"📐 {model_name} n_fft={params['n_fft']} hop={params['hop_length']} "
+                  f"win={params['win_length']}: {row['time_s']:.3f}s, SI-SDR {row['si_sdr']:.2f} dB")
+            measurements.append(row)
+    finally:
+        ai_enhancer.stft_params[model_name] = default
+
+    best = _pick(measurements, measurements[0], max_quality_loss)
+    return {"best": {key: best[key] for key in ("n_fft", "hop_length", "win_length")},
+            "measurements": measurements}
+
+
+def tune_segments(cases: List[dict], sr: int, repeats: int, max_quality_loss: float,
+                  worker_pool: Optional[EnhancementWorkerPool] = None) -> dict:
+    """在指定执行后端上搜索长音频分段时长，基线为默认的30秒分段
+
+    worker_pool为None时测量单进程服务使用的线程池后端，否则测量多进程服务的工作进程池后端。
+    """
+    backend = "process_pool" if worker_pool is not None else "thread_pool"
+    measurements = []
+    for seconds in [DEFAULT_SEGMENT_SECONDS] + [s for s in SEGMENT_SECONDS_CANDIDATES if s != DEFAULT_SEGMENT_SECONDS]:
+        run = lambda case: enhance_long_audio(case["noisy"], sr, segment_seconds=seconds, worker_pool=worker_pool,
+                                              profile=False, **CALIBRATION_SETTINGS)[0]
+        row = dict(_measure(run, cases, repeats), segment_seconds=seconds)
+        print(f"✂️ 分段 {seconds:g}s ({backend}): {row['time_s']:.3f}s, SI-SDR {row['si_sdr']:.2f} dB")
+        measurements.append(row)
+    best = _pick(measurements, measurements[0], max_quality_loss)
+    return {"best": best["segment_seconds"], "measurements": measurements}
+
+
+def run_autotune(sr: int = 16000, seconds: float = 4.0, long_seconds: float = 120.0,
+                 repeats: int = 3, max_quality_loss: float = 0.5, workers: int = 0) -> dict:
+    """在本机运行校准负载，返回可直接保存的调优配置
+
+    workers: 与服务的 --workers 一致；大于0时另外在同样规模的工作进程池上调优分段时长
+    """
+    # 关闭节点缓存，保证重复运行都是真实计算（在分叉工作进程之前设置，子进程继承）
+    hybrid_enhancer.graph_executor.cache_size = 0
+    hybrid_enhancer.graph_executor.clear_cache()
+    if not ai_enhancer.is_model_loaded("rnnoise"):
+        ai_enhancer.download_and_load_model("rnnoise")
+
+    # 工作进程必须在任何校准计算之前分叉
+    worker_pool = None
+    if workers > 0:
+        worker_pool = EnhancementWorkerPool(workers, ["rnnoise"])
+        worker_pool.start()
+
+    cases = build_cases(sr, snrs=[5.0], seconds=seconds)
+    # 长音频样例由短样例循环拼接，用于分段时长调优
+    long_cases = [{"clean": np.resize(case["clean"], int(long_seconds * sr)),
+                   "noisy": np.resize(case["noisy"], int(long_seconds * sr))} for case in cases[:1]]
+
+    print(f"🎛️ 本机自动调优: {socket.gethostname()}，{os.cpu_count()} 核，"
+          f"允许质量损失 {max_quality_loss} dB")
+    try:
+        threads = tune_threads(cases, sr, repeats)
+        stft = {
+            "rnnoise": tune_stft("rnnoise", RNNOISE_STFT_CANDIDATES, cases, sr, repeats, max_quality_loss),
+            "speechbrain_enhance": tune_stft("speechbrain_enhance", SPEECHBRAIN_STFT_CANDIDATES,
+                                             cases, sr, repeats, max_quality_loss),
+        }
+        # 分段时长按执行后端分别调优（两种后端都使用调优前的STFT参数）
+        segments = {"thread_pool": tune_segments(long_cases, sr, repeats, max_quality_loss)}
+        if worker_pool is not None:
+            segments["process_pool"] = tune_segments(long_cases, sr, repeats, max_quality_loss, worker_pool)
+    finally:
+        if worker_pool is not None:
+            worker_pool.shutdown()
+
+    return {
+        "host": socket.gethostname(),
+        "cpu_count": os.cpu_count(),
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "max_quality_loss_db": max_quality_loss,
+        "num_threads": threads["best"],
+        "stft": {name: result["best"] for name, result in stft.items() if result},
+        "workers": workers,
+        "segment_seconds": {backend: result["best"] for backend, result in segments.items()},
+        "measurements": {
+            "threads": threads["measurements"],
+            "stft": {name: result["measurements"] for name, result in stft.items() if result},
+            "segment_seconds": {backend: result["measurements"] for backend, result in segments.items()},
+        },
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="本机自动调优：线程数、STFT参数与长音频分段时长")
+    parser.add_argument("--output", default=default_profile_path(),
+                        help="调优配置保存路径，默认按主机名保存 (环境变量 AUDIOHD_HOST_PROFILE)")
+    parser.add_argument("--max-quality-loss", type=float, default=0.5,
+                        help="相对默认参数允许的SI-SDR下降(dB)")
+    parser.add_argument("--sr", type=int, default=16000, help="校准采样率")
+    parser.add_argument("--seconds", type=float, default=4.0, help="每个校准样例的时长（秒）")
+    parser.add_argument("--long-seconds", type=float, default=120.0, help="分段调优使用的长音频时长（秒）")
+    parser.add_argument("--repeats", type=int, default=3, help="每个候选重复次数，取最短耗时")
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("AUDIOHD_WORKERS", "0")),
+                        help="服务使用的工作进程数，大于0时另在工作进程池上调优分段时长 (环境变量 AUDIOHD_WORKERS)")
+    args = parser.parse_args()
+
+    profile = run_autotune(args.sr, args.seconds, args.long_seconds, args.repeats, args.max_quality_loss,
+                           args.workers)
+    path = save_host_profile(profile, args.output)
+    print()
+    print(f"🧵 线程数: {profile['num_threads']}")
+    for model_name, params in profile["stft"].items():
+        print(f"📐 {model_name}: n_fft={params['n_fft']} hop={params['hop_length']} win={params['win_length']}")
+    for backend, seconds in profile["segment_seconds"].items():
+        print(f"✂️ 分段时长 ({backend}): {seconds:g}s")
+    print(f"💾 本机调优配置已保存: {path}（服务启动时自动加载）")
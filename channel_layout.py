@@ -0,0 +1,60 @@
+import numpy as np
+from typing import Tuple
+from dsp_utils import as_float32, peak_abs
+
+# 两声道差值峰值低于该比例（相对峰值，约-60dB）视为双单声道
+DUAL_MONO_TOLERANCE = 1e-3
+
+# 相关系数高于该值且侧声道能量低于中声道该dB数时按中/侧声道处理
+CORRELATION_THRESHOLD = 0.98
+SIDE_RATIO_DB = -30.0
+# 侧/中能量比的下限（双单声道没有侧声道），保证元数据可按标准JSON序列化
+SIDE_RATIO_FLOOR_DB = -120.0
+
+
+def analyze_channel_layout(left: np.ndarray, right: np.ndarray) -> dict:
+    """廉价的声道间相关性检测，判断立体声是否可以走捷径
+
+    layout: dual_mono（相同声道，处理一次后复制）、mid_side（高度相关，
+    中声道完整处理、侧声道走廉价路径）或 independent（分别处理）。
+    """
+    left, right = as_float32(left), as_float32(right)
+    peak = max(peak_abs(left), peak_abs(right))
+    info = {"layout": "independent", "correlation": None, "side_ratio_db": None}
+    if len(left) != len(right) or not np.isfinite(peak):
+        return info
+
+    if peak_abs(left - right) <= DUAL_MONO_TOLERANCE * peak:
+        info.update(layout="dual_mono", correlation=1.0, side_ratio_db=SIDE_RATIO_FLOOR_DB)
+        return info
+
+    # 三个内积即可得到相关系数和中/侧声道能量
+    ll, rr, lr = float(np.dot(left, left)), float(np.dot(right, right)), float(np.dot(left, right))
+    correlation = lr / np.sqrt(ll * rr) if ll > 0 and rr > 0 else 0.0
+    mid_energy = (ll + rr + 2 * lr) / 4
+    side_energy = max((ll + rr - 2 * lr) / 4, 0.0)
+    side_ratio_db = max(10 * np.log10((side_energy + 1e-12) / (mid_energy + 1e-12)), SIDE_RATIO_FLOOR_DB)
+    info.update(correlation=round(float(correlation), 4), side_ratio_db=round(float(side_ratio_db), 1))
+
+    if correlation >= CORRELATION_THRESHOLD and side_ratio_db <= SIDE_RATIO_DB:
+        info["layout"] = "mid_side"
+    return info
+
+
+def to_mid_side(left: np.ndarray, right: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """左右声道转换为中/侧声道"""
+    left, right = as_float32(left), as_float32(right)
+    mid = left + right
+    mid *= np.float32(0.5)
+    side = left - right
+    side *= np.float32(0.5)
+    return mid, side
+
+
+def from_mid_side(mid: np.ndarray, side: np.ndarray) -> np.ndarray:
+    """中/侧声道还原为 (2, n) 的左右声道"""
+    length = min(len(mid), len(side))
+    stereo = np.empty((2, length), dtype=np.float32)
+    np.add(mid[:length], side[:length], out=stereo[0])
+    np.subtract(mid[:length], side[:length], out=stereo[1])
+    return stereo
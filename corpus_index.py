@@ -0,0 +1,322 @@
+import argparse
+import hashlib
+import heapq
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import numpy as np
+import librosa
+import soundfile as sf
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+from hybrid_enhancer import hybrid_enhancer
+from dsp_utils import as_float32
+import warnings
+warnings.filterwarnings("ignore")
+
+AUDIO_EXTENSIONS = (".wav", ".flac", ".mp3", ".ogg", ".m4a")
+
+# 尚无实测数据时各模式的初始实时率估计（处理秒数 / 每声道音频秒数）
+DEFAULT_REALTIME_FACTORS = {
+    "traditional_only": 0.05,
+    "ai_only": 0.10,
+    "ai_then_traditional": 0.15,
+    "traditional_then_ai": 0.15,
+    "parallel_blend": 0.15,
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    hash TEXT PRIMARY KEY,
+    duration REAL,
+    sample_rate INTEGER,
+    channels INTEGER,
+    features TEXT,
+    adaptive_mode TEXT,
+    indexed_at REAL
+);
+CREATE TABLE IF NOT EXISTS paths (
+    path TEXT PRIMARY KEY,
+    size INTEGER,
+    mtime REAL,
+    hash TEXT
+);
+CREATE TABLE IF NOT EXISTS runs (
+    hash TEXT,
+    mode TEXT,
+    audio_seconds REAL,
+    runtime REAL,
+    recorded_at REAL
+);
+CREATE INDEX IF NOT EXISTS runs_mode ON runs (mode);
+"""
+
+
+def file_hash(path: str, chunk_size: int = 1 << 20) -> str:
+    """文件内容哈希，作为索引主键（同一内容换路径或改名也能命中）"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def find_audio_files(directory: str) -> List[str]:
+    """递归查找目录下的音频文件"""
+    found = []
+    for root, _, names in os.walk(directory):
+        found.extend(os.path.join(root, name) for name in names if name.lower().endswith(AUDIO_EXTENSIONS))
+    return sorted(found)
+
+
+class CorpusIndex:
+    """语料特征索引 - 以文件哈希为键持久化时长、采样率、声道数与特征分析结果
+
+    批处理据此跳过重复分析、预测每个文件的处理成本，并做最长优先调度。
+    """
+
+    def __init__(self, path: str = "corpus_index.sqlite"):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+
+    def close(self):
+        self._conn.close()
+
+    def _resolve_hash(self, path: str) -> str:
+        """按 (路径, 大小, 修改时间) 复用已计算的哈希，文件未变时不必重读"""
+        stat = os.stat(path)
+        with self._lock:
+            row = self._conn.execute("SELECT size, mtime, hash FROM paths WHERE path = ?", (path,)).fetchone()
+        if row is not None and row[0] == stat.st_size and row[1] == stat.st_mtime:
+            return row[2]
+
+        digest = file_hash(path)
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO paths VALUES (?, ?, ?, ?)",
+                               (path, stat.st_size, stat.st_mtime, digest))
+        return digest
+
+    def lookup(self, digest: str) -> Optional[dict]:
+        """按哈希查询索引条目"""
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM files WHERE hash = ?", (digest,)).fetchone()
+        if row is None:
+            return None
+        return {
+            "hash": row[0],
+            "duration": row[1],
+            "sample_rate": row[2],
+            "channels": row[3],
+            "features": json.loads(row[4]),
+            "adaptive_mode": row[5],
+        }
+
+    def index_file(self, path: str) -> dict:
+        """索引单个文件；已索引的内容直接返回，不重新分析"""
+        digest = self._resolve_hash(path)
+        entry = self.lookup(digest)
+        if entry is not None:
+            return dict(entry, path=path)
+
+        audio, sr = librosa.load(path, sr=None, mono=False)
+        channels = [as_float32(audio)] if audio.ndim == 1 else [as_float32(c) for c in audio]
+        # 每个声道单独分析，与实际增强时逐声道处理保持一致
+        features = [hybrid_enhancer._analyze_audio_features(channel, sr) for channel in channels]
+        features = [{key: float(value) for key, value in f.items()} for f in features]
+        adaptive_mode = hybrid_enhancer.choose_adaptive_strategy(features[0])[0]
+
+        entry = {
+            "hash": digest,
+            "duration": len(channels[0]) / sr,
+            "sample_rate": sr,
+            "channels": len(channels),
+            "features": features,
+            "adaptive_mode": adaptive_mode,
+        }
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (digest, entry["duration"], sr, entry["channels"], json.dumps(features), adaptive_mode, time.time())
+            )
+        return dict(entry, path=path)
+
+    def index_files(self, paths: List[str], num_workers: int = 4) -> List[dict]:
+        """并行索引多个文件（分析时间主要在librosa/NumPy中，可释放GIL）"""
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            entries = list(executor.map(self.index_file, paths))
+        print(f"🗂️ 已索引 {len(entries)} 个文件")
+        return entries
+
+    def record_run(self, digest: str, mode: str, audio_seconds: float, runtime: float):
+        """记录一次实际处理耗时，用于校准成本模型"""
+        with self._lock, self._conn:
+            self._conn.execute("INSERT INTO runs VALUES (?, ?, ?, ?, ?)",
+                               (digest, mode, audio_seconds, runtime, time.time()))
+
+    def realtime_factors(self) -> Dict[str, float]:
+        """各模式的实时率：有实测数据时用实测总耗时/总音频时长，否则用初始估计"""
+        factors = dict(DEFAULT_REALTIME_FACTORS)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT mode, SUM(runtime), SUM(audio_seconds) FROM runs GROUP BY mode"
+            ).fetchall()
+        for mode, runtime, seconds in rows:
+            if seconds:
+                factors[mode] = runtime / seconds
+        return factors
+
+
+def route_mode(entry: dict, processing_mode: str) -> str:
+    """文件实际走的处理模式（自适应模式按索引中的特征预先决定）"""
+    return entry["adaptive_mode"] if processing_mode == "adaptive_hybrid" else processing_mode
+
+
+def predict_cost(entry: dict, processing_mode: str, factors: Dict[str, float]) -> float:
+    """预测处理耗时（秒）：实时率 × 时长 × 声道数"""
+    mode = route_mode(entry, processing_mode)
+    return factors.get(mode, max(factors.values())) * entry["duration"] * entry["channels"]
+
+
+def plan_batch(entries: List[dict], processing_mode: str, factors: Dict[str, float]) -> List[dict]:
+    """按预测耗时从长到短排列的共享任务队列（最长处理时间优先，LPT）
+
+    不预先把文件固定分给某个工作者：空闲的工作者从队首取下一个最长的文件，
+    预测偏差只影响取到的顺序，不会出现尾部一个工作者还排着队、其他工作者已空闲的情况。
+    """
+    tasks = [dict(entry, mode=route_mode(entry, processing_mode),
+                  cost=predict_cost(entry, processing_mode, factors)) for entry in entries]
+    tasks.sort(key=lambda task: task["cost"], reverse=True)
+    return tasks
+
+
+def predict_loads(tasks: List[dict], num_workers: int) -> List[float]:
+    """按预测耗时模拟共享队列调度，返回各工作者的预测负载（用于估算总耗时）"""
+    loads = [0.0] * max(1, num_workers)
+    heapq.heapify(loads)
+    for task in tasks:
+        heapq.heapreplace(loads, loads[0] + task["cost"])
+    return sorted(loads, reverse=True)
+
+
+def _process_task(task: dict, output_dir: str, input_root: str, enhance_fn, processing_mode: str,
+                  settings: dict, index: CorpusIndex) -> dict:
+    """处理一个文件：使用索引中的特征跳过重复分析，写出结果并记录耗时"""
+    start = time.perf_counter()
+    audio, sr = librosa.load(task["path"], sr=None, mono=False)
+    channels = [audio] if audio.ndim == 1 else list(audio)
+
+    outputs, success = [], True
+    for channel, features in zip(channels, task["features"]):
+        # 自适应模式仍按原模式调用，由传入的特征重新选择策略（不再重复分析）
+        enhanced, metadata = enhance_fn(channel, sr, processing_mode, features=features, **settings)
+        outputs.append(enhanced)
+        success = success and metadata.get("success", False)
+    enhanced = outputs[0] if len(outputs) == 1 else np.stack(outputs)
+
+    relative = os.path.relpath(task["path"], input_root)
+    output_path = os.path.join(output_dir, os.path.splitext(relative)[0] + ".wav")
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    sf.write(output_path, enhanced.T, sr)
+
+    runtime = time.perf_counter() - start
+    index.record_run(task["hash"], task["mode"], task["duration"] * task["channels"], runtime)
+    return {"path": task["path"], "output": output_path, "success": success,
+            "predicted": task["cost"], "runtime": runtime}
+
+
+def run_batch(paths: List[str], output_dir: str, input_root: str, index: CorpusIndex,
+              processing_mode: str = "adaptive_hybrid", num_workers: int = 4,
+              worker_pool=None, **settings) -> dict:
+    """按索引规划并执行批处理
+
+    各工作者线程从共享队列中依次取出最长的剩余文件；提供worker_pool时增强在工作进程中执行。
+    """
+    entries = index.index_files(paths, num_workers)
+    factors = index.realtime_factors()
+    tasks = plan_batch(entries, processing_mode, factors)
+    num_workers = max(1, min(num_workers, len(tasks)))
+    predicted = predict_loads(tasks, num_workers)
+    print(f"📋 批处理计划: {len(entries)} 个文件，{num_workers} 个工作者，"
+          f"预测最长负载 {max(predicted):.1f}秒 / 平均 {np.mean(predicted):.1f}秒")
+
+    enhance_fn = worker_pool.enhance_audio if worker_pool is not None else hybrid_enhancer.enhance_audio
+    pending = queue.SimpleQueue()
+    for task in tasks:
+        pending.put(task)
+
+    def work():
+        results = []
+        while True:
+            try:
+                task = pending.get_nowait()
+            except queue.Empty:
+                return results
+            results.append(_process_task(task, output_dir, input_root, enhance_fn, processing_mode, settings, index))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        futures = [executor.submit(work) for _ in range(num_workers)]
+        results = [result for future in futures for result in future.result()]
+    makespan = time.perf_counter() - start
+
+    busy = sum(result["runtime"] for result in results)
+    summary = {
+        "files": len(results),
+        "failed": sum(not result["success"] for result in results),
+        "makespan": makespan,
+        "predicted_makespan": max(predicted),
+        "utilization": busy / (makespan * num_workers) if makespan > 0 else 0.0,
+        "results": results,
+    }
+    print(f"✅ 批处理完成: {summary['files']} 个文件，耗时 {makespan:.1f}秒 "
+          f"(预测 {summary['predicted_makespan']:.1f}秒)，工作者利用率 {summary['utilization']:.0%}")
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="语料特征索引与批处理调度")
+    parser.add_argument("command", choices=["index", "plan", "run"])
+    parser.add_argument("input_dir", help="音频文件目录")
+    parser.add_argument("output_dir", nargs="?", help="增强结果输出目录（run）")
+    parser.add_argument("--index", default="corpus_index.sqlite", help="索引数据库路径")
+    parser.add_argument("--mode", default="adaptive_hybrid", help="处理模式")
+    parser.add_argument("--ai-model", default="facebook_denoiser")
+    parser.add_argument("--level", default="medium")
+    parser.add_argument("--blend-ratio", type=float, default=0.5)
+    parser.add_argument("--workers", type=int, default=4, help="并行工作者数")
+    parser.add_argument("--pool", action="store_true", help="使用多进程工作池执行增强")
+    args = parser.parse_args()
+
+    index = CorpusIndex(args.index)
+    paths = find_audio_files(args.input_dir)
+
+    if args.command == "index":
+        index.index_files(paths, args.workers)
+    elif args.command == "plan":
+        entries = index.index_files(paths, args.workers)
+        tasks = plan_batch(entries, args.mode, index.realtime_factors())
+        loads = predict_loads(tasks, args.workers)
+        print(f"📋 共享队列: {len(tasks)} 个文件，{len(loads)} 个工作者预测负载 "
+              + " / ".join(f"{load:.1f}秒" for load in loads))
+        for task in tasks:
+            print(f"   {task['cost']:8.1f}秒  {task['mode']:<22} {task['path']}")
+    else:
+        if not args.output_dir:
+            parser.error("run 需要指定 output_dir")
+        pool = None
+        if args.pool:
+            from worker_pool import EnhancementWorkerPool
+            pool = EnhancementWorkerPool(args.workers)
+            pool.start()
+        try:
+            run_batch(paths, args.output_dir, args.input_dir, index, args.mode, args.workers, pool,
+                      ai_model=args.ai_model, enhancement_level=args.level, blend_ratio=args.blend_ratio)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+    index.close()
@@ -0,0 +1,192 @@
+import io
+import os
+import numpy as np
+import librosa
+import soundfile as sf
+from functools import partial
+from typing import List, Optional
+from ai_models import ai_enhancer
+from hybrid_enhancer import hybrid_enhancer
+from worker_pool import compute_threads_per_worker, configure_threads
+from dsp_utils import as_float32
+import warnings
+warnings.filterwarnings("ignore")
+
+try:
+    from datasets import Audio, Dataset, IterableDataset, Value
+    from datasets.fingerprint import Hasher
+    import pyarrow.parquet as pq
+except ImportError:  # datasets为可选依赖，仅批量处理需要
+    Audio = Dataset = IterableDataset = Value = Hasher = pq = None
+
+# 已完成初始化的进程（线程数设置与模型加载每个进程只做一次）
+_prepared_pid = None
+
+
+def _require_datasets():
+    if Dataset is None:
+        raise ImportError("批量数据集处理需要安装 datasets: pip install datasets")
+
+
+def _prepare_process(num_threads: int, processing_mode: str, ai_model: str):
+    """每个map进程第一次处理批次时设置线程数并加载模型"""
+    global _prepared_pid
+    if _prepared_pid == os.getpid():
+        return
+    configure_threads(num_threads)
+    if processing_mode != "traditional_only" and not ai_enhancer.is_model_loaded(ai_model):
+        ai_enhancer.download_and_load_model(ai_model)
+    _prepared_pid = os.getpid()
+
+
+def _decode(value: dict):
+    """解码未解码的Audio列（bytes/path）或已是数组的样本，返回 (音频, 采样率)"""
+    if value.get("array") is not None:
+        return as_float32(value["array"]), value["sampling_rate"]
+    if value.get("bytes"):
+        audio, sr = sf.read(io.BytesIO(value["bytes"]), dtype="float32")
+        return audio.T, sr
+    audio, sr = librosa.load(value["path"], sr=None, mono=False)
+    return as_float32(audio), sr
+
+
+def _encode(audio: np.ndarray, sr: int) -> dict:
+    """在内存中编码为32位浮点WAV，直接作为Arrow中Audio列的bytes存储"""
+    buffer = io.BytesIO()
+    sf.write(buffer, audio.T, sr, format="WAV", subtype="FLOAT")
+    return {"bytes": buffer.getvalue(), "path": None}
+
+
+def _enhance_batch(batch: dict, audio_column: str, output_column: str,
+                   settings: dict, num_threads: int) -> dict:
+    """datasets批处理函数：逐条增强并写回新的音频列"""
+    _prepare_process(num_threads, settings["processing_mode"], settings["ai_model"])
+
+    outputs, methods, successes = [], [], []
+    for value in batch[audio_column]:
+        audio, sr = _decode(value)
+        if audio.ndim > 1:
+            # 多声道逐声道增强
+            results = [hybrid_enhancer.enhance_audio(channel, sr, **settings) for channel in audio]
+            enhanced = np.stack([result[0] for result in results])
+            metadata = results[0][1]
+        else:
+            enhanced, metadata = hybrid_enhancer.enhance_audio(audio, sr, **settings)
+        outputs.append(_encode(enhanced, sr))
+        methods.append(metadata.get("method_used", metadata.get("error", "")))
+        successes.append(bool(metadata.get("success", False)))
+
+    return {output_column: outputs, "enhancement_method": methods, "enhancement_success": successes}
+
+
+def enhance_dataset(dataset, audio_column: str = "audio", output_column: str = "enhanced_audio",
+                    processing_mode: str = "adaptive_hybrid",
+                    ai_model: str = "facebook_denoiser",
+                    enhancement_level: str = "medium",
+                    blend_ratio: float = 0.5,
+                    normalization: str = "loudness",
+                    batch_size: int = 8,
+                    num_proc: Optional[int] = None,
+                    cache_dir: Optional[str] = None):
+    """对datasets数据集批量增强，结果作为Arrow中的Audio列写回
+
+    Dataset: 通过批量map并行处理（num_proc个进程），结果缓存为Arrow文件；
+    指定cache_dir后，中断的任务重新运行时会直接加载已完成的分片缓存。
+    IterableDataset（流式模式）: 返回惰性映射的数据集，适合超出内存的语料，
+    需要落盘和断点续跑时使用 enhance_streaming_to_shards。
+    """
+    _require_datasets()
+    settings = {
+        "processing_mode": processing_mode,
+        "ai_model": ai_model,
+        "enhancement_level": enhancement_level,
+        "blend_ratio": blend_ratio,
+        "normalization": normalization,
+    }
+    num_threads = compute_threads_per_worker(num_proc or 1)
+
+    # 关闭输入列的解码，由本模块解码，避免依赖datasets版本相关的音频后端
+    dataset = dataset.cast_column(audio_column, Audio(decode=False))
+    fn = partial(_enhance_batch, audio_column=audio_column, output_column=output_column,
+                 settings=settings, num_threads=num_threads)
+
+    if isinstance(dataset, IterableDataset):
+        # 流式数据集需显式声明输出列类型：先按Audio的存储结构输出，再转换为Audio列
+        features = None
+        if dataset.features is not None:
+            features = dataset.features.copy()
+            features[output_column] = {"bytes": Value("binary"), "path": Value("string")}
+            features["enhancement_method"] = Value("string")
+            features["enhancement_success"] = Value("bool")
+        enhanced = dataset.map(fn, batched=True, batch_size=batch_size, features=features)
+        return enhanced.cast_column(output_column, Audio()) if features is not None else enhanced
+
+    # fork启动的map进程直接继承父进程已加载的模型
+    if processing_mode != "traditional_only" and not ai_enhancer.is_model_loaded(ai_model):
+        ai_enhancer.download_and_load_model(ai_model)
+
+    # 指纹只由输入数据与处理参数决定，保证重新运行时能命中缓存
+    fingerprint = Hasher.hash([dataset._fingerprint, audio_column, output_column, settings])
+    cache_file_name = None
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        cache_file_name = os.path.join(cache_dir, f"enhanced-{fingerprint}.arrow")
+
+    print(f"📦 批量增强数据集: {len(dataset)} 条，{num_proc or 1} 个进程 × {num_threads} 线程")
+    enhanced = dataset.map(
+        fn, batched=True, batch_size=batch_size, num_proc=num_proc,
+        cache_file_name=cache_file_name, load_from_cache_file=True,
+        new_fingerprint=fingerprint, desc="音频增强"
+    )
+    return enhanced.cast_column(audio_column, Audio()).cast_column(output_column, Audio())
+
+
+def _write_shard(rows: dict, audio_column: str, output_column: str, path: str):
+    """原子写入一个Parquet分片（先写临时文件再重命名）"""
+    shard = Dataset.from_dict(rows)
+    shard = shard.cast_column(audio_column, Audio()).cast_column(output_column, Audio())
+    tmp_path = path + ".tmp"
+    shard.to_parquet(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def enhance_streaming_to_shards(dataset, output_dir: str, shard_size: int = 500,
+                                audio_column: str = "audio", output_column: str = "enhanced_audio",
+                                batch_size: int = 8, **settings) -> List[str]:
+    """流式增强数据集并按分片写入Parquet，可断点续跑
+
+    已完成的分片不会重复处理：重新运行时按已有分片Parquet元数据中的行数跳过样本，
+    与上次运行使用的shard_size无关。
+    返回全部分片路径，可用 load_dataset("parquet", data_files=...) 加载。
+    """
+    _require_datasets()
+    os.makedirs(output_dir, exist_ok=True)
+    shard_path = lambda index: os.path.join(output_dir, f"shard-{index:05d}.parquet")
+
+    done, processed = 0, 0
+    while os.path.exists(shard_path(done)):
+        processed += pq.read_metadata(shard_path(done)).num_rows
+        done += 1
+    if done:
+        print(f"⏩ 已有 {done} 个分片，跳过 {processed} 条样本")
+        dataset = dataset.skip(processed)
+
+    enhanced = enhance_dataset(dataset, audio_column, output_column, batch_size=batch_size, **settings)
+    # 分片中直接保存编码后的bytes，不在这里解码
+    enhanced = enhanced.cast_column(audio_column, Audio(decode=False))
+    enhanced = enhanced.cast_column(output_column, Audio(decode=False))
+
+    index, rows = done, {}
+    for example in enhanced:
+        for key, value in example.items():
+            rows.setdefault(key, []).append(value)
+        if len(rows[output_column]) >= shard_size:
+            _write_shard(rows, audio_column, output_column, shard_path(index))
+            print(f"💾 分片 {index} 已写入")
+            index, rows = index + 1, {}
+    if rows:
+        _write_shard(rows, audio_column, output_column, shard_path(index))
+        index += 1
+
+    print(f"✅ 流式增强完成: {index} 个分片")
+    return [shard_path(i) for i in range(index)]
@@ -0,0 +1,26 @@
+import numpy as np
+
+
+def as_float32(audio: np.ndarray) -> np.ndarray:
+    """转换为float32数组，已是float32时不复制"""
+    return np.asarray(audio, dtype=np.float32)
+
+
+def peak_abs(audio: np.ndarray) -> float:
+    """不分配临时数组地计算峰值绝对值
+
+    max/min会传播NaN和Inf，因此返回值非有限即表示音频包含无效数值，
+    可以替代单独的 np.isfinite(audio).all() 扫描。
+    """
+    if audio.size == 0:
+        return 0.0
+    return float(np.maximum(np.max(audio), -np.min(audio)))
+
+
+def scale_owned(audio: np.ndarray, scale: float, source: np.ndarray) -> np.ndarray:
+    """按比例缩放音频；若与输入source无共享内存则原地修改，否则返回新数组"""
+    scale = np.float32(scale)
+    if np.may_share_memory(audio, source) or not audio.flags.writeable:
+        return audio * scale
+    audio *= scale
+    return audio
@@ -0,0 +1,263 @@
+import argparse
+import csv
+import json
+import time
+import tracemalloc
+import numpy as np
+import librosa
+from typing import Dict, List, Optional
+from hybrid_enhancer import hybrid_enhancer
+from dsp_utils import as_float32
+import warnings
+warnings.filterwarnings("ignore")
+
+# 默认评估的处理配置（enhance_audio的关键字参数）
+DEFAULT_CONFIGS = [
+    {"processing_mode": "traditional_only", "enhancement_level": "basic"},
+    {"processing_mode": "traditional_only", "enhancement_level": "medium"},
+    {"processing_mode": "ai_only", "ai_model": "rnnoise"},
+    {"processing_mode": "ai_then_traditional", "ai_model": "rnnoise", "enhancement_level": "basic"},
+    {"processing_mode": "parallel_blend", "ai_model": "rnnoise", "blend_ratio": 0.5},
+]
+
+# 测试信号
+
+def synthetic_speech(sr: int, seconds: float = 4.0, seed: int = 0) -> np.ndarray:
+    """类语音合成信号：基频滑动的谐波串，乘以音节速率（约4Hz）的包络"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(sr * seconds)) / sr
+    f0 = 120 + 40 * np.sin(2 * np.pi * 0.5 * t + rng.uniform(0, np.pi))
+    phase = 2 * np.pi * np.cumsum(f0) / sr
+    harmonics = np.arange(1, 16)[:, None]
+    # 谐波幅度按1/k衰减，高于4kHz的谐波不叠加
+    amplitude = (1.0 / harmonics) * (harmonics * f0.mean() < 4000)
+    voiced = np.sum(amplitude * np.sin(harmonics * phase), axis=0)
+    envelope = np.clip(np.sin(2 * np.pi * 4 * t + rng.uniform(0, np.pi)), 0, None) ** 2
+    signal = voiced * envelope
+    return as_float32(0.5 * signal / np.max(np.abs(signal)))
+
+
+def colored_noise(kind: str, n_samples: int, seed: int = 0) -> np.ndarray:
+    """生成白/粉红/布朗噪声（频域整形）"""
+    rng = np.random.default_rng(seed)
+    spectrum = np.fft.rfft(rng.standard_normal(n_samples))
+    freqs = np.maximum(np.fft.rfftfreq(n_samples), 1.0 / n_samples)
+    exponent = {"white": 0.0, "pink": 0.5, "brown": 1.0}[kind]
+    noise = np.fft.irfft(spectrum / freqs ** exponent, n_samples)
+    return as_float32(noise / np.std(noise))
+
+
+def mix_at_snr(clean: np.ndarray, noise: np.ndarray, snr_db: float) -> np.ndarray:
+    """按指定信噪比混合干净信号与噪声"""
+    clean_power = np.mean(np.square(clean, dtype=np.float64))
+    noise_power = np.mean(np.square(noise, dtype=np.float64)) + 1e-20
+    scale = np.sqrt(clean_power / (noise_power * 10 ** (snr_db / 10)))
+    return as_float32(clean + scale * noise)
+
+
+# 客观指标（支持批量，最后一维为时间）
+
+def si_sdr(reference: np.ndarray, estimate: np.ndarray) -> np.ndarray:
+    """尺度不变信号失真比（dB）"""
+    reference = reference - reference.mean(axis=-1, keepdims=True)
+    estimate = estimate - estimate.mean(axis=-1, keepdims=True)
+    alpha = np.sum(reference * estimate, axis=-1, keepdims=True) / (
+        np.sum(reference ** 2, axis=-1, keepdims=True) + 1e-10)
+    target = alpha * reference
+    residual = estimate - target
+    return 10 * np.log10((np.sum(target ** 2, axis=-1) + 1e-10) / (np.sum(residual ** 2, axis=-1) + 1e-10))
+
+
+def segmental_snr(reference: np.ndarray, estimate: np.ndarray, sr: int,
+                  frame_ms: float = 20.0, floor_db: float = -10.0, ceiling_db: float = 35.0) -> np.ndarray:
+    """分段信噪比（dB）：逐帧SNR截断到[floor, ceiling]后取平均，忽略静音帧"""
+    frame = max(1, int(sr * frame_ms / 1000))
+    n_frames = reference.shape[-1] // frame
+    shape = reference.shape[:-1] + (n_frames, frame)
+    ref_frames = reference[..., :n_frames * frame].reshape(shape)
+    err_frames = ref_frames - estimate[..., :n_frames * frame].reshape(shape)
+
+    signal = np.sum(ref_frames ** 2, axis=-1)
+    noise = np.sum(err_frames ** 2, axis=-1)
+    snr = np.clip(10 * np.log10((signal + 1e-10) / (noise + 1e-10)), floor_db, ceiling_db)
+    # 静音帧（比最大帧能量低40dB以上）不参与平均
+    active = signal > np.max(signal, axis=-1, keepdims=True) * 1e-4
+    return np.sum(snr * active, axis=-1) / np.maximum(np.sum(active, axis=-1), 1)
+
+
+def log_spectral_distance(reference: np.ndarray, estimate: np.ndarray,
+                          n_fft: int = 512, hop_length: int = 128) -> np.ndarray:
+    """对数谱距离（dB）：逐帧对数功率谱差的均方根，再对非静音帧取平均
+
+    功率谱以参考信号峰值以下80dB为下限，避免空频点的数值噪声主导结果。
+    """
+    ref_power = np.abs(librosa.stft(reference, n_fft=n_fft, hop_length=hop_length)) ** 2
+    est_power = np.abs(librosa.stft(estimate, n_fft=n_fft, hop_length=hop_length)) ** 2
+    floor = np.max(ref_power, axis=(-2, -1), keepdims=True) * 1e-8 + 1e-20
+    diff = 10 * np.log10(np.maximum(ref_power, floor) / np.maximum(est_power, floor))
+    lsd = np.sqrt(np.mean(diff ** 2, axis=-2))
+    frame_energy = np.sum(ref_power, axis=-2)
+    active = frame_energy > np.max(frame_energy, axis=-1, keepdims=True) * 1e-4
+    return np.sum(lsd * active, axis=-1) / np.maximum(np.sum(active, axis=-1), 1)
+
+
+def compute_metrics(reference: np.ndarray, estimate: np.ndarray, sr: int) -> Dict[str, np.ndarray]:
+    """批量计算全部客观指标"""
+    length = min(reference.shape[-1], estimate.shape[-1])
+    reference, estimate = reference[..., :length], estimate[..., :length]
+    return {
+        "si_sdr": si_sdr(reference, estimate),
+        "seg_snr": segmental_snr(reference, estimate, sr),
+        "lsd": log_spectral_distance(reference, estimate),
+    }
+
+
+# 评估流程
+
+def config_name(config: dict) -> str:
+    """配置的简短名称"""
+    return ",".join(f"{key}={value}" for key, value in config.items())
+
+
+def evaluate_config(config: dict, cases: List[dict], sr: int, measure_memory: bool = True) -> dict:
+    """对所有测试样例运行一个配置，返回平均指标、运行时间与峰值内存"""
+    kwargs = dict({"normalization": "none"}, **config)
+    outputs, runtime, failures = [], 0.0, 0
+    for case in cases:
+        # 清空节点缓存，保证每次都是真实计算
+        hybrid_enhancer.graph_executor.clear_cache()
+        start = time.perf_counter()
+        enhanced, metadata = hybrid_enhancer.enhance_audio(case["noisy"], sr, profile=False, **kwargs)
+        runtime += time.perf_counter() - start
+        failures += 0 if metadata.get("success", False) else 1
+        outputs.append(as_float32(enhanced)[:len(case["clean"])])
+
+    peak_memory_mb = None
+    if measure_memory:
+        # 单独再跑一遍测量Python/NumPy峰值分配，避免tracemalloc影响计时
+        hybrid_enhancer.graph_executor.clear_cache()
+        tracemalloc.start()
+        hybrid_enhancer.enhance_audio(cases[0]["noisy"], sr, profile=False, **kwargs)
+        peak_memory_mb = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+
+    length = min(len(output) for output in outputs)
+    clean = np.stack([case["clean"][:length] for case in cases])
+    metrics = compute_metrics(clean, np.stack([output[:length] for output in outputs]), sr)
+
+    total_seconds = sum(len(case["noisy"]) for case in cases) / sr
+    row = {"config": config_name(config), "failures": failures,
+           "runtime_s": runtime, "realtime_factor": runtime / total_seconds,
+           "peak_memory_mb": peak_memory_mb}
+    row.update({name: float(np.mean(values)) for name, values in metrics.items()})
+    return row
+
+
+def build_cases(sr: int, clean_files: Optional[List[str]] = None,
+                snrs: List[float] = (0.0, 5.0, 10.0), noise_kinds: List[str] = ("white", "pink"),
+                seconds: float = 4.0) -> List[dict]:
+    """生成测试样例：每个干净参考 × 噪声类型 × 信噪比"""
+    if clean_files:
+        references = [as_float32(librosa.load(path, sr=sr, mono=True, duration=seconds)[0])
+                      for path in clean_files]
+    else:
+        references = [synthetic_speech(sr, seconds, seed) for seed in range(2)]
+
+    cases = []
+    for i, clean in enumerate(references):
+        for j, kind in enumerate(noise_kinds):
+            noise = colored_noise(kind, len(clean), seed=100 * i + j)
+            for snr in snrs:
+                cases.append({"clean": clean, "noisy": mix_at_snr(clean, noise, snr),
+                              "noise": kind, "snr": snr})
+    return cases
+
+
+def pareto_front(rows: List[dict], cost: str = "runtime_s", quality: str = "si_sdr") -> List[dict]:
+    """标记帕累托最优配置：不存在更快且质量不更差（或同样快且质量更好）的配置"""
+    for row in rows:
+        row["pareto"] = not any(
+            other is not row
+            and other[cost] <= row[cost] and other[quality] >= row[quality]
+            and (other[cost] < row[cost] or other[quality] > row[quality])
+            for other in rows
+        )
+    return rows
+
+
+def cheapest_meeting(rows: List[dict], min_si_sdr: Optional[float] = None,
+                     min_seg_snr: Optional[float] = None, max_lsd: Optional[float] = None) -> Optional[dict]:
+    """满足质量要求的最快配置"""
+    candidates = [
+        row for row in rows
+        if not row["failures"]
+        and (min_si_sdr is None or row["si_sdr"] >= min_si_sdr)
+        and (min_seg_snr is None or row["seg_snr"] >= min_seg_snr)
+        and (max_lsd is None or row["lsd"] <= max_lsd)
+    ]
+    return min(candidates, key=lambda row: row["runtime_s"]) if candidates else None
+
+
+def format_table(rows: List[dict]) -> str:
+    """按运行时间排序的文本表，★表示帕累托最优"""
+    header = f"{'':2}{'SI-SDR':>8} {'segSNR':>8} {'LSD':>7} {'时间(s)':>9} {'RTF':>7} {'内存(MB)':>9}  配置"
+    lines = [header, "-" * len(header)]
+    for row in sorted(rows, key=lambda row: row["runtime_s"]):
+        memory = f"{row['peak_memory_mb']:9.1f}" if row["peak_memory_mb"] is not None else f"{'-':>9}"
+        mark = "★" if row.get("pareto") else " "
+        failed = f"  (失败 {row['failures']} 次)" if row["failures"] else ""
+        lines.append(f"{mark:2}{row['si_sdr']:8.2f} {row['seg_snr']:8.2f} {row['lsd']:7.2f} "
+                     f"{row['runtime_s']:9.3f} {row['realtime_factor']:7.3f} {memory}  {row['config']}{failed}")
+    return "\n".join(lines)
+
+
+def run_evaluation(configs: Optional[List[dict]] = None, sr: int = 16000, **case_kwargs) -> List[dict]:
+    """运行完整评估，返回带帕累托标记的结果行；第一行是未处理的带噪输入基线"""
+    cases = build_cases(sr, **case_kwargs)
+    print(f"🧪 评估样例: {len(cases)} 个，配置: {len(configs or DEFAULT_CONFIGS)} 个")
+
+    length = min(len(case["clean"]) for case in cases)
+    baseline = compute_metrics(np.stack([case["clean"][:length] for case in cases]),
+                               np.stack([case["noisy"][:length] for case in cases]), sr)
+    rows = [dict({"config": "未处理 (带噪输入)", "failures": 0, "runtime_s": 0.0,
+                  "realtime_factor": 0.0, "peak_memory_mb": None},
+                 **{name: float(np.mean(values)) for name, values in baseline.items()})]
+
+    for config in configs or DEFAULT_CONFIGS:
+        print(f"⏱️ 评估配置: {config_name(config)}")
+        rows.append(evaluate_config(config, cases, sr))
+    return pareto_front(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="音频增强质量-速度评估")
+    parser.add_argument("--clean", nargs="*", help="干净参考语音文件，不指定时使用合成信号")
+    parser.add_argument("--snr", nargs="*", type=float, default=[0.0, 5.0, 10.0], help="混合信噪比(dB)")
+    parser.add_argument("--noise", nargs="*", default=["white", "pink"], choices=["white", "pink", "brown"])
+    parser.add_argument("--sr", type=int, default=16000, help="评估采样率")
+    parser.add_argument("--seconds", type=float, default=4.0, help="每个样例的时长（秒）")
+    parser.add_argument("--configs", help="JSON文件，内容为enhance_audio参数字典的列表")
+    parser.add_argument("--min-si-sdr", type=float, help="质量要求：最低SI-SDR(dB)")
+    parser.add_argument("--csv", help="结果另存为CSV")
+    args = parser.parse_args()
+
+    configs = None
+    if args.configs:
+        with open(args.configs, encoding="utf-8") as f:
+            configs = json.load(f)
+
+    rows = run_evaluation(configs, args.sr, clean_files=args.clean, snrs=args.snr,
+                          noise_kinds=args.noise, seconds=args.seconds)
+    print()
+    print(format_table(rows))
+
+    if args.min_si_sdr is not None:
+        best = cheapest_meeting(rows[1:], min_si_sdr=args.min_si_sdr)
+        print(f"\n🏆 满足 SI-SDR ≥ {args.min_si_sdr} dB 的最快配置: {best['config'] if best else '无'}")
+
+    if args.csv:
+        with open(args.csv, "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+            writer.writeheader()
+            writer.writerows(rows)
+        print(f"💾 结果已保存: {args.csv}")
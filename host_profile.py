@@ -0,0 +1,39 @@
+import json
+import os
+import socket
+from typing import Optional
+
+
+def default_profile_path() -> str:
+    """本机调优配置的默认路径（环境变量 AUDIOHD_HOST_PROFILE 可覆盖）"""
+    return os.environ.get("AUDIOHD_HOST_PROFILE") or os.path.join(
+        os.path.expanduser("~"), ".cache", "audiohd", f"host_profile-{socket.gethostname()}.json"
+    )
+
+
+def load_host_profile(path: Optional[str] = None) -> dict:
+    """读取autotune.py生成的本机调优配置，不存在或无法读取时返回空配置"""
+    path = path or default_profile_path()
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, encoding="utf-8") as f:
+            profile = json.load(f)
+        print(f"⚙️ 已加载本机调优配置: {path}")
+        return profile
+    except Exception as e:
+        print(f"⚠️ 本机调优配置读取失败，使用默认参数: {str(e)}")
+        return {}
+
+
+def save_host_profile(profile: dict, path: Optional[str] = None) -> str:
+    """保存本机调优配置"""
+    path = path or default_profile_path()
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(profile, f, ensure_ascii=False, indent=2)
+    return path
+
+
+# 启动时加载的本机调优配置
+host_profile = load_host_profile()
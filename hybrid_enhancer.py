@@ -1,8 +1,14 @@
 import numpy as np
 import librosa
-from typing import Tuple, Optional, List
+from typing import Tuple, Optional, List, Union
 from ai_models import ai_enhancer
 from app import AudioQualityEnhancer
+from job_queue import JobCancelled, report_progress
+from dsp_utils import as_float32, peak_abs, scale_owned
+from loudness import normalize_loudness
+from quality_gate import quality_gate
+from profiling import request_profiler
+from processing_graph import ProcessingGraph, GraphExecutor, STANDARD_MODES, build_custom_chain, build_default
 import warnings
 warnings.filterwarnings("ignore")
 
@@ -16,6 +22,13 @@ class HybridAudioEnhancer:
         # AI增强器
         self.ai_enhancer = ai_enhancer
         
+        # 输入质量门限（无参考评分）
+        self.quality_gate = quality_gate
+        
+        # 处理图执行器（独立分支并发、节点结果缓存）及各模式的图构建函数
+        self.graph_executor = GraphExecutor(self)
+        self.mode_builders = dict(STANDARD_MODES)
+        
         # 处理模式
         self.processing_modes = {
             "traditional_only": "仅传统处理",
@@ -26,12 +39,33 @@ class HybridAudioEnhancer:
             "adaptive_hybrid": "自适应混合"
         }
         
+        # 输出标准化方式
+        self.normalization_modes = {
+            "loudness": "单遍响度标准化 (-16 LUFS, -1 dBTP)",
+            "loudness_two_pass": "两遍响度标准化",
+            "peak": "全局峰值标准化",
+            "none": "不标准化"
+        }
+        
         print("🎵 混合音频增强器初始化完成")
     
     def get_available_modes(self) -> dict:
         """获取可用的处理模式"""
         return self.processing_modes
     
+    def register_mode(self, name: str, display_name: str, builder):
+        """注册自定义处理模式，builder为图构建函数或步骤列表"""
+        if isinstance(builder, (list, tuple)):
+            builder = build_custom_chain(list(builder))
+        self.mode_builders[name] = builder
+        self.processing_modes[name] = display_name
+    
+    def _resolve_mode(self, processing_mode):
+        """获取处理模式对应的图构建函数"""
+        if isinstance(processing_mode, (list, tuple)):
+            return build_custom_chain(list(processing_mode))
+        return self.mode_builders.get(processing_mode)
+    
     def get_ai_models(self) -> dict:
         """获取可用的AI模型"""
         return self.ai_enhancer.get_available_models()
@@ -45,23 +79,27 @@ class HybridAudioEnhancer:
         """仅使用传统方法处理"""
         print("🔧 使用传统信号处理...")
         
-        enhanced = audio.copy()
+        # 各处理步骤都返回新数组，无需预先复制输入
+        enhanced = as_float32(audio)
         
         if enhancement_level in ["basic", "medium", "advanced"]:
             # 降噪
-            enhanced = self.traditional_enhancer.adaptive_noise_reduction(enhanced, sr)
+            report_progress("传统处理: 自适应降噪")
+            enhanced = as_float32(self.traditional_enhancer.adaptive_noise_reduction(enhanced, sr))
             
         if enhancement_level in ["medium", "advanced"]:
             # 谐波增强
-            enhanced = self.traditional_enhancer.harmonic_enhancement(enhanced, sr)
+            report_progress("传统处理: 谐波增强")
+            enhanced = as_float32(self.traditional_enhancer.harmonic_enhancement(enhanced, sr))
             
         if enhancement_level == "advanced":
             # 动态范围处理
-            enhanced = self.traditional_enhancer.dynamic_range_enhancement(enhanced)
+            report_progress("传统处理: 动态范围")
+            enhanced = as_float32(self.traditional_enhancer.dynamic_range_enhancement(enhanced))
             
             # 立体声宽度增强（如果是立体声）
-            if len(enhanced.shape) > 1 or enhanced.ndim > 1:
-                enhanced = self.traditional_enhancer.stereo_width_enhancement(enhanced)
+            if enhanced.ndim > 1:
+                enhanced = as_float32(self.traditional_enhancer.stereo_width_enhancement(enhanced))
         
         return enhanced
     
@@ -76,6 +114,7 @@ class HybridAudioEnhancer:
                 print(f"❌ AI模型加载失败，使用传统处理作为备选")
                 return self.process_traditional_only(audio, sr, "medium")
         
+        report_progress(f"AI模型处理: {ai_model}")
         enhanced = self.ai_enhancer.enhance_audio(audio, sr, ai_model)
         return enhanced
     
@@ -118,37 +157,55 @@ class HybridAudioEnhancer:
         ai_enhanced = self.process_ai_only(audio, sr, ai_model)
         traditional_enhanced = self.process_traditional_only(audio, sr, enhancement_level)
         
+        return self.blend_results(ai_enhanced, traditional_enhanced, blend_ratio)
+    
+    def blend_results(self, ai_enhanced: np.ndarray, traditional_enhanced: np.ndarray,
+                      blend_ratio: float) -> np.ndarray:
+        """按比例混合AI与传统处理结果"""
         # 确保两个结果长度一致
         min_len = min(len(ai_enhanced), len(traditional_enhanced))
         ai_enhanced = ai_enhanced[:min_len]
         traditional_enhanced = traditional_enhanced[:min_len]
         
-        # 混合结果
-        blended = blend_ratio * ai_enhanced + (1 - blend_ratio) * traditional_enhanced
+        # 混合结果: trad + r * (ai - trad)，只分配一个输出缓冲区
+        blended = np.subtract(ai_enhanced, traditional_enhanced, dtype=np.float32)
+        blended *= np.float32(blend_ratio)
+        blended += traditional_enhanced
         
         return blended
     
     def process_adaptive_hybrid(self, audio: np.ndarray, sr: int,
-                              ai_model: str = "facebook_denoiser") -> np.ndarray:
+                              ai_model: str = "facebook_denoiser",
+                              features: Optional[dict] = None) -> np.ndarray:
         """自适应混合：根据音频特征智能选择最佳处理方式"""
         print("🧠 自适应混合处理...")
         
-        # 分析音频特征
-        audio_features = self._analyze_audio_features(audio, sr)
+        # 分析音频特征（可复用调用方已有的分析结果）
+        audio_features = features if features is not None else self._analyze_audio_features(audio, sr)
         
         # 根据特征选择处理策略
-        if audio_features["noise_level"] > 0.3:
+        mode, level, ratio = self.choose_adaptive_strategy(audio_features)
+        if mode == "ai_then_traditional":
+            return self.process_ai_then_traditional(audio, sr, ai_model, level)
+        elif mode == "traditional_then_ai":
+            return self.process_traditional_then_ai(audio, sr, ai_model, level)
+        else:
+            return self.process_parallel_blend(audio, sr, ai_model, level, ratio)
+    
+    def choose_adaptive_strategy(self, features: dict) -> Tuple[str, str, float]:
+        """根据音频特征选择自适应策略，返回(处理模式, 传统增强级别, 混合比例)"""
+        if features["noise_level"] > 0.3:
             print("📊 检测到高噪声，优先使用AI降噪")
-            return self.process_ai_then_traditional(audio, sr, ai_model, "basic")
-        elif audio_features["dynamic_range"] < 0.2:
+            return "ai_then_traditional", "basic", 0.5
+        elif features["dynamic_range"] < 0.2:
             print("📊 检测到动态范围窄，优先使用传统增强")
-            return self.process_traditional_then_ai(audio, sr, ai_model, "advanced")
-        elif audio_features["spectral_centroid"] > 3000:
+            return "traditional_then_ai", "advanced", 0.5
+        elif features["spectral_centroid"] > 3000:
             print("📊 检测到高频内容丰富，使用并行混合")
-            return self.process_parallel_blend(audio, sr, ai_model, "medium", 0.6)
+            return "parallel_blend", "medium", 0.6
         else:
             print("📊 使用平衡的混合处理")
-            return self.process_parallel_blend(audio, sr, ai_model, "medium", 0.5)
+            return "parallel_blend", "medium", 0.5
     
     def _analyze_audio_features(self, audio: np.ndarray, sr: int) -> dict:
         """分析音频特征"""
@@ -184,6 +241,60 @@ class HybridAudioEnhancer:
                 "zero_crossing_rate": 0.1
             }
     
+    def check_quality_gate(self, audio: np.ndarray, sr: int,
+                            quality_threshold: Optional[float],
+                            quality_score: Optional[float]) -> Optional[dict]:
+        """评估输入质量，返回门限判定信息；未启用门限时返回None"""
+        if quality_threshold is None:
+            return None
+        
+        report_progress("输入质量评估", 0.02)
+        if quality_score is None:
+            quality_score = self.quality_gate.score(audio, sr)
+        skipped = quality_score >= quality_threshold
+        if skipped:
+            print(f"⏭️ 输入质量 {quality_score:.2f} ≥ 门限 {quality_threshold:.2f}，跳过增强处理")
+        return {
+            "score": float(quality_score),
+            "threshold": float(quality_threshold),
+            "scorer": self.quality_gate.scorer_name,
+            "skipped": bool(skipped)
+        }
+    
+    def skip_enhancement(self, audio: np.ndarray, sr: int, peak: float, normalization: str,
+                          features: Optional[dict], gate_info: dict) -> Tuple[np.ndarray, dict]:
+        """质量门限命中时的快速路径：仅做输出标准化"""
+        report_progress("质量检查与标准化", 0.95)
+        enhanced = self.normalize_output(audio, audio, sr, peak, normalization)
+        metadata = {
+            "method_used": f"质量门限跳过 (评分 {gate_info['score']:.2f})",
+            "original_features": features or {},
+            "processing_mode": "quality_gate_skip",
+            "ai_model": None,
+            "ai_model_used": "未使用",
+            "traditional_used": False,
+            "enhancement_level": None,
+            "actual_method_details": f"输入质量评分 {gate_info['score']:.2f} ≥ 门限 {gate_info['threshold']:.2f}，跳过AI与传统处理，仅标准化",
+            "blend_ratio_used": None,
+            "blend_ratio_display": "不适用",
+            "normalization": normalization,
+            "quality_gate": gate_info,
+            "success": True
+        }
+        print(f"✅ 音频增强完成: {metadata['method_used']}")
+        return enhanced, metadata
+    
+    def normalize_output(self, enhanced: np.ndarray, audio: np.ndarray, sr: int,
+                         peak: float, normalization: str) -> np.ndarray:
+        """按指定方式标准化输出电平"""
+        if normalization == "none" or peak <= 0:
+            return enhanced
+        if normalization == "peak":
+            # 全局峰值标准化：需要完整输出，无法流式输出
+            return scale_owned(enhanced, 0.95 / peak, audio)
+        # 响度标准化：对完整输出做单遍（有界前瞻）处理；需要边处理边输出时直接使用loudness.iter_normalized
+        return normalize_loudness(enhanced, sr, two_pass=(normalization == "loudness_two_pass"))
+    
     def _get_blend_ratio_display(self, processing_mode: str, actual_ai_used: bool, actual_traditional_used: bool, blend_ratio: float) -> str:
         """获取混合比例的显示文本"""
         if processing_mode == "parallel_blend":
@@ -207,112 +318,126 @@ class HybridAudioEnhancer:
             return "不适用"
     
     def enhance_audio(self, audio: np.ndarray, sr: int, 
-                     processing_mode: str = "adaptive_hybrid",
+                     processing_mode: Union[str, List[dict]] = "adaptive_hybrid",
                      ai_model: str = "facebook_denoiser",
                      enhancement_level: str = "medium",
-                     blend_ratio: float = 0.5) -> Tuple[np.ndarray, dict]:
-        """主要的音频增强接口"""
+                     blend_ratio: float = 0.5,
+                     normalization: str = "loudness",
+                     features: Optional[dict] = None,
+                     quality_threshold: Optional[float] = None,
+                     quality_score: Optional[float] = None,
+                     profile: Optional[bool] = None) -> Tuple[np.ndarray, dict]:
+        """主要的音频增强接口
+
+        processing_mode: 模式名称，或自定义处理链的步骤列表（见ProcessingGraph.chain）
+        features: 预先计算的音频特征（如整段长音频的分析结果），传入时跳过重复分析
+        quality_threshold: 输入质量分数（MOS量纲）达到该值时跳过AI和传统处理，None为关闭
+        quality_score: 预先批量计算的质量分数，传入时不再单独评分
+        profile: 是否对本次调用做性能分析，None时按抽样比例决定
+        """
+        args = (audio, sr, processing_mode, ai_model, enhancement_level, blend_ratio,
+                normalization, features, quality_threshold, quality_score)
+        if not request_profiler.should_profile(profile):
+            return self._enhance_audio(*args)
+        
+        label = processing_mode if isinstance(processing_mode, str) else "custom"
+        with request_profiler.profile(label) as profile_info:
+            enhanced, metadata = self._enhance_audio(*args)
+        if profile_info:
+            metadata["profile"] = profile_info
+        return enhanced, metadata
+    
+    def _enhance_audio(self, audio: np.ndarray, sr: int, processing_mode, ai_model: str,
+                       enhancement_level: str, blend_ratio: float, normalization: str,
+                       features: Optional[dict],
+                       quality_threshold: Optional[float],
+                       quality_score: Optional[float]) -> Tuple[np.ndarray, dict]:
+        """enhance_audio的实际处理流程"""
         
         # 输入验证
         if len(audio) == 0:
             print("❌ 输入音频为空")
             return audio, {"error": "空音频"}
         
-        if not np.isfinite(audio).all():
+        audio = as_float32(audio)
+        
+        # 峰值扫描同时完成有效性检查（NaN/Inf会传播到峰值）
+        if not np.isfinite(peak_abs(audio)):
             print("❌ 输入音频包含无效数值")
             return audio, {"error": "无效音频数据"}
         
-        # 音频特征分析
-        features = self._analyze_audio_features(audio, sr)
+        # 质量门限：已足够干净的输入只做标准化
+        gate_info = self.check_quality_gate(audio, sr, quality_threshold, quality_score)
+        if gate_info is not None and gate_info["skipped"]:
+            return self.skip_enhancement(audio, sr, peak_abs(audio), normalization, features, gate_info)
+        
+        graph = ProcessingGraph()
+        values = {}
+        stage_timings = {}
+        cache_hits = []
+        fingerprint = self.graph_executor.fingerprint(audio, sr) if self.graph_executor.cacheable(audio) else None
         
         try:
-            # 记录实际使用的处理方法
-            actual_ai_used = False
-            actual_traditional_used = False
-            actual_method_details = ""
+            # 音频特征分析（图中的analyze节点，结果可跨请求缓存）
+            report_progress("音频特征分析", 0.05)
+            if features is None:
+                features, stats = self.graph_executor.run(graph.analyze(), audio, sr, values, fingerprint)
+                stage_timings.update(stats["timings"])
+                cache_hits.extend(stats["cache_hits"])
             
-            # 根据模式选择处理方法
-            if processing_mode == "traditional_only":
-                enhanced = self.process_traditional_only(audio, sr, enhancement_level)
-                method_used = f"传统处理 ({enhancement_level})"
-                actual_traditional_used = True
-                actual_method_details = f"仅传统信号处理，级别：{enhancement_level}"
-                
-            elif processing_mode == "ai_only":
-                enhanced = self.process_ai_only(audio, sr, ai_model)
-                method_used = f"AI处理 ({ai_model})"
-                actual_ai_used = True
-                actual_method_details = f"仅AI模型处理：{ai_model}"
-                
-            elif processing_mode == "ai_then_traditional":
-                enhanced = self.process_ai_then_traditional(audio, sr, ai_model, enhancement_level)
-                method_used = f"AI→传统 ({ai_model} + {enhancement_level})"
-                actual_ai_used = True
-                actual_traditional_used = True
-                actual_method_details = f"AI优先：{ai_model} → 传统{enhancement_level}"
-                
-            elif processing_mode == "traditional_then_ai":
-                enhanced = self.process_traditional_then_ai(audio, sr, ai_model, enhancement_level)
-                method_used = f"传统→AI ({enhancement_level} + {ai_model})"
-                actual_ai_used = True
-                actual_traditional_used = True
-                actual_method_details = f"传统优先：{enhancement_level} → {ai_model}"
-                
-            elif processing_mode == "parallel_blend":
-                enhanced = self.process_parallel_blend(audio, sr, ai_model, enhancement_level, blend_ratio)
-                method_used = f"并行混合 ({ai_model} + {enhancement_level}, 比例:{blend_ratio:.1f})"
-                actual_ai_used = True
-                actual_traditional_used = True
-                actual_method_details = f"并行混合：{ai_model}({blend_ratio:.1f}) + 传统{enhancement_level}({1-blend_ratio:.1f})"
-                
-            elif processing_mode == "adaptive_hybrid":
-                enhanced = self.process_adaptive_hybrid(audio, sr, ai_model)
-                method_used = "自适应混合"
-                # 自适应模式会根据音频特征决定是否使用AI
-                if features["noise_level"] > 0.3 or features["dynamic_range"] < 0.2 or features["spectral_centroid"] > 3000:
-                    actual_ai_used = True
-                    actual_traditional_used = True
-                    actual_method_details = f"自适应选择：{ai_model} + 传统处理"
-                else:
-                    actual_ai_used = True
-                    actual_traditional_used = True
-                    actual_method_details = f"自适应选择：平衡混合 {ai_model} + 传统处理"
-                
-            else:
+            # 根据模式构建处理图
+            builder = self._resolve_mode(processing_mode)
+            if builder is None:
                 print(f"❌ 未知的处理模式: {processing_mode}")
-                enhanced = self.process_traditional_only(audio, sr, "medium")
-                method_used = "传统处理 (默认)"
-                actual_traditional_used = True
-                actual_method_details = "默认传统处理"
+                builder = build_default
+            settings = {
+                "ai_model": ai_model,
+                "enhancement_level": enhancement_level,
+                "blend_ratio": blend_ratio,
+                "enhancer": self
+            }
+            output, description = builder(graph, settings, features)
+            
+            # 执行处理图：相同子图只计算一次，独立分支并发执行，最后检查并标准化
+            report_progress("增强处理", 0.15)
+            enhanced, stats = self.graph_executor.run(graph.normalize(output, normalization),
+                                                      audio, sr, values, fingerprint)
+            stage_timings.update(stats["timings"])
+            cache_hits.extend(stats["cache_hits"])
             
-            # 最终检查和标准化
-            if not np.isfinite(enhanced).all():
-                print("⚠️ 处理结果包含无效数值，使用原始音频")
-                enhanced = audio
+            method_used = description["method_used"]
+            actual_ai_used = description["ai_used"]
+            actual_traditional_used = description["traditional_used"]
+            actual_method_details = description["actual_method_details"]
+            if "invalid_output_fallback" in stats["events"]:
                 method_used += " (失败，返回原始)"
             
-            # 标准化到合理范围
-            if np.max(np.abs(enhanced)) > 0:
-                enhanced = enhanced / np.max(np.abs(enhanced)) * 0.95
+            mode_name = processing_mode if isinstance(processing_mode, str) else "custom"
             
             # 返回结果和元数据
             metadata = {
                 "method_used": method_used,
                 "original_features": features,
-                "processing_mode": processing_mode,
+                "processing_mode": mode_name,
                 "ai_model": ai_model if actual_ai_used else None,
                 "ai_model_used": ai_model if actual_ai_used else "未使用",
                 "traditional_used": actual_traditional_used,
                 "enhancement_level": enhancement_level,
                 "actual_method_details": actual_method_details,
-                "blend_ratio_used": blend_ratio if processing_mode == "parallel_blend" else None,
-                "blend_ratio_display": self._get_blend_ratio_display(processing_mode, actual_ai_used, actual_traditional_used, blend_ratio),
+                "blend_ratio_used": blend_ratio if mode_name == "parallel_blend" else None,
+                "blend_ratio_display": self._get_blend_ratio_display(mode_name, actual_ai_used, actual_traditional_used, blend_ratio),
+                "normalization": normalization,
+                "quality_gate": gate_info,
+                "stage_timings": stage_timings,
+                "cache_hits": cache_hits,
                 "success": True
             }
             
             print(f"✅ 音频增强完成: {method_used}")
             return enhanced, metadata
             
+        except JobCancelled:
+            raise
         except Exception as e:
             print(f"❌ 音频增强失败: {str(e)}")
             return audio, {"error": str(e), "success": False}
@@ -0,0 +1,180 @@
+import contextvars
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional, Tuple
+
+
+class JobCancelled(Exception):
+    """任务被取消或超过截止时间"""
+
+
+class JobQueueFull(Exception):
+    """任务队列已满（背压）"""
+
+
+# 当前线程正在执行的任务，以及进度映射区间（用于立体声等分段报告）
+_current_job = contextvars.ContextVar("audiohd_current_job", default=None)
+_progress_span = contextvars.ContextVar("audiohd_progress_span", default=(0.0, 1.0))
+
+
+def current_job() -> Optional["Job"]:
+    """当前线程正在执行的任务，不在任务中运行时返回None"""
+    return _current_job.get()
+
+
+def report_progress(stage: str, fraction: Optional[float] = None):
+    """报告当前任务的阶段进度，并在阶段/分块之间检查取消和截止时间
+
+    不在任务中运行时（如直接调用enhance_audio）为空操作。
+    """
+    job = _current_job.get()
+    if job is None:
+        return
+    if fraction is not None:
+        start, end = _progress_span.get()
+        fraction = start + (end - start) * min(max(fraction, 0.0), 1.0)
+    job.update_progress(stage, fraction)
+    job.raise_if_cancelled()
+
+
+@contextmanager
+def progress_span(start: float, end: float):
+    """将内部报告的0~1进度映射到[start, end]区间"""
+    outer_start, outer_end = _progress_span.get()
+    width = outer_end - outer_start
+    token = _progress_span.set((outer_start + width * start, outer_start + width * end))
+    try:
+        yield
+    finally:
+        _progress_span.reset(token)
+
+
+class Job:
+    """单个增强任务的状态、进度与取消标记"""
+
+    def __init__(self, timeout: Optional[float] = None):
+        self.id = uuid.uuid4().hex[:12]
+        self.status = "queued"
+        self.stage = "排队中"
+        self.progress = 0.0
+        self.result = None
+        self.error = None
+        self.created_at = time.monotonic()
+        self.started_at = None
+        self.finished_at = None
+        self.deadline = self.created_at + timeout if timeout else None
+        self._cancel_event = threading.Event()
+        self._done_event = threading.Event()
+
+    @property
+    def done(self) -> bool:
+        """任务是否已结束（完成、失败、取消或过期）"""
+        return self._done_event.is_set()
+
+    def cancel(self):
+        """请求取消任务，在下一个检查点生效"""
+        self._cancel_event.set()
+
+    def raise_if_cancelled(self):
+        """若任务已取消或超过截止时间则抛出JobCancelled"""
+        if self._cancel_event.is_set():
+            raise JobCancelled("任务已取消")
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            raise JobCancelled("任务超过截止时间")
+
+    def update_progress(self, stage: str, fraction: Optional[float] = None):
+        """更新阶段描述和进度"""
+        self.stage = stage
+        if fraction is not None:
+            self.progress = max(self.progress, fraction)
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """等待任务结束，返回是否已结束"""
+        return self._done_event.wait(timeout)
+
+
+class JobManager:
+    """有界并发的异步任务队列 - 支持进度、协作式取消和截止时间"""
+
+    def __init__(self, max_concurrency: int = 1, max_pending: int = 8,
+                 default_timeout: Optional[float] = None):
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_pending = max(0, max_pending)
+        self.default_timeout = default_timeout
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency,
+                                            thread_name_prefix="audiohd-job")
+        # 运行中 + 排队中的任务总数上限
+        self._slots = threading.BoundedSemaphore(self.max_concurrency + self.max_pending)
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def capacity(self) -> int:
+        """可同时容纳的任务数（运行 + 排队）"""
+        return self.max_concurrency + self.max_pending
+
+    def submit(self, fn: Callable, *args, timeout: Optional[float] = None, **kwargs) -> Job:
+        """提交任务；队列已满时抛出JobQueueFull"""
+        if not self._slots.acquire(blocking=False):
+            raise JobQueueFull("任务队列已满，请稍后重试")
+
+        job = Job(timeout if timeout is not None else self.default_timeout)
+        with self._lock:
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def _run(self, job: Job, fn: Callable, args: Tuple, kwargs: dict):
+        """在工作线程中执行任务"""
+        token = None
+        try:
+            # 排队期间被取消或已过期的任务直接丢弃
+            job.raise_if_cancelled()
+            job.status = "running"
+            job.started_at = time.monotonic()
+            job.update_progress("开始处理", 0.0)
+            token = _current_job.set(job)
+            job.result = fn(*args, **kwargs)
+            job.raise_if_cancelled()
+            job.status = "done"
+            job.update_progress("处理完成", 1.0)
+        except JobCancelled as e:
+            job.status = "cancelled" if job._cancel_event.is_set() else "expired"
+            job.error = str(e)
+            print(f"🛑 任务 {job.id} 已终止: {e} (阶段: {job.stage})")
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+            print(f"❌ 任务 {job.id} 失败: {e}")
+        finally:
+            if token is not None:
+                _current_job.reset(token)
+            with self._lock:
+                self._jobs.pop(job.id, None)
+            self._slots.release()
+            job.finished_at = time.monotonic()
+            job._done_event.set()
+
+    def get_job(self, job_id: str) -> Optional[Job]:
+        """按ID获取未结束的任务"""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> bool:
+        """取消指定任务"""
+        job = self.get_job(job_id)
+        if job is None:
+            return False
+        job.cancel()
+        return True
+
+    def shutdown(self):
+        """取消所有任务并关闭线程池"""
+        with self._lock:
+            jobs = list(self._jobs.values())
+        for job in jobs:
+            job.cancel()
+        self._executor.shutdown(wait=True)
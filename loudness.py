@@ -0,0 +1,372 @@
+import numpy as np
+from scipy import signal
+from scipy.ndimage import maximum_filter1d, minimum_filter1d
+from numpy.lib.stride_tricks import sliding_window_view
+from typing import Iterable, Iterator, Optional
+from dsp_utils import as_float32
+
+# BS.1770 门限
+ABSOLUTE_GATE_LUFS = -70.0
+RELATIVE_GATE_LU = -10.0
+
+# 限幅器内部上限相对真峰值上限的余量（dB），覆盖插值滤波器在接近奈奎斯特频率处的低估
+TRUE_PEAK_MARGIN_DB = 0.2
+
+
+def k_weighting_sos(sr: int) -> np.ndarray:
+    """按ITU-R BS.1770计算任意采样率下的K加权滤波器（二阶节形式）"""
+    # 第一级：高频搁架滤波器（头部声学效应）
+    G, Q, fc = 3.999843853973347, 0.7071752369554196, 1681.974450955533
+    A = 10 ** (G / 40)
+    w0 = 2 * np.pi * fc / sr
+    cos_w0, alpha = np.cos(w0), np.sin(w0) / (2 * Q)
+    shelf = np.array([
+        A * ((A + 1) + (A - 1) * cos_w0 + 2 * np.sqrt(A) * alpha),
+        -2 * A * ((A - 1) + (A + 1) * cos_w0),
+        A * ((A + 1) + (A - 1) * cos_w0 - 2 * np.sqrt(A) * alpha),
+        (A + 1) - (A - 1) * cos_w0 + 2 * np.sqrt(A) * alpha,
+        2 * ((A - 1) - (A + 1) * cos_w0),
+        (A + 1) - (A - 1) * cos_w0 - 2 * np.sqrt(A) * alpha,
+    ])
+
+    # 第二级：RLB高通滤波器
+    Q, fc = 0.5003270373238773, 38.13547087602444
+    w0 = 2 * np.pi * fc / sr
+    cos_w0, alpha = np.cos(w0), np.sin(w0) / (2 * Q)
+    highpass = np.array([
+        (1 + cos_w0) / 2, -(1 + cos_w0), (1 + cos_w0) / 2,
+        1 + alpha, -2 * cos_w0, 1 - alpha,
+    ])
+
+    sos = np.vstack([shelf, highpass])
+    return sos / sos[:, 3:4]
+
+
+def _power_to_lufs(power):
+    """均方功率转换为LUFS"""
+    return -0.691 + 10 * np.log10(np.maximum(power, 1e-12))
+
+
+def _gated_loudness(block_powers: np.ndarray) -> Optional[float]:
+    """对块功率应用绝对/相对门限，返回积分响度；全部静音时返回None"""
+    block_powers = block_powers[_power_to_lufs(block_powers) > ABSOLUTE_GATE_LUFS]
+    if len(block_powers) == 0:
+        return None
+    relative_gate = _power_to_lufs(np.mean(block_powers)) + RELATIVE_GATE_LU
+    block_powers = block_powers[_power_to_lufs(block_powers) > relative_gate]
+    return float(_power_to_lufs(np.mean(block_powers)))
+
+
+def measure_integrated_loudness(audio: np.ndarray, sr: int) -> Optional[float]:
+    """测量积分响度（BS.1770：400ms块、75%重叠、双重门限），单声道或(声道, 采样)"""
+    audio = np.atleast_2d(as_float32(audio))
+    filtered = signal.sosfilt(k_weighting_sos(sr), audio, axis=-1)
+    power = np.einsum("cn,cn->n", filtered, filtered)
+
+    block, hop = int(0.4 * sr), int(0.1 * sr)
+    if power.shape[0] < block:
+        return _gated_loudness(np.array([power.mean()])) if power.shape[0] else None
+
+    # 用累积和一次性得到所有重叠块的均方功率
+    cumulative = np.concatenate(([0.0], np.cumsum(power, dtype=np.float64)))
+    starts = np.arange(0, power.shape[0] - block + 1, hop)
+    block_powers = (cumulative[starts + block] - cumulative[starts]) / block
+    return _gated_loudness(block_powers)
+
+
+class StreamingLoudnessNormalizer:
+    """有界前瞻的流式响度标准化器 - 响度目标 + 真峰值前瞻限幅
+
+    响度按400ms非重叠块持续测量并做门限积分；增益按固定的测量块决定，
+    每块由此前各块的积分响度得到目标，并以受限斜率在块内线性过渡，
+    因此输出与输入的分块方式无关。还没有有效响度估计时暂存当前块，
+    块测完后仍无估计（如开头的静音）则沿用当前增益输出，
+    输出延迟最多为一个测量块加限幅器前瞻。
+    两遍模式下传入 reference_lufs，整个信号使用固定增益。
+    """
+
+    def __init__(self, sr: int, target_lufs: float = -16.0, true_peak_db: float = -1.0,
+                 lookahead_ms: float = 5.0, max_gain_db: float = 20.0,
+                 max_slew_db_per_s: float = 6.0, reference_lufs: Optional[float] = None,
+                 oversample: int = 8):
+        self.sr = sr
+        self.target_lufs = target_lufs
+        self.ceiling = 10 ** ((true_peak_db - TRUE_PEAK_MARGIN_DB) / 20)
+        self.max_gain_db = max_gain_db
+        self.max_slew_db_per_s = max_slew_db_per_s
+        self.reference_lufs = reference_lufs
+        self.lookahead = max(2, int(sr * lookahead_ms / 1000))
+
+        # 响度测量状态
+        self._sos = k_weighting_sos(sr)
+        self._sos_zi = None
+        self._block_size = int(0.4 * sr)
+        self._block_buffer = np.zeros(0, dtype=np.float64)
+        self._block_powers = []
+        self._gain_db = None
+
+        # 增益施加状态：当前块序号、块内已处理的采样数、块内增益斜坡（dB）、暂存的采样
+        self._block_index = 0
+        self._block_offset = 0
+        self._block_ramp = None
+        self._held = []
+
+        # 真峰值估计：过采样插值FIR（带状态，适合分块）
+        self.oversample = oversample
+        # 每相24抽头的Kaiser窗插值滤波器；奇数长度保证整数群延迟，原采样点的峰值被精确保留
+        fir = (signal.firwin(24 * oversample + 1, 1.0 / oversample, window=("kaiser", 5.0))
+               * oversample).astype(np.float32)
+        # 多相分解：_tp_phases[k, p] = fir[k*oversample + p]，按原采样率计算所有插值相位，
+        # 不需要补零上采样；按时间倒序排列，与滑动窗口直接做矩阵乘法
+        taps = -(-len(fir) // oversample)
+        phases = np.zeros(taps * oversample, dtype=np.float32)
+        phases[:len(fir)] = fir
+        self._tp_phases = np.ascontiguousarray(phases.reshape(taps, oversample)[::-1])
+        # 插值输出相对输入峰值的放大上限：窗口内最大采样乘以它仍低于上限的位置不必精确插值
+        self._tp_bound = float(np.abs(self._tp_phases).sum(axis=0).max())
+        self._tp_history = None
+        self._tp_delay = int(np.ceil((len(fir) - 1) / 2 / oversample))
+        self._tp_skip = self._tp_delay
+
+        # 限幅器状态
+        self._x = None
+        self._g = np.zeros(0, dtype=np.float32)
+        self._gmin_history = np.ones(self.lookahead - 1, dtype=np.float32)
+
+        self._mono = None
+        self._finished = False
+
+    @property
+    def integrated_loudness(self) -> Optional[float]:
+        """目前为止测得的门限积分响度"""
+        if not self._block_powers:
+            return None
+        return _gated_loudness(np.asarray(self._block_powers))
+
+    def process(self, chunk: np.ndarray) -> np.ndarray:
+        """输入一个音频块，返回已可输出的标准化音频（长度可能小于输入）"""
+        return self._process(chunk, final=False)
+
+    def flush(self) -> np.ndarray:
+        """输入结束，返回剩余的全部音频"""
+        return self._process(None, final=True)
+
+    def _process(self, chunk: Optional[np.ndarray], final: bool) -> np.ndarray:
+        if self._finished:
+            raise RuntimeError("标准化器已结束，不能继续输入")
+        if chunk is not None:
+            chunk = as_float32(chunk)
+            if self._mono is None:
+                self._mono = chunk.ndim == 1
+            chunk = np.atleast_2d(chunk)
+            if self._x is None:
+                self._x = np.zeros((chunk.shape[0], 0), dtype=np.float32)
+        self._finished = final
+
+        if self._x is None:
+            return np.zeros(0, dtype=np.float32)
+
+        scaled = self._apply_loudness_gain(chunk, final)
+        limited = self._limit(scaled, final)
+        return limited[0] if self._mono else limited
+
+    def _measure(self, chunk: np.ndarray):
+        """K加权后按400ms块累积均方功率"""
+        if self._sos_zi is None:
+            self._sos_zi = np.zeros((self._sos.shape[0], chunk.shape[0], 2))
+        filtered, self._sos_zi = signal.sosfilt(self._sos, chunk, axis=-1, zi=self._sos_zi)
+        power = np.einsum("cn,cn->n", filtered, filtered)
+
+        buffer = np.concatenate((self._block_buffer, power))
+        n_blocks = len(buffer) // self._block_size
+        if n_blocks:
+            used = n_blocks * self._block_size
+            self._block_powers.extend(buffer[:used].reshape(n_blocks, self._block_size).mean(axis=1))
+            buffer = buffer[used:]
+        self._block_buffer = buffer
+
+    def _target_gain_db(self, loudness: float) -> float:
+        """由积分响度计算目标增益"""
+        return float(np.clip(self.target_lufs - loudness, -self.max_gain_db, self.max_gain_db))
+
+    def _decide_block_ramp(self, complete: bool) -> Optional[tuple]:
+        """决定当前块的增益斜坡 (起点dB, 终点dB)；需要等待当前块测完时返回None
+
+        只使用当前块之前（首个估计时包括当前块）的测量结果，与输入分块方式无关。
+        """
+        if self.reference_lufs is not None:
+            gain_db = self._target_gain_db(self.reference_lufs)
+            return gain_db, gain_db
+
+        k = self._block_index
+        loudness = _gated_loudness(np.asarray(self._block_powers[:k])) if k else None
+        if loudness is not None:
+            # 已有估计：按受限斜率向目标过渡
+            max_step = self.max_slew_db_per_s * self._block_size / self.sr
+            start_db = self._gain_db
+            end_db = start_db + float(np.clip(self._target_gain_db(loudness) - start_db, -max_step, max_step))
+            self._gain_db = end_db
+            return start_db, end_db
+
+        if not complete:
+            return None
+        powers = self._block_powers[:k + 1]
+        if len(powers) == k and len(self._block_buffer):
+            # 输入结束时不足一个测量块的尾部：以现有部分作为一个块
+            powers = powers + [self._block_buffer.mean()]
+        loudness = _gated_loudness(np.asarray(powers)) if powers else None
+        if loudness is None:
+            # 前瞻用尽仍无有效响度（静音）：沿用当前增益
+            gain_db = self._gain_db if self._gain_db is not None else 0.0
+            return gain_db, gain_db
+        # 首个估计直接生效
+        self._gain_db = self._target_gain_db(loudness)
+        return self._gain_db, self._gain_db
+
+    def _ramp_gain(self, offset: int, n: int) -> np.ndarray:
+        """当前块内 [offset, offset+n) 位置的线性增益"""
+        start_gain, end_gain = (10 ** (db / 20) for db in self._block_ramp)
+        if start_gain == end_gain:
+            return np.float32(start_gain)
+        position = np.arange(offset + 1, offset + n + 1, dtype=np.float32) / self._block_size
+        return (start_gain + (end_gain - start_gain) * position).astype(np.float32)
+
+    def _apply_loudness_gain(self, chunk: Optional[np.ndarray], final: bool) -> np.ndarray:
+        """测量响度并按固定测量块施加增益；当前块需要等待测量时暂存"""
+        if chunk is not None and chunk.shape[1]:
+            if self.reference_lufs is None:
+                self._measure(chunk)
+        else:
+            chunk = np.zeros((self._x.shape[0], 0), dtype=np.float32)
+
+        output = []
+        position = 0
+        while True:
+            n = min(chunk.shape[1] - position, self._block_size - self._block_offset)
+            piece = chunk[:, position:position + n]
+            position += n
+            block_complete = self._block_offset + n == self._block_size
+
+            if self._block_ramp is None:
+                self._block_ramp = self._decide_block_ramp(block_complete or (final and position == chunk.shape[1]))
+            if self._block_ramp is None:
+                # 等待当前块测完
+                self._held.append(piece)
+            else:
+                if self._held:
+                    piece = np.concatenate(self._held + [piece], axis=1)
+                    self._held = []
+                offset = self._block_offset + n - piece.shape[1]
+                output.append(piece * self._ramp_gain(offset, piece.shape[1]))
+            self._block_offset += n
+
+            if block_complete:
+                self._block_index += 1
+                self._block_offset = 0
+                self._block_ramp = None
+            if position >= chunk.shape[1]:
+                break
+
+        if not output:
+            return np.zeros((self._x.shape[0], 0), dtype=np.float32)
+        return np.concatenate(output, axis=1) if len(output) > 1 else output[0]
+
+    def _true_peak(self, audio: np.ndarray) -> np.ndarray:
+        """过采样估计每个采样点的真峰值（跨声道取最大），相对输入滞后_tp_delay个采样
+
+        先用窗口内的采样峰值乘以插值放大上限筛选，只对可能超过限幅上限的位置做多相插值；
+        其余位置返回该上限估计（不超过限幅上限，对应增益恰为1，与精确插值结果相同）。
+        """
+        channels, n = audio.shape
+        taps = self._tp_phases.shape[0]
+        if self._tp_history is None:
+            self._tp_history = np.zeros((channels, taps - 1), dtype=np.float32)
+        extended = np.concatenate((self._tp_history, audio), axis=1)
+        self._tp_history = extended[:, n:]
+
+        envelope = np.abs(extended).max(axis=0)
+        if envelope.max() * self._tp_bound <= self.ceiling:
+            # 整块都不可能超过上限（常见情况），不需要逐点估计
+            return np.full(n, envelope.max() * self._tp_bound, dtype=np.float32)
+        peaks = (maximum_filter1d(envelope, taps, mode="nearest")[taps // 2:taps // 2 + n]
+                 * self._tp_bound).astype(np.float32)
+        candidates = np.flatnonzero(peaks > self.ceiling)
+        if len(candidates):
+            windows = sliding_window_view(extended, taps, axis=-1)[:, candidates]
+            peaks[candidates] = np.abs(windows @ self._tp_phases).max(axis=(0, 2))
+        return peaks
+
+    def _limit(self, scaled: np.ndarray, final: bool) -> np.ndarray:
+        """前瞻限幅：滑动窗口最小增益 + 等长平滑，保证输出不超过真峰值上限"""
+        L = self.lookahead
+        feed = [scaled] if scaled.shape[1] else []
+        if final:
+            # 用静音冲刷插值滤波器，得到最后_tp_delay个采样的峰值
+            feed.append(np.zeros((self._x.shape[0], self._tp_delay), dtype=np.float32))
+        for block in feed:
+            peaks = self._true_peak(block)
+            raw_gain = np.minimum(1.0, self.ceiling / np.maximum(peaks, 1e-12)).astype(np.float32)
+            if self._tp_skip:
+                skip = min(self._tp_skip, len(raw_gain))
+                raw_gain = raw_gain[skip:]
+                self._tp_skip -= skip
+            self._g = np.concatenate((self._g, raw_gain))
+        if scaled.shape[1]:
+            self._x = np.concatenate((self._x, scaled), axis=1)
+
+        gains = self._g[:self._x.shape[1]]
+        if final:
+            # 信号结束后视为静音，不需要再压低增益
+            gains = np.concatenate((gains, np.ones(L - 1, dtype=np.float32)))
+        n_ready = min(len(gains) - (L - 1), self._x.shape[1])
+        if n_ready <= 0:
+            return np.zeros((self._x.shape[0], 0), dtype=np.float32)
+
+        # 前瞻最小值: gmin[i] = min(g[i : i+L])；整段都不需要限幅时跳过滤波
+        window = gains[:n_ready + L - 1]
+        if window.min() >= 1.0:
+            gmin = np.ones(n_ready, dtype=np.float32)
+        else:
+            gmin = minimum_filter1d(window, L, mode="nearest")[L // 2:L // 2 + n_ready]
+
+        # 等长滑动平均: 每个输出采样的增益不高于其自身所需增益
+        extended = np.concatenate((self._gmin_history, gmin))
+        cumulative = np.concatenate(([0.0], np.cumsum(extended, dtype=np.float64)))
+        smooth = ((cumulative[L:] - cumulative[:-L]) / L).astype(np.float32)
+
+        output = self._x[:, :n_ready] * smooth
+        self._gmin_history = extended[-(L - 1):]
+        self._x = self._x[:, n_ready:]
+        self._g = self._g[n_ready:]
+        return output
+
+
+def iter_normalized(chunks: Iterable[np.ndarray], sr: int, **kwargs) -> Iterator[np.ndarray]:
+    """对音频块流做流式响度标准化，边处理边输出"""
+    normalizer = StreamingLoudnessNormalizer(sr, **kwargs)
+    for chunk in chunks:
+        out = normalizer.process(chunk)
+        if out.shape[-1]:
+            yield out
+    out = normalizer.flush()
+    if out.shape[-1]:
+        yield out
+
+
+def normalize_loudness(audio: np.ndarray, sr: int, two_pass: bool = False,
+                       chunk_seconds: float = 1.0, **kwargs) -> np.ndarray:
+    """对完整音频做响度标准化
+
+    two_pass=True 时先廉价地测量整段积分响度再以固定增益处理，
+    否则按块流式处理（与实时输出的结果一致）。
+    """
+    audio = as_float32(audio)
+    if two_pass:
+        kwargs["reference_lufs"] = measure_integrated_loudness(audio, sr)
+    chunk = max(1, int(chunk_seconds * sr))
+    pieces = list(iter_normalized(
+        (audio[..., i:i + chunk] for i in range(0, audio.shape[-1], chunk)), sr, **kwargs
+    ))
+    if not pieces:
+        return audio.copy()
+    return np.concatenate(pieces, axis=-1)
@@ -0,0 +1,374 @@
+import contextvars
+import hashlib
+import threading
+import time
+import numpy as np
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from dsp_utils import as_float32, peak_abs
+from job_queue import report_progress
+from profiling import request_profiler
+
+
+class Node:
+    """处理图中的一个阶段，键由操作、参数和输入节点的键共同决定"""
+
+    __slots__ = ("op", "params", "inputs", "key")
+
+    def __init__(self, op: str, inputs: Tuple["Node", ...], params: dict):
+        self.op = op
+        self.params = params
+        self.inputs = inputs
+        self.key = (op, tuple(sorted(params.items())), tuple(node.key for node in inputs))
+
+    @property
+    def label(self) -> str:
+        """用于日志和计时的可读名称"""
+        if not self.params:
+            return self.op
+        args = ", ".join(f"{k}={v}" for k, v in sorted(self.params.items()))
+        return f"{self.op}({args})"
+
+
+class ProcessingGraph:
+    """声明式处理图 - 相同的子图只会创建一次（哈希共享）"""
+
+    def __init__(self):
+        self._nodes: Dict[tuple, Node] = {}
+        self.source = self._add("input")
+
+    def _add(self, op: str, *inputs: Node, **params) -> Node:
+        node = Node(op, inputs, params)
+        # 相同操作+参数+输入的节点直接复用，实现子图去重
+        return self._nodes.setdefault(node.key, node)
+
+    def analyze(self, x: Optional[Node] = None) -> Node:
+        """音频特征分析"""
+        return self._add("analyze", x or self.source)
+
+    def ai(self, x: Node, model: str) -> Node:
+        """AI模型处理"""
+        return self._add("ai", x, model=model)
+
+    def traditional(self, x: Node, level: str) -> Node:
+        """传统信号处理"""
+        return self._add("traditional", x, level=level)
+
+    def blend(self, ai: Node, traditional: Node, ratio: float) -> Node:
+        """按比例混合两路结果（ratio为第一路的权重）"""
+        return self._add("blend", ai, traditional, ratio=float(ratio))
+
+    def normalize(self, x: Node, mode: str) -> Node:
+        """有效性检查与输出标准化"""
+        return self._add("normalize", x, self.source, mode=mode)
+
+    def chain(self, steps: List[dict], x: Optional[Node] = None) -> Node:
+        """按步骤列表构建自定义处理链
+
+        每一步为 {"op": "ai", "model": ...}、{"op": "traditional", "level": ...}
+        或 {"op": "blend", "ratio": ..., "branches": [步骤列表, 步骤列表]}。
+        """
+        node = x or self.source
+        for step in steps:
+            op = step.get("op")
+            if op == "ai":
+                node = self.ai(node, step["model"])
+            elif op == "traditional":
+                node = self.traditional(node, step.get("level", "medium"))
+            elif op == "blend":
+                first, second = step["branches"]
+                node = self.blend(self.chain(first, node), self.chain(second, node), step.get("ratio", 0.5))
+            else:
+                raise ValueError(f"未知的处理步骤: {op}")
+        return node
+
+
+def describe_chain(steps: List[dict]) -> str:
+    """生成自定义处理链的可读描述"""
+    parts = []
+    for step in steps:
+        if step.get("op") == "ai":
+            parts.append(step["model"])
+        elif step.get("op") == "traditional":
+            parts.append(f"传统{step.get('level', 'medium')}")
+        elif step.get("op") == "blend":
+            first, second = step["branches"]
+            parts.append(f"[{describe_chain(first)} | {describe_chain(second)}]×{step.get('ratio', 0.5):.1f}")
+    return " → ".join(parts)
+
+
+def _chain_uses(steps: List[dict], op: str) -> bool:
+    """判断自定义处理链中是否包含指定操作"""
+    for step in steps:
+        if step.get("op") == op:
+            return True
+        if step.get("op") == "blend" and any(_chain_uses(branch, op) for branch in step["branches"]):
+            return True
+    return False
+
+
+class GraphExecutor:
+    """处理图执行器 - 按拓扑层级执行，同层独立节点并发运行，昂贵节点的结果跨请求缓存"""
+
+    # 结果可跨请求缓存的操作（输出只依赖输入音频和参数）
+    CACHEABLE_OPS = {"analyze", "ai", "traditional"}
+
+    def __init__(self, enhancer, max_workers: int = 2, cache_size: int = 256 * 1024 * 1024,
+                 max_cacheable_bytes: int = 32 * 1024 * 1024):
+        """cache_size: 缓存结果的总字节上限（0表示关闭缓存）
+        max_cacheable_bytes: 超过该大小的输入音频不计算指纹也不缓存（长音频几乎不会重复提交）
+        max_workers: 单次请求内同层节点的最大并发数
+        """
+        self.enhancer = enhancer
+        self.cache_size = cache_size
+        self.max_cacheable_bytes = max_cacheable_bytes
+        self._cache = OrderedDict()
+        self._cache_bytes = 0
+        self._cache_lock = threading.Lock()
+        self.max_workers = max_workers
+        self._ops: Dict[str, Callable] = {
+            "input": lambda node, inputs, audio, sr, stats: audio,
+            "analyze": lambda node, inputs, audio, sr, stats: self.enhancer._analyze_audio_features(inputs[0], sr),
+            "ai": self._run_ai,
+            "traditional": lambda node, inputs, audio, sr, stats: self.enhancer.process_traditional_only(
+                inputs[0], sr, node.params["level"]),
+            "blend": lambda node, inputs, audio, sr, stats: self.enhancer.blend_results(
+                inputs[0], inputs[1], node.params["ratio"]),
+            "normalize": self._run_normalize,
+        }
+
+    def _run_ai(self, node, inputs, audio, sr, stats):
+        result = self.enhancer.process_ai_only(inputs[0], sr, node.params["model"])
+        if not self.enhancer.ai_enhancer.is_model_loaded(node.params["model"]):
+            # 模型加载失败时的传统备选结果不应被缓存为AI输出
+            stats["uncacheable"].add(node.key)
+        return result
+
+    def _run_normalize(self, node, inputs, audio, sr, stats):
+        report_progress("质量检查与标准化", 0.95)
+        enhanced, source = as_float32(inputs[0]), inputs[1]
+        peak = peak_abs(enhanced)
+        if not np.isfinite(peak):
+            print("⚠️ 处理结果包含无效数值，使用原始音频")
+            stats["events"].append("invalid_output_fallback")
+            enhanced, peak = source, peak_abs(source)
+        result = self.enhancer.normalize_output(enhanced, source, sr, peak, node.params["mode"])
+        # 不标准化时结果可能直接是只读的缓存数组，返回给调用方前复制
+        return result if result.flags.writeable else result.copy()
+
+    @staticmethod
+    def _levels(output: Node) -> List[List[Node]]:
+        """按依赖深度分层，同一层的节点互不依赖"""
+        depth: Dict[tuple, int] = {}
+        nodes: Dict[tuple, Node] = {}
+
+        def visit(node: Node) -> int:
+            if node.key not in depth:
+                depth[node.key] = 1 + max((visit(i) for i in node.inputs), default=-1)
+                nodes[node.key] = node
+            return depth[node.key]
+
+        visit(output)
+        levels = [[] for _ in range(max(depth.values()) + 1)]
+        for key, d in depth.items():
+            levels[d].append(nodes[key])
+        return levels
+
+    def cacheable(self, audio: np.ndarray) -> bool:
+        """输入音频是否参与跨请求缓存"""
+        return 0 < audio.nbytes <= min(self.cache_size, self.max_cacheable_bytes)
+
+    @staticmethod
+    def _nbytes(value) -> int:
+        """缓存结果占用的字节数（数组按数据大小计，容器递归累加）"""
+        if isinstance(value, np.ndarray):
+            return value.nbytes
+        if isinstance(value, dict):
+            return sum(GraphExecutor._nbytes(v) for v in value.values())
+        if isinstance(value, (list, tuple)):
+            return sum(GraphExecutor._nbytes(v) for v in value)
+        return 0
+
+    @staticmethod
+    def fingerprint(audio: np.ndarray, sr: int) -> str:
+        """输入音频的内容指纹，用作跨请求缓存键"""
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(str((audio.shape, audio.dtype.str, sr)).encode())
+        digest.update(memoryview(np.ascontiguousarray(audio)).cast("B"))
+        return digest.hexdigest()
+
+    def _cache_get(self, key):
+        with self._cache_lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return True, self._cache[key]
+        return False, None
+
+    def _cache_put(self, key, value, inputs: list):
+        nbytes = self._nbytes(value)
+        if self.cache_size <= 0 or nbytes > self.cache_size:
+            return
+        if isinstance(value, np.ndarray):
+            if any(isinstance(i, np.ndarray) and np.may_share_memory(value, i) for i in inputs):
+                # 直通节点返回的是调用方的数组，缓存私有副本，不能冻结调用方的数据
+                value = value.copy()
+            # 缓存的数组只读，防止下游原地修改
+            value.flags.writeable = False
+        with self._cache_lock:
+            if key in self._cache:
+                self._cache_bytes -= self._nbytes(self._cache.pop(key))
+            self._cache[key] = value
+            self._cache_bytes += nbytes
+            # 按最近最少使用淘汰，直到总字节数不超过上限
+            while self._cache_bytes > self.cache_size:
+                _, evicted = self._cache.popitem(last=False)
+                self._cache_bytes -= self._nbytes(evicted)
+
+    def clear_cache(self):
+        """清空节点结果缓存"""
+        with self._cache_lock:
+            self._cache.clear()
+            self._cache_bytes = 0
+
+    def _cache_key(self, node: Node, fingerprint: Optional[str]):
+        """缓存键：输入指纹 + 节点键；AI节点另含模型版本与STFT参数"""
+        if not fingerprint or node.op not in self.CACHEABLE_OPS:
+            return None
+        if node.op == "ai":
+            return fingerprint, node.key, self.enhancer.ai_enhancer.model_version(node.params["model"])
+        return fingerprint, node.key
+
+    def _execute(self, node: Node, values: dict, audio, sr, fingerprint, stats) -> Tuple[Any, float, bool]:
+        cache_key = self._cache_key(node, fingerprint)
+        if cache_key is not None:
+            hit, value = self._cache_get(cache_key)
+            if hit:
+                return value, 0.0, True
+
+        start = time.perf_counter()
+        inputs = [values[i.key] for i in node.inputs]
+        value = self._ops[node.op](node, inputs, audio, sr, stats)
+        elapsed = time.perf_counter() - start
+
+        if cache_key is not None and node.key not in stats["uncacheable"]:
+            # 处理期间可能加载了模型，按处理后的模型版本登记
+            self._cache_put(self._cache_key(node, fingerprint), value, inputs + [audio])
+        return value, elapsed, False
+
+    def run(self, output: Node, audio: np.ndarray, sr: int,
+            values: Optional[dict] = None, fingerprint: Optional[str] = None) -> Tuple[Any, dict]:
+        """执行处理图直到output节点，返回(结果, 统计信息)
+
+        values: 同一请求中已计算的节点结果（按节点键），可在多次run之间复用
+        """
+        values = {} if values is None else values
+        stats = {"timings": {}, "cache_hits": [], "events": [], "uncacheable": set()}
+        if fingerprint is None and self.cacheable(audio):
+            fingerprint = self.fingerprint(audio, sr)
+
+        for level in self._levels(output):
+            todo = [node for node in level if node.key not in values]
+            if len(todo) == 1 or request_profiler.active_in_current_thread:
+                # 性能分析时串行执行，保证所有阶段都记录在被分析的线程上
+                results = [self._execute(node, values, audio, sr, fingerprint, stats) for node in todo]
+            elif todo:
+                # 线程池按请求创建，并发请求的分支互不排队；
+                # 每个任务复制当前上下文，保证进度/取消检查在线程中同样生效
+                with ThreadPoolExecutor(max_workers=min(len(todo), self.max_workers),
+                                        thread_name_prefix="audiohd-graph") as pool:
+                    futures = [pool.submit(contextvars.copy_context().run, self._execute,
+                                           node, values, audio, sr, fingerprint, stats)
+                               for node in todo]
+                    results = [future.result() for future in futures]
+            else:
+                results = []
+
+            for node, (value, elapsed, cached) in zip(todo, results):
+                values[node.key] = value
+                stats["timings"][node.label] = round(elapsed, 4)
+                if cached:
+                    stats["cache_hits"].append(node.label)
+
+        del stats["uncacheable"]
+        return values[output.key], stats
+
+
+# 标准处理模式的图构建函数：(graph, settings, features) -> (输出节点, 描述)
+ModeBuilder = Callable[[ProcessingGraph, dict, dict], Tuple[Node, dict]]
+
+
+def _describe(method_used: str, details: str, ai_used: bool, traditional_used: bool) -> dict:
+    return {
+        "method_used": method_used,
+        "actual_method_details": details,
+        "ai_used": ai_used,
+        "traditional_used": traditional_used,
+    }
+
+
+def build_traditional_only(g: ProcessingGraph, s: dict, features: dict):
+    node = g.traditional(g.source, s["enhancement_level"])
+    return node, _describe(f"传统处理 ({s['enhancement_level']})",
+                           f"仅传统信号处理，级别：{s['enhancement_level']}", False, True)
+
+
+def build_ai_only(g: ProcessingGraph, s: dict, features: dict):
+    node = g.ai(g.source, s["ai_model"])
+    return node, _describe(f"AI处理 ({s['ai_model']})", f"仅AI模型处理：{s['ai_model']}", True, False)
+
+
+def build_ai_then_traditional(g: ProcessingGraph, s: dict, features: dict):
+    node = g.traditional(g.ai(g.source, s["ai_model"]), s["enhancement_level"])
+    return node, _describe(f"AI→传统 ({s['ai_model']} + {s['enhancement_level']})",
+                           f"AI优先：{s['ai_model']} → 传统{s['enhancement_level']}", True, True)
+
+
+def build_traditional_then_ai(g: ProcessingGraph, s: dict, features: dict):
+    node = g.ai(g.traditional(g.source, s["enhancement_level"]), s["ai_model"])
+    return node, _describe(f"传统→AI ({s['enhancement_level']} + {s['ai_model']})",
+                           f"传统优先：{s['enhancement_level']} → {s['ai_model']}", True, True)
+
+
+def build_parallel_blend(g: ProcessingGraph, s: dict, features: dict):
+    ratio = s["blend_ratio"]
+    node = g.blend(g.ai(g.source, s["ai_model"]),
+                   g.traditional(g.source, s["enhancement_level"]), ratio)
+    return node, _describe(f"并行混合 ({s['ai_model']} + {s['enhancement_level']}, 比例:{ratio:.1f})",
+                           f"并行混合：{s['ai_model']}({ratio:.1f}) + 传统{s['enhancement_level']}({1 - ratio:.1f})",
+                           True, True)
+
+
+def build_adaptive_hybrid(g: ProcessingGraph, s: dict, features: dict):
+    # 复用已分析的特征选择策略，再构建对应的子图
+    mode, level, ratio = s["enhancer"].choose_adaptive_strategy(features)
+    node, _ = STANDARD_MODES[mode](g, dict(s, enhancement_level=level, blend_ratio=ratio), features)
+    if mode == "parallel_blend" and ratio == 0.5:
+        details = f"自适应选择：平衡混合 {s['ai_model']} + 传统处理"
+    else:
+        details = f"自适应选择：{s['ai_model']} + 传统处理"
+    return node, _describe("自适应混合", details, True, True)
+
+
+STANDARD_MODES: Dict[str, ModeBuilder] = {
+    "traditional_only": build_traditional_only,
+    "ai_only": build_ai_only,
+    "ai_then_traditional": build_ai_then_traditional,
+    "traditional_then_ai": build_traditional_then_ai,
+    "parallel_blend": build_parallel_blend,
+    "adaptive_hybrid": build_adaptive_hybrid,
+}
+
+
+def build_default(g: ProcessingGraph, s: dict, features: dict):
+    node = g.traditional(g.source, "medium")
+    return node, _describe("传统处理 (默认)", "默认传统处理", False, True)
+
+
+def build_custom_chain(steps: List[dict]) -> ModeBuilder:
+    """将步骤列表包装为模式构建函数"""
+    def builder(g: ProcessingGraph, s: dict, features: dict):
+        node = g.chain(steps)
+        return node, _describe(f"自定义处理链 ({describe_chain(steps)})", f"自定义：{describe_chain(steps)}",
+                               _chain_uses(steps, "ai"), _chain_uses(steps, "traditional"))
+    return builder
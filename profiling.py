@@ -0,0 +1,104 @@
+import cProfile
+import io
+import itertools
+import os
+import pstats
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+import torch
+
+
+class RequestProfiler:
+    """按需性能分析 - 对单次增强调用同时采集cProfile与torch profiler
+
+    每个请求可单独开启，也可按比例抽样（环境变量 AUDIOHD_PROFILE_SAMPLE）。
+    关闭时只有一次判断，没有任何额外开销。输出文件：
+    .prof（pstats，可用snakeviz/flameprof查看火焰图）、
+    .trace.json（Chrome trace，可在chrome://tracing或Perfetto中查看）、
+    .txt（算子耗时/内存与Python函数耗时摘要）。
+    """
+
+    def __init__(self, output_dir: Optional[str] = None, sample_rate: Optional[float] = None):
+        self.output_dir = output_dir or os.environ.get("AUDIOHD_PROFILE_DIR", "profiles")
+        if sample_rate is None:
+            sample_rate = float(os.environ.get("AUDIOHD_PROFILE_SAMPLE", "0"))
+        self.sample_rate = sample_rate
+        # cProfile和torch profiler都不能嵌套，同一进程同一时刻只分析一个调用
+        self._lock = threading.Lock()
+        self._counter = itertools.count()
+        self._active_thread = None
+
+    def should_profile(self, profile: Optional[bool] = None) -> bool:
+        """显式指定时按指定值，否则按抽样比例决定"""
+        if profile is not None:
+            return bool(profile)
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    @property
+    def active_in_current_thread(self) -> bool:
+        """当前线程是否正在被分析（cProfile只记录开启它的线程）"""
+        return self._active_thread == threading.get_ident()
+
+    @contextmanager
+    def profile(self, label: str = "enhance"):
+        """分析with块内的执行，产出文件路径写入yield的字典；已有分析进行中时yield None"""
+        if not self._lock.acquire(blocking=False):
+            print("⚠️ 已有调用正在进行性能分析，本次跳过")
+            yield None
+            return
+
+        try:
+            info = {}
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if torch.cuda.is_available():
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+
+            py_profiler = cProfile.Profile()
+            start = time.perf_counter()
+            with torch.profiler.profile(activities=activities, record_shapes=True,
+                                        profile_memory=True) as torch_profiler:
+                self._active_thread = threading.get_ident()
+                py_profiler.enable()
+                try:
+                    yield info
+                finally:
+                    py_profiler.disable()
+                    self._active_thread = None
+
+            info["wall_time"] = round(time.perf_counter() - start, 4)
+            info.update(self._export(label, py_profiler, torch_profiler))
+            print(f"🔬 性能分析已保存: {info['summary']}")
+        finally:
+            self._lock.release()
+
+    def _export(self, label: str, py_profiler: cProfile.Profile, torch_profiler) -> dict:
+        """写出pstats、Chrome trace和文本摘要"""
+        os.makedirs(self.output_dir, exist_ok=True)
+        stem = os.path.join(
+            self.output_dir,
+            f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{next(self._counter)}-{label}"
+        )
+        paths = {
+            "pstats": stem + ".prof",
+            "chrome_trace": stem + ".trace.json",
+            "summary": stem + ".txt",
+        }
+
+        py_profiler.dump_stats(paths["pstats"])
+        torch_profiler.export_chrome_trace(paths["chrome_trace"])
+
+        stream = io.StringIO()
+        pstats.Stats(py_profiler, stream=stream).sort_stats("cumulative").print_stats(30)
+        with open(paths["summary"], "w", encoding="utf-8") as f:
+            f.write("== torch算子 (按自身CPU耗时) ==\n")
+            f.write(torch_profiler.key_averages().table(sort_by="self_cpu_time_total", row_limit=25))
+            f.write("\n\n== Python函数 (按累计耗时) ==\n")
+            f.write(stream.getvalue())
+        return paths
+
+
+# 全局性能分析器实例
+request_profiler = RequestProfiler()
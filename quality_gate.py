@@ -0,0 +1,118 @@
+import os
+import numpy as np
+import torch
+import torchaudio
+import librosa
+from typing import List, Optional
+from ai_models import ai_enhancer
+from dsp_utils import as_float32
+import warnings
+warnings.filterwarnings("ignore")
+
+
+class QualityGate:
+    """无参考输入质量评估 - 为已足够干净的音频提供提前退出
+
+    分数为MOS量纲（1~5）。从整段音频中均匀截取若干片段分别打分，取最低分，
+    只有各部分都足够干净时才会跳过增强。若SQUIM主观模型（facebook_denoiser）已加载且配置了
+    非匹配的干净参考语音，则用模型批量打分；否则使用基于帧能量分布的
+    信噪比估计作为廉价代理。
+    """
+
+    SQUIM_SAMPLE_RATE = 16000
+
+    def __init__(self, max_seconds: float = 10.0, num_excerpts: int = 5,
+                 reference_path: Optional[str] = None):
+        # 每段音频总共只评估max_seconds秒（分成num_excerpts个片段），保持打分成本固定
+        self.max_seconds = max_seconds
+        self.num_excerpts = max(1, num_excerpts)
+        self.reference = None
+        reference_path = reference_path or os.environ.get("AUDIOHD_SQUIM_REFERENCE")
+        if reference_path:
+            self.load_reference(reference_path)
+
+    def load_reference(self, path: str):
+        """加载非匹配参考语音（任意干净语音，与输入内容无关）"""
+        try:
+            audio, _ = librosa.load(path, sr=self.SQUIM_SAMPLE_RATE, mono=True)
+            self.reference = torch.from_numpy(as_float32(audio))
+            print(f"✅ 质量评估参考语音已加载: {path}")
+        except Exception as e:
+            print(f"⚠️ 质量评估参考语音加载失败，使用代理评分: {str(e)}")
+            self.reference = None
+
+    def _excerpts(self, audio: np.ndarray, sr: int) -> List[np.ndarray]:
+        """在整段音频上均匀截取用于评估的片段，短音频整段评估"""
+        audio = as_float32(audio)
+        if len(audio) <= int(self.max_seconds * sr):
+            return [audio]
+        length = int(self.max_seconds * sr / self.num_excerpts)
+        starts = np.linspace(0, len(audio) - length, self.num_excerpts).astype(int)
+        return [audio[start:start + length] for start in starts]
+
+    def _squim_scores(self, excerpts: List[np.ndarray], sr: int, model) -> np.ndarray:
+        """使用SQUIM主观模型批量打分"""
+        batch = torch.nn.utils.rnn.pad_sequence(
+            [torch.from_numpy(excerpt) for excerpt in excerpts], batch_first=True
+        )
+        if sr != self.SQUIM_SAMPLE_RATE:
+            batch = torchaudio.functional.resample(batch, sr, self.SQUIM_SAMPLE_RATE)
+        reference = self.reference.unsqueeze(0).expand(batch.shape[0], -1)
+
+        device = ai_enhancer.device
+        with torch.no_grad():
+            scores = model(batch.to(device), reference.to(device))
+        return scores.cpu().numpy().astype(np.float32)
+
+    def _proxy_scores(self, excerpts: List[np.ndarray], sr: int) -> np.ndarray:
+        """廉价代理：20ms帧能量的高/低分位数之比估计信噪比，映射到MOS量纲"""
+        frame = max(1, int(0.02 * sr))
+        n_frames = max(1, max(len(excerpt) for excerpt in excerpts) // frame)
+
+        # 不等长片段以NaN填充后一次性计算
+        frame_power = np.full((len(excerpts), n_frames), np.nan, dtype=np.float32)
+        for i, excerpt in enumerate(excerpts):
+            count = len(excerpt) // frame
+            if count:
+                frames = excerpt[:count * frame].reshape(count, frame)
+                frame_power[i, :count] = np.einsum("ij,ij->i", frames, frames) / frame
+
+        speech, noise = np.nanpercentile(frame_power, [95, 10], axis=1)
+        snr_db = 10 * np.log10((speech + 1e-10) / (noise + 1e-10))
+        scores = 1.0 + 4.0 * np.clip((snr_db - 5.0) / 35.0, 0.0, 1.0)
+        # 过短无法评估的片段给最低分，不会触发跳过
+        scores[~np.isfinite(scores)] = 1.0
+        return scores.astype(np.float32)
+
+    def score_batch(self, audios: List[np.ndarray], sr: int) -> np.ndarray:
+        """批量评估输入质量，返回每段音频的MOS量纲分数（各片段中的最低分）"""
+        per_audio = [self._excerpts(audio, sr) for audio in audios]
+        excerpts = [excerpt for parts in per_audio for excerpt in parts]
+
+        scores = None
+        entry = ai_enhancer.get_model_entry("facebook_denoiser")
+        if entry is not None and self.reference is not None:
+            try:
+                scores = self._squim_scores(excerpts, sr, entry["model"])
+            except Exception as e:
+                print(f"⚠️ SQUIM质量评估失败，使用代理评分: {str(e)}")
+        if scores is None:
+            scores = self._proxy_scores(excerpts, sr)
+
+        bounds = np.cumsum([0] + [len(parts) for parts in per_audio])
+        return np.array([scores[bounds[i]:bounds[i + 1]].min() for i in range(len(audios))], dtype=np.float32)
+
+    def score(self, audio: np.ndarray, sr: int) -> float:
+        """评估单段音频质量"""
+        return float(self.score_batch([audio], sr)[0])
+
+    @property
+    def scorer_name(self) -> str:
+        """当前使用的评分方式"""
+        if self.reference is not None and ai_enhancer.is_model_loaded("facebook_denoiser"):
+            return "SQUIM"
+        return "SNR代理"
+
+
+# 全局质量门限实例
+quality_gate = QualityGate()
@@ -0,0 +1,261 @@
+import argparse
+import contextlib
+import os
+import tempfile
+import time
+import numpy as np
+import soundfile as sf
+from typing import List, Optional
+import app_hybrid
+from request_trace import load_trace
+from evaluation import synthetic_speech, colored_noise, mix_at_snr
+from job_queue import JobManager, JobQueueFull
+import warnings
+warnings.filterwarnings("ignore")
+
+# 吞吐量低于提供负载的该比例时视为饱和
+SATURATION_THROUGHPUT_RATIO = 0.9
+
+
+class SyntheticAudioCache:
+    """按追踪中的 (时长, 采样率, 声道数, 声道布局) 生成匹配的测试音频文件并缓存"""
+
+    # 合成信号的基础片段时长，更长的请求循环拼接
+    BASE_SECONDS = 10.0
+
+    def __init__(self, directory: Optional[str] = None):
+        self.directory = directory or tempfile.mkdtemp(prefix="audiohd-replay-")
+        self._files = {}
+
+    def get(self, duration: float, sr: int, channels: int = 1, shortcut: Optional[str] = None) -> str:
+        key = (round(duration, 1), int(sr), int(channels), shortcut if channels == 2 else None)
+        if key not in self._files:
+            self._files[key] = self._synthesize(*key)
+        return self._files[key]
+
+    def _synthesize(self, duration: float, sr: int, channels: int, shortcut: Optional[str]) -> str:
+        n_samples = max(1, int(duration * sr))
+        seed = len(self._files)
+        clean = np.resize(synthetic_speech(sr, min(duration, self.BASE_SECONDS) or 0.1, seed), n_samples)
+        noisy = mix_at_snr(clean, colored_noise("pink", n_samples, seed), 10.0)
+
+        if channels == 2:
+            # 按原请求的声道布局合成，保证立体声捷径的命中情况与线上一致
+            if shortcut == "dual_mono_duplicated":
+                second = noisy
+            elif shortcut == "mid_side":
+                second = noisy + 0.01 * colored_noise("white", n_samples, seed + 1)
+            else:
+                second = mix_at_snr(clean, colored_noise("pink", n_samples, seed + 1), 10.0)
+            audio = np.stack([noisy, second])
+        else:
+            audio = np.stack([noisy] * channels) if channels > 1 else noisy
+
+        path = os.path.join(self.directory, f"replay-{len(self._files)}.wav")
+        sf.write(path, audio.T, sr)
+        return path
+
+    def __len__(self) -> int:
+        return len(self._files)
+
+    def cleanup(self):
+        """删除生成的测试文件"""
+        for path in self._files.values():
+            if os.path.exists(path):
+                os.remove(path)
+        self._files.clear()
+
+
+def build_requests(traces: List[dict], audio_cache: SyntheticAudioCache) -> List[dict]:
+    """将追踪记录转换为 process_audio_hybrid 的参数"""
+    requests = []
+    for trace in traces:
+        if "duration" not in trace:
+            continue
+        path = audio_cache.get(trace["duration"], trace["sample_rate"], trace.get("channels", 1),
+                               trace.get("channel_shortcut"))
+        requests.append({
+            "timestamp": trace.get("timestamp", 0.0),
+            "args": (path, trace["processing_mode"], trace.get("enable_ai", True), trace["ai_model"],
+                     trace["enhancement_level"], trace["blend_ratio"], trace.get("quality_threshold") or 0.0),
+        })
+    return requests
+
+
+def run_load(requests: List[dict], concurrency: int, rate: Optional[float] = None,
+             max_pending: int = 8, num_requests: Optional[int] = None,
+             speedup: float = 1.0, seed: int = 0) -> dict:
+    """以指定并发和到达率驱动本地服务，返回吞吐量与延迟统计
+
+    rate: 泊松到达率（请求/秒）；为None时按追踪中的原始到达间隔（除以speedup）回放。
+    """
+    rng = np.random.default_rng(seed)
+    num_requests = num_requests or len(requests)
+    manager = JobManager(concurrency, max_pending, None)
+    jobs, rejected = [], 0
+
+    origin = requests[0]["timestamp"]
+    trace_span = requests[-1]["timestamp"] - origin
+    # 追踪的平均到达间隔（单条追踪没有间隔）
+    mean_interval = trace_span / (len(requests) - 1) if len(requests) > 1 else 0.0
+
+    start = time.monotonic()
+    arrival = start
+    for i in range(num_requests):
+        request = requests[i % len(requests)]
+        if rate:
+            arrival += rng.exponential(1.0 / rate)
+        else:
+            # 循环回放时整体顺延一个追踪周期（末条与下一轮首条之间补一个平均间隔）
+            cycle = (trace_span + mean_interval) * (i // len(requests))
+            arrival = start + (request["timestamp"] - origin + cycle) / speedup
+        delay = arrival - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+        try:
+            jobs.append(manager.submit(app_hybrid.process_audio_hybrid, *request["args"]))
+        except JobQueueFull:
+            rejected += 1
+
+    for job in jobs:
+        job.wait()
+    manager.shutdown()
+
+    # 清理服务端写出的结果文件
+    for job in jobs:
+        if job.result and job.result[0] and os.path.exists(job.result[0]):
+            os.remove(job.result[0])
+
+    # 泊松到达从start起累计了num_requests个间隔；按追踪回放时首条在start到达，
+    # 跨度只覆盖num_requests-1个间隔，补上一个平均间隔
+    offered_seconds = arrival - start if rate else arrival - start + mean_interval / speedup
+    end = max([job.finished_at for job in jobs], default=time.monotonic())
+    completed = [job for job in jobs if job.status == "done" and job.result and job.result[0]]
+    latencies = np.array([job.finished_at - job.created_at for job in completed])
+    queue_waits = np.array([job.started_at - job.created_at for job in completed])
+
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if len(latencies) else (np.nan,) * 3
+    return {
+        "concurrency": concurrency,
+        # 到达间隔为零（如单条追踪）时提供负载无定义
+        "offered_rate": num_requests / offered_seconds if offered_seconds > 0 else float("nan"),
+        "throughput": len(completed) / max(end - start, 1e-9),
+        "completed": len(completed),
+        "failed": len(jobs) - len(completed),
+        "rejected": rejected,
+        "p50": float(p50),
+        "p95": float(p95),
+        "p99": float(p99),
+        "mean_queue_wait": float(queue_waits.mean()) if len(queue_waits) else float("nan"),
+    }
+
+
+def is_saturated(row: dict, latency_slo: Optional[float] = None) -> bool:
+    """拒绝请求、吞吐量跟不上提供负载或超出延迟目标时视为饱和（提供负载无定义时不按吞吐量判断）"""
+    return bool(
+        row["rejected"] > 0
+        or row["throughput"] < SATURATION_THROUGHPUT_RATIO * row["offered_rate"]
+        or (latency_slo is not None and row["p95"] > latency_slo)
+    )
+
+
+def sweep(requests: List[dict], concurrencies: List[int], rates: List[Optional[float]],
+          latency_slo: Optional[float] = None, verbose: bool = False, **load_kwargs) -> List[dict]:
+    """对每个并发数依次提高到达率，记录各配置结果与饱和点"""
+    rows = []
+    for concurrency in concurrencies:
+        saturation = None
+        for rate in rates:
+            label = f"{rate:g}/s" if rate else "追踪原始节奏"
+            print(f"🚦 并发 {concurrency}，到达率 {label} ...")
+            with contextlib.ExitStack() as stack:
+                if not verbose:
+                    # 压测期间屏蔽处理过程的日志输出
+                    devnull = stack.enter_context(open(os.devnull, "w"))
+                    stack.enter_context(contextlib.redirect_stdout(devnull))
+                row = run_load(requests, concurrency, rate, **load_kwargs)
+            row["saturated"] = is_saturated(row, latency_slo)
+            if row["saturated"] and saturation is None and rate:
+                saturation = rate
+            rows.append(row)
+        for row in rows:
+            if row["concurrency"] == concurrency:
+                row["saturation_rate"] = saturation
+    return rows
+
+
+def format_report(rows: List[dict]) -> str:
+    """生成压测报告表格"""
+    header = (f"{'并发':>4} {'提供负载':>9} {'吞吐量':>8} {'完成':>5} {'失败':>4} {'拒绝':>4} "
+              f"{'P50(s)':>8} {'P95(s)':>8} {'P99(s)':>8} {'排队(s)':>8}  饱和")
+    lines = [header, "-" * len(header)]
+    for row in rows:
+        lines.append(
+            f"{row['concurrency']:>4} {row['offered_rate']:>9.2f} {row['throughput']:>8.2f} "
+            f"{row['completed']:>5} {row['failed']:>4} {row['rejected']:>4} "
+            f"{row['p50']:>8.2f} {row['p95']:>8.2f} {row['p99']:>8.2f} {row['mean_queue_wait']:>8.2f}  "
+            f"{'⚠️' if row['saturated'] else '✅'}"
+        )
+
+    lines.append("")
+    for concurrency in sorted({row["concurrency"] for row in rows}):
+        saturation = next(row["saturation_rate"] for row in rows if row["concurrency"] == concurrency)
+        sustained = [row["offered_rate"] for row in rows
+                     if row["concurrency"] == concurrency and not row["saturated"]
+                     and np.isfinite(row["offered_rate"])]
+        lines.append(
+            f"📈 并发 {concurrency}: 最大可持续负载 "
+            f"{max(sustained):.2f} 请求/秒" if sustained else f"📈 并发 {concurrency}: 所有负载均已饱和"
+        )
+        if saturation:
+            lines[-1] += f"，饱和点约 {saturation:g} 请求/秒"
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="回放请求追踪，对本地服务进行压测")
+    parser.add_argument("trace", help="app_hybrid.py --trace-file 记录的追踪文件")
+    parser.add_argument("--concurrency", nargs="*", type=int, default=[1, 2, 4], help="同时处理的任务数")
+    parser.add_argument("--rates", nargs="*", type=float, default=[],
+                        help="泊松到达率（请求/秒），不指定时按追踪中的原始节奏回放")
+    parser.add_argument("--speedup", type=float, default=1.0, help="按原始节奏回放时的加速倍数")
+    parser.add_argument("--requests", type=int, default=None, help="每个配置的请求数，默认与追踪条数相同")
+    parser.add_argument("--max-pending", type=int, default=8, help="排队等待的任务数上限")
+    parser.add_argument("--latency-slo", type=float, default=None, help="P95延迟目标（秒），超出视为饱和")
+    parser.add_argument("--workers", type=int, default=0, help="工作进程数，0表示单进程模式")
+    parser.add_argument("--preload", nargs="*", default=[], help="预加载的AI模型")
+    parser.add_argument("--keep-cache", action="store_true",
+                        help="保留处理图的节点缓存（合成音频重复出现，默认关闭以接近线上负载）")
+    parser.add_argument("--verbose", action="store_true", help="显示处理过程日志")
+    args = parser.parse_args()
+
+    if not args.keep_cache:
+        app_hybrid.hybrid_enhancer.graph_executor.cache_size = 0
+
+    traces = load_trace(args.trace)
+    audio_cache = SyntheticAudioCache()
+    requests = build_requests(traces, audio_cache)
+    if not requests:
+        raise SystemExit("❌ 追踪文件中没有可回放的请求")
+    print(f"📼 已加载 {len(requests)} 条请求追踪，合成测试音频 {len(audio_cache)} 个")
+
+    if args.workers > 0:
+        from worker_pool import EnhancementWorkerPool
+        app_hybrid.worker_pool = EnhancementWorkerPool(args.workers, args.preload)
+        app_hybrid.worker_pool.start()
+
+    try:
+        # 预热一次，避免首个配置包含库初始化开销
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            output_path = app_hybrid.process_audio_hybrid(*requests[0]["args"])[0]
+        if output_path and os.path.exists(output_path):
+            os.remove(output_path)
+        rows = sweep(requests, args.concurrency, args.rates or [None], args.latency_slo, args.verbose,
+                     max_pending=args.max_pending, num_requests=args.requests, speedup=args.speedup)
+        print()
+        print(format_report(rows))
+    finally:
+        audio_cache.cleanup()
+        if app_hybrid.worker_pool is not None:
+            app_hybrid.worker_pool.shutdown()
@@ -0,0 +1,49 @@
+import json
+import os
+import threading
+import time
+from typing import List, Optional
+
+
+class TraceRecorder:
+    """请求追踪记录器 - 每个请求追加一行JSON，用于回放压测和容量规划
+
+    通过环境变量 AUDIOHD_TRACE_FILE 或 --trace-file 开启，未开启时不做任何事。
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.environ.get("AUDIOHD_TRACE_FILE") or None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        """是否记录追踪"""
+        return self.path is not None
+
+    def record(self, trace: dict):
+        """追加一条请求记录"""
+        if not self.enabled:
+            return
+        trace = dict(trace, recorded_at=time.time())
+        line = json.dumps(trace, ensure_ascii=False, default=str)
+        try:
+            with self._lock, open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+        except Exception as e:
+            print(f"⚠️ 请求追踪写入失败: {str(e)}")
+
+
+def load_trace(path: str) -> List[dict]:
+    """读取追踪文件，按请求到达时间排序"""
+    traces = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                traces.append(json.loads(line))
+    traces.sort(key=lambda trace: trace.get("timestamp", 0))
+    return traces
+
+
+# 全局请求追踪实例
+trace_recorder = TraceRecorder()
@@ -0,0 +1,205 @@
+import contextlib
+import math
+import os
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+from hybrid_enhancer import hybrid_enhancer
+from job_queue import JobCancelled, report_progress
+from dsp_utils import as_float32, peak_abs
+from profiling import request_profiler
+from host_profile import host_profile
+from worker_pool import compute_threads_per_worker, limit_threads
+import warnings
+warnings.filterwarnings("ignore")
+
+# 未调优时的分段时长（秒）
+DEFAULT_SEGMENT_SECONDS = 30.0
+
+
+def tuned_segment_seconds(backend: str) -> float:
+    """本机调优配置中指定执行后端（thread_pool/process_pool）的分段时长，未调优时使用默认值"""
+    return host_profile.get("segment_seconds", {}).get(backend, DEFAULT_SEGMENT_SECONDS)
+
+
+def stft_alignment() -> int:
+    """分段对齐粒度：所有AI模型STFT帧移的最小公倍数"""
+    return math.lcm(*(params["hop_length"] for params in hybrid_enhancer.ai_enhancer.stft_params.values()))
+
+
+def plan_segments(n_samples: int, sr: int, segment_seconds: float = 30.0,
+                  crossfade_seconds: float = 0.5, warmup_seconds: float = 1.0,
+                  align: Optional[int] = None) -> List[dict]:
+    """规划重叠分段
+
+    每段的核心区间为 [boundary_k, boundary_k+1)，交叉淡化区以边界为中心；
+    处理窗口在两侧再各加 warmup 的上下文，使RNN隐藏状态和STFT边缘在
+    交叉淡化区之前就已稳定。所有位置（含交叉淡化区两端）按 align（STFT帧移）对齐，
+    保证各段的帧网格与整段顺序处理一致。
+    """
+    align = align or stft_alignment()
+
+    def aligned(seconds):
+        return max(align, int(round(seconds * sr / align)) * align)
+
+    step = aligned(segment_seconds)
+    # 先对半宽对齐再加倍，保证交叉淡化区两端都落在帧网格上
+    half_fade = aligned(crossfade_seconds / 2)
+    warmup = aligned(warmup_seconds)
+
+    boundaries = list(range(0, n_samples, step)) + [n_samples]
+    # 最后一段过短时并入前一段
+    if len(boundaries) > 2 and boundaries[-1] - boundaries[-2] < 2 * (half_fade + warmup):
+        boundaries.pop(-2)
+
+    segments = []
+    for k in range(len(boundaries) - 1):
+        core_start, core_end = boundaries[k], boundaries[k + 1]
+        fade_start = core_start - half_fade if k > 0 else 0
+        fade_end = core_end + half_fade if k < len(boundaries) - 2 else n_samples
+        segments.append({
+            "index": k,
+            "start": max(0, fade_start - warmup),
+            "end": min(n_samples, fade_end + warmup),
+            "fade_start": fade_start,
+            "fade_end": fade_end,
+            "fade_in": 2 * half_fade if k > 0 else 0,
+            "fade_out": 2 * half_fade if k < len(boundaries) - 2 else 0,
+        })
+    return segments
+
+
+def _stitch(segments: List[dict], outputs: List[np.ndarray], n_samples: int) -> np.ndarray:
+    """按线性交叉淡化拼接各段输出（相邻段权重之和为1）"""
+    stitched = np.zeros(n_samples, dtype=np.float32)
+    for segment, output in zip(segments, outputs):
+        offset = segment["fade_start"] - segment["start"]
+        length = segment["fade_end"] - segment["fade_start"]
+        part = np.zeros(length, dtype=np.float32)
+        available = as_float32(output[offset:offset + length])
+        part[:len(available)] = available
+
+        if segment["fade_in"]:
+            n = segment["fade_in"]
+            part[:n] *= (np.arange(n, dtype=np.float32) + 0.5) / n
+        if segment["fade_out"]:
+            n = segment["fade_out"]
+            part[-n:] *= 1.0 - (np.arange(n, dtype=np.float32) + 0.5) / n
+
+        stitched[segment["fade_start"]:segment["fade_end"]] += part
+    return stitched
+
+
+def enhance_long_audio(audio: np.ndarray, sr: int,
+                       processing_mode: str = "adaptive_hybrid",
+                       ai_model: str = "facebook_denoiser",
+                       enhancement_level: str = "medium",
+                       blend_ratio: float = 0.5,
+                       normalization: str = "loudness",
+                       segment_seconds: Optional[float] = None,
+                       crossfade_seconds: float = 0.5,
+                       warmup_seconds: float = 1.0,
+                       worker_pool=None,
+                       num_workers: Optional[int] = None,
+                       quality_threshold: Optional[float] = None,
+                       quality_score: Optional[float] = None,
+                       profile: Optional[bool] = None) -> Tuple[np.ndarray, dict]:
+    """将一段长音频切分为重叠片段并行增强，再交叉淡化拼接
+
+    worker_pool: EnhancementWorkerPool实例（多进程）；为None时使用线程池，
+    num_workers个线程（默认不超过CPU核心数），每个线程的torch/BLAS线程数限制为 CPU核心数 // num_workers。
+    特征分析与标准化在整段上只做一次，保证各段的自适应决策和电平一致。
+    segment_seconds: 每段时长，None时使用本机针对当前执行后端的调优配置（默认30秒）
+    profile: 对整段的调度过程做性能分析（各分段本身不单独分析）
+    """
+    if request_profiler.should_profile(profile):
+        with request_profiler.profile("long_audio") as profile_info:
+            enhanced, metadata = enhance_long_audio(
+                audio, sr, processing_mode, ai_model, enhancement_level, blend_ratio,
+                normalization, segment_seconds, crossfade_seconds,
+                warmup_seconds, worker_pool, num_workers, quality_threshold, quality_score,
+                profile=False
+            )
+        if profile_info:
+            metadata["profile"] = profile_info
+        return enhanced, metadata
+
+    backend = "process_pool" if worker_pool is not None else "thread_pool"
+    segment_seconds = segment_seconds or tuned_segment_seconds(backend)
+    audio = as_float32(audio)
+    n_samples = len(audio)
+    if n_samples == 0 or not np.isfinite(peak_abs(audio)):
+        return hybrid_enhancer.enhance_audio(audio, sr, processing_mode, ai_model,
+                                             enhancement_level, blend_ratio, normalization,
+                                             profile=False)
+
+    # 质量门限在整段上判定一次（评分片段均匀分布在整段音频上）
+    gate_info = hybrid_enhancer.check_quality_gate(audio, sr, quality_threshold, quality_score)
+    if gate_info is not None and gate_info["skipped"]:
+        return hybrid_enhancer.skip_enhancement(audio, sr, peak_abs(audio), normalization, None, gate_info)
+
+    segments = plan_segments(n_samples, sr, segment_seconds, crossfade_seconds, warmup_seconds)
+    print(f"✂️ 长音频分段并行处理: {n_samples / sr:.1f}秒 → {len(segments)} 段")
+
+    report_progress("整段音频特征分析", 0.02)
+    features = hybrid_enhancer._analyze_audio_features(audio, sr)
+
+    # 各段不单独标准化，由整段统一处理
+    args = (processing_mode, ai_model, enhancement_level, blend_ratio, "none", features)
+
+    executor = None
+    limits = contextlib.ExitStack()
+    if worker_pool is not None:
+        submit = lambda seg: worker_pool.submit(audio[seg["start"]:seg["end"]], sr, *args, profile=False)
+        # 等待期间检查取消/截止时间，终止时回收正在处理的工作进程
+        collect = lambda handle: handle.wait()
+    else:
+        num_workers = num_workers or min(len(segments), os.cpu_count() or 1)
+        # 各段线程共享进程的算子线程池，按线程数均分核心，避免超额订阅
+        limits.enter_context(limit_threads(compute_threads_per_worker(num_workers)))
+        executor = ThreadPoolExecutor(max_workers=num_workers)
+        submit = lambda seg: executor.submit(hybrid_enhancer.enhance_audio,
+                                             audio[seg["start"]:seg["end"]], sr, *args, profile=False)
+        collect = lambda handle: handle.result()
+
+    handles = []
+    try:
+        handles = [submit(segment) for segment in segments]
+        outputs, metadata_list = [], []
+        for k, handle in enumerate(handles):
+            output, metadata = collect(handle)
+            if not metadata.get("success", False):
+                raise RuntimeError(f"第 {k + 1} 段处理失败: {metadata.get('error', '未知错误')}")
+            outputs.append(output)
+            metadata_list.append(metadata)
+            # 分段之间的进度报告同时是取消检查点
+            report_progress(f"分段处理 {k + 1}/{len(segments)}", 0.05 + 0.85 * (k + 1) / len(segments))
+    except JobCancelled:
+        # 取消尚未完成的分段（线程池只能取消未开始的，进程池会终止正在运行的）
+        for handle in handles:
+            handle.cancel()
+        raise
+    except Exception as e:
+        for handle in handles:
+            handle.cancel()
+        print(f"❌ 分段并行处理失败: {str(e)}")
+        return audio, {"error": str(e), "success": False}
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=False)
+        limits.close()
+
+    report_progress("拼接与标准化", 0.92)
+    enhanced = _stitch(segments, outputs, n_samples)
+    enhanced = hybrid_enhancer.normalize_output(enhanced, audio, sr, peak_abs(enhanced), normalization)
+
+    metadata = dict(metadata_list[0])
+    metadata.update({
+        "normalization": normalization,
+        "quality_gate": gate_info,
+        "segments": len(segments),
+        "segment_seconds": segment_seconds,
+        "parallel_backend": backend,
+    })
+    print(f"✅ 分段并行处理完成: {len(segments)} 段")
+    return enhanced, metadata
@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+from ai_models import ai_enhancer
+
+SR = 16000
+
+
+@pytest.mark.parametrize("model_name", ["rnnoise", "speechbrain_enhance", "facebook_denoiser"])
+def test_unload_during_processing_uses_snapshot(model_name):
+    """处理开始后模型被并发卸载时，仍使用enhance_audio取得的快照完成处理"""
+    if not ai_enhancer.download_and_load_model(model_name):
+        pytest.skip(f"模型 {model_name} 无法加载")
+    entry = ai_enhancer.get_model_entry(model_name)
+
+    def unloading_processor(*args):
+        ai_enhancer.unload_model(model_name)
+        return entry["processor"](*args)
+
+    audio = (0.1 * np.random.default_rng(0).standard_normal(SR)).astype(np.float32)
+    try:
+        expected = ai_enhancer.enhance_audio(audio, SR, model_name)
+        ai_enhancer._register_model(model_name, dict(entry, processor=unloading_processor))
+        enhanced = ai_enhancer.enhance_audio(audio, SR, model_name)
+    finally:
+        ai_enhancer._register_model(model_name, entry)
+
+    assert not np.array_equal(enhanced, audio)
+    np.testing.assert_allclose(enhanced, expected, atol=1e-6)
@@ -0,0 +1,27 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("app")
+import autotune
+
+
+def test_tune_segments_measures_the_requested_backend(monkeypatch):
+    calls = []
+
+    def fake_long_audio(audio, sr, segment_seconds=None, worker_pool=None, **kwargs):
+        calls.append((segment_seconds, worker_pool))
+        return audio, {"success": True}
+
+    monkeypatch.setattr(autotune, "enhance_long_audio", fake_long_audio)
+    clean = np.sin(np.linspace(0, 400, 16000)).astype(np.float32)
+    cases = [{"clean": clean, "noisy": clean + 0.01}]
+    pool = object()
+
+    result = autotune.tune_segments(cases, 16000, repeats=1, max_quality_loss=0.5, worker_pool=pool)
+    assert {seconds for seconds, _ in calls} == set(autotune.SEGMENT_SECONDS_CANDIDATES)
+    assert all(worker_pool is pool for _, worker_pool in calls)
+    assert result["best"] in autotune.SEGMENT_SECONDS_CANDIDATES
+
+    calls.clear()
+    autotune.tune_segments(cases, 16000, repeats=1, max_quality_loss=0.5)
+    assert all(worker_pool is None for _, worker_pool in calls)
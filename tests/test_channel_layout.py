@@ -0,0 +1,63 @@
+import json
+import numpy as np
+import pytest
+from channel_layout import analyze_channel_layout, SIDE_RATIO_FLOOR_DB
+
+
+def test_dual_mono_metadata_is_strict_json():
+    left = np.sin(np.linspace(0, 100, 16000)).astype(np.float32)
+    info = analyze_channel_layout(left, left.copy())
+    assert info["layout"] == "dual_mono"
+    assert info["side_ratio_db"] == SIDE_RATIO_FLOOR_DB
+    json.dumps(info, allow_nan=False)
+
+
+def test_near_identical_channels_respect_floor():
+    left = np.sin(np.linspace(0, 100, 16000)).astype(np.float32)
+    right = left + 5e-3 * np.cos(np.linspace(0, 300, 16000)).astype(np.float32)
+    info = analyze_channel_layout(left * 1e-3, right * 1e-3)
+    assert info["layout"] != "dual_mono"
+    assert info["side_ratio_db"] >= SIDE_RATIO_FLOOR_DB
+    json.dumps(info, allow_nan=False)
+
+
+class _RecordingPool:
+    """记录提交参数的工作进程池替身，任务原样返回输入"""
+    
+    def __init__(self):
+        self.submitted = []
+    
+    def submit(self, audio, sr, *args, **kwargs):
+        self.submitted.append((args, kwargs))
+        
+        class _Task:
+            def wait(self):
+                return audio, {"success": True}
+            
+            def cancel(self):
+                pass
+        return _Task()
+
+
+def test_mid_side_channels_both_go_through_worker_pool(monkeypatch):
+    pytest.importorskip("app")
+    pytest.importorskip("gradio")
+    import app_hybrid
+
+    def _in_process(*args, **kwargs):
+        raise AssertionError("服务进程内不应直接处理声道")
+
+    pool = _RecordingPool()
+    monkeypatch.setattr(app_hybrid, "worker_pool", pool)
+    monkeypatch.setattr(app_hybrid.hybrid_enhancer, "enhance_audio", _in_process)
+
+    t = np.linspace(0, 400, 16000)
+    left = (0.3 * np.sin(t)).astype(np.float32)
+    right = (left + 0.01 * np.cos(3 * t)).astype(np.float32)
+    settings = ("hybrid", "rnnoise", "medium", 0.5)
+    enhanced, metadata = app_hybrid._enhance_stereo(np.stack([left, right]), 16000, settings, {"profile": False})
+
+    assert metadata["channel_shortcut"] == "mid_side"
+    assert enhanced.shape == (2, 16000)
+    assert [args for args, _ in pool.submitted] == [settings, ("traditional_only", "rnnoise", "basic", 0.5)]
+    assert all(kwargs["normalization"] == "none" for _, kwargs in pool.submitted)
@@ -0,0 +1,103 @@
+import os
+import threading
+import time
+import numpy as np
+import pytest
+import soundfile as sf
+
+pytest.importorskip("app")
+import corpus_index  # noqa: E402
+from corpus_index import CorpusIndex, DEFAULT_REALTIME_FACTORS, plan_batch, predict_loads  # noqa: E402
+
+SR = 16000
+
+
+def _write(path, amplitude: float = 0.1, seconds: float = 0.5):
+    t = np.arange(int(SR * seconds)) / SR
+    sf.write(str(path), (amplitude * np.sin(2 * np.pi * 220 * t)).astype(np.float32), SR)
+    return str(path)
+
+
+def _entry(name: str, duration: float, mode: str = "traditional_only", channels: int = 1) -> dict:
+    return {"path": name, "hash": name, "duration": duration, "channels": channels,
+            "features": [{}] * channels, "adaptive_mode": mode}
+
+
+def test_plan_is_longest_first_and_loads_follow_lpt():
+    entries = [_entry(name, duration) for name, duration in
+               [("a", 30.0), ("b", 70.0), ("c", 40.0), ("d", 30.0), ("e", 50.0), ("f", 20.0)]]
+    factors = {"traditional_only": 0.1}
+    tasks = plan_batch(entries, "traditional_only", factors)
+
+    assert [task["path"] for task in tasks] == ["b", "e", "c", "a", "d", "f"]
+    assert [task["cost"] for task in tasks] == pytest.approx([7.0, 5.0, 4.0, 3.0, 3.0, 2.0])
+    assert predict_loads(tasks, 2) == pytest.approx([12.0, 12.0])
+    assert predict_loads(tasks, 1) == pytest.approx([24.0])
+
+
+def test_adaptive_mode_routes_cost_by_indexed_strategy():
+    entries = [_entry("ai", 10.0, mode="ai_only", channels=2), _entry("dsp", 10.0)]
+    tasks = plan_batch(entries, "adaptive_hybrid", DEFAULT_REALTIME_FACTORS)
+    assert [task["mode"] for task in tasks] == ["ai_only", "traditional_only"]
+    assert tasks[0]["cost"] == pytest.approx(DEFAULT_REALTIME_FACTORS["ai_only"] * 20.0)
+
+
+def test_resolve_hash_reuses_digest_until_file_changes(monkeypatch, tmp_path):
+    index = CorpusIndex(str(tmp_path / "index.sqlite"))
+    path = _write(tmp_path / "clip.wav")
+    computed = []
+    real_hash = corpus_index.file_hash
+    monkeypatch.setattr(corpus_index, "file_hash", lambda p: computed.append(p) or real_hash(p))
+
+    digest = index._resolve_hash(path)
+    assert index._resolve_hash(path) == digest
+    assert len(computed) == 1
+
+    # 内容不变但修改时间变化：重新计算，哈希相同
+    stat = os.stat(path)
+    os.utime(path, (stat.st_atime, stat.st_mtime + 10))
+    assert index._resolve_hash(path) == digest
+    assert len(computed) == 2
+
+    _write(path, amplitude=0.2, seconds=0.6)
+    assert index._resolve_hash(path) != digest
+    assert len(computed) == 3
+    index.close()
+
+
+def test_realtime_factors_calibrate_from_recorded_runs(tmp_path):
+    index = CorpusIndex(str(tmp_path / "index.sqlite"))
+    assert index.realtime_factors() == DEFAULT_REALTIME_FACTORS
+
+    index.record_run("a", "traditional_only", 10.0, 2.0)
+    index.record_run("b", "traditional_only", 30.0, 2.0)
+    factors = index.realtime_factors()
+    assert factors["traditional_only"] == pytest.approx(0.1)
+    assert factors["ai_only"] == DEFAULT_REALTIME_FACTORS["ai_only"]
+    index.close()
+
+
+def test_run_batch_idle_workers_pull_from_shared_queue(monkeypatch, tmp_path):
+    """预测相同但实际很慢的文件不会让同一工作者后面排着的文件等待"""
+    input_dir = tmp_path / "in"
+    input_dir.mkdir()
+    # 按路径排序后慢文件排在最前（预测耗时相同，稳定排序保持路径顺序）
+    paths = [_write(input_dir / "0_slow.wav", amplitude=0.5)]
+    paths += [_write(input_dir / f"{i}_fast.wav") for i in range(1, 4)]
+
+    workers = {}
+
+    def _enhance(audio, sr, *args, **kwargs):
+        slow = np.max(np.abs(audio)) > 0.3
+        workers.setdefault(threading.get_ident(), []).append(slow)
+        time.sleep(1.0 if slow else 0.05)
+        return audio, {"success": True}
+
+    monkeypatch.setattr(corpus_index.hybrid_enhancer, "enhance_audio", _enhance)
+    index = CorpusIndex(str(tmp_path / "index.sqlite"))
+    summary = corpus_index.run_batch(paths, str(tmp_path / "out"), str(input_dir), index,
+                                     "traditional_only", num_workers=2)
+    index.close()
+
+    assert summary["files"] == 4 and summary["failed"] == 0
+    assert sorted(workers.values(), key=len) == [[True], [False, False, False]]
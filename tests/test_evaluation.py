@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("app")
+import evaluation  # noqa: E402
+
+SR = 16000
+
+
+def _tone(seconds: float = 1.0) -> np.ndarray:
+    t = np.arange(int(SR * seconds)) / SR
+    return (0.3 * np.sin(2 * np.pi * 220 * t) + 0.1 * np.sin(2 * np.pi * 1330 * t)).astype(np.float32)
+
+
+def _noise(n_samples: int, level: float, seed: int = 0) -> np.ndarray:
+    return (level * np.random.default_rng(seed).standard_normal(n_samples)).astype(np.float32)
+
+
+def test_si_sdr_is_scale_invariant():
+    clean = _tone()
+    noisy = clean + _noise(len(clean), 0.05)
+    score = evaluation.si_sdr(clean, noisy)
+    assert evaluation.si_sdr(clean, 0.25 * noisy) == pytest.approx(score, abs=1e-3)
+    assert evaluation.si_sdr(clean, 4.0 * noisy) == pytest.approx(score, abs=1e-3)
+    assert evaluation.si_sdr(clean, clean + _noise(len(clean), 0.2)) < score
+
+
+def test_si_sdr_matches_mixing_snr():
+    clean = _tone(2.0)
+    noise = _noise(len(clean), 1.0)
+    noisy = evaluation.mix_at_snr(clean, noise, 10.0)
+    assert evaluation.si_sdr(clean, noisy) == pytest.approx(10.0, abs=0.5)
+
+
+def test_segmental_snr_clips_to_ceiling_and_orders_noise():
+    clean = _tone()
+    assert evaluation.segmental_snr(clean, clean, SR) == pytest.approx(35.0)
+    light = evaluation.segmental_snr(clean, clean + _noise(len(clean), 0.01), SR)
+    heavy = evaluation.segmental_snr(clean, clean + _noise(len(clean), 0.1), SR)
+    assert 35.0 >= light > heavy >= -10.0
+
+
+def test_log_spectral_distance_of_identical_signals_is_zero():
+    clean = _tone()
+    assert evaluation.log_spectral_distance(clean, clean) == pytest.approx(0.0, abs=1e-6)
+    assert evaluation.log_spectral_distance(clean, clean + _noise(len(clean), 0.05)) > 1.0
+
+
+def test_metrics_are_batched_over_leading_axes():
+    clean = np.stack([_tone(), _tone()])
+    noisy = clean + np.stack([_noise(SR, 0.01, seed=1), _noise(SR, 0.1, seed=2)])
+    metrics = evaluation.compute_metrics(clean, noisy, SR)
+    for name, values in metrics.items():
+        assert values.shape == (2,), name
+    assert metrics["si_sdr"][0] > metrics["si_sdr"][1]
+    assert metrics["si_sdr"][1] == pytest.approx(evaluation.si_sdr(clean[1], noisy[1]), abs=1e-4)
+
+
+def test_pareto_front_excludes_dominated_rows():
+    rows = [
+        {"name": "fast", "runtime_s": 1.0, "si_sdr": 5.0},
+        {"name": "slow_better", "runtime_s": 3.0, "si_sdr": 9.0},
+        {"name": "dominated", "runtime_s": 2.0, "si_sdr": 4.0},
+        {"name": "tie_slower", "runtime_s": 3.0, "si_sdr": 9.0 - 1e-9},
+        {"name": "duplicate_fast", "runtime_s": 1.0, "si_sdr": 5.0},
+    ]
+    front = {row["name"] for row in evaluation.pareto_front(rows) if row["pareto"]}
+    assert front == {"fast", "slow_better", "duplicate_fast"}
@@ -0,0 +1,35 @@
+import json
+import host_profile
+
+
+def test_missing_profile_loads_empty(tmp_path):
+    assert host_profile.load_host_profile(str(tmp_path / "missing.json")) == {}
+
+
+def test_corrupt_profile_loads_empty(tmp_path):
+    path = tmp_path / "profile.json"
+    path.write_text("{not json", encoding="utf-8")
+    assert host_profile.load_host_profile(str(path)) == {}
+
+
+def test_profile_round_trip(tmp_path):
+    profile = {"num_threads": 4, "stft": {"rnnoise": {"hop_length": 320}},
+               "segment_seconds": {"thread_pool": 20.0, "process_pool": 60.0}}
+    path = host_profile.save_host_profile(profile, str(tmp_path / "nested" / "profile.json"))
+    assert json.loads(open(path, encoding="utf-8").read()) == profile
+    assert host_profile.load_host_profile(path) == profile
+
+
+def test_profile_path_env_override(monkeypatch, tmp_path):
+    monkeypatch.setenv("AUDIOHD_HOST_PROFILE", str(tmp_path / "custom.json"))
+    assert host_profile.default_profile_path() == str(tmp_path / "custom.json")
+
+
+def test_stft_params_overridden_by_profile(monkeypatch):
+    import ai_models
+    monkeypatch.setattr(ai_models, "host_profile",
+                        {"stft": {"rnnoise": {"hop_length": 320, "win_length": 768}, "unknown": {"n_fft": 64}}})
+    enhancer = ai_models.AIAudioEnhancer()
+    assert enhancer.stft_params["rnnoise"] == {"n_fft": 1024, "hop_length": 320, "win_length": 768}
+    assert enhancer.stft_params["speechbrain_enhance"]["hop_length"] == 256
+    assert "unknown" not in enhancer.stft_params
@@ -0,0 +1,81 @@
+import threading
+import time
+import pytest
+from job_queue import JobManager, JobQueueFull, current_job, progress_span, report_progress
+
+
+def _busy(stop: threading.Event = None, seconds: float = 10.0):
+    """在检查点之间循环，直到被取消、过期或超时"""
+    end = time.monotonic() + seconds
+    while time.monotonic() < end and not (stop is not None and stop.is_set()):
+        report_progress("处理中", 0.5)
+        time.sleep(0.01)
+    return "finished"
+
+
+@pytest.fixture
+def manager():
+    manager = JobManager(max_concurrency=1, max_pending=1)
+    yield manager
+    manager.shutdown()
+
+
+def test_submit_runs_job_to_completion(manager):
+    job = manager.submit(lambda x: x * 2, 21)
+    assert job.wait(5)
+    assert (job.status, job.result, job.progress) == ("done", 42, 1.0)
+    assert manager.get_job(job.id) is None
+
+
+def test_cancel_mid_job(manager):
+    job = manager.submit(_busy)
+    while job.status != "running":
+        time.sleep(0.01)
+    assert manager.cancel(job.id)
+    assert job.wait(5)
+    assert job.status == "cancelled" and job.result is None
+
+
+def test_deadline_expires_running_job(manager):
+    start = time.monotonic()
+    job = manager.submit(_busy, timeout=0.3)
+    assert job.wait(5)
+    assert job.status == "expired"
+    assert time.monotonic() - start < 2
+
+
+def test_job_cancelled_while_queued_never_runs(manager):
+    stop, ran = threading.Event(), []
+    first = manager.submit(_busy, stop)
+    queued = manager.submit(lambda: ran.append(True))
+    queued.cancel()
+    stop.set()
+    assert first.wait(5) and queued.wait(5)
+    assert first.status == "done" and queued.status == "cancelled" and not ran
+
+
+def test_rejects_when_running_and_pending_slots_are_full(manager):
+    stop = threading.Event()
+    jobs = [manager.submit(_busy, stop) for _ in range(manager.capacity)]
+    with pytest.raises(JobQueueFull):
+        manager.submit(_busy, stop)
+
+    # 任务结束后释放名额，可以再次提交
+    stop.set()
+    assert all(job.wait(5) for job in jobs)
+    assert manager.submit(lambda: "ok").wait(5)
+
+
+def test_progress_span_maps_nested_progress(manager):
+    def work():
+        with progress_span(0.5, 1.0):
+            report_progress("右声道", 0.5)
+        return current_job().progress
+
+    job = manager.submit(work)
+    assert job.wait(5) and job.result == pytest.approx(0.75)
+
+
+def test_report_progress_outside_job_is_noop():
+    report_progress("不在任务中", 0.5)
+    assert current_job() is None
@@ -0,0 +1,96 @@
+import numpy as np
+import pytest
+from scipy import signal
+from loudness import StreamingLoudnessNormalizer, measure_integrated_loudness, normalize_loudness
+
+SR = 16000
+
+
+def _program(seconds: float = 12.0, seed: int = 0, step: bool = True) -> np.ndarray:
+    """测试信号：调幅谐波 + 噪声，step=True时中段提高12dB"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(SR * seconds)) / SR
+    tone = sum(np.sin(2 * np.pi * 220 * k * t + rng.uniform(0, np.pi)) / k for k in range(1, 10))
+    audio = 0.05 * tone * (0.6 + 0.4 * np.sin(2 * np.pi * 0.7 * t)) + 0.005 * rng.standard_normal(len(t))
+    if step:
+        audio[len(t) // 3:2 * len(t) // 3] *= 4.0
+    return audio.astype(np.float32)
+
+
+def _true_peak_db(audio: np.ndarray) -> float:
+    """16倍过采样测量真峰值（与限幅器内部的估计相互独立）"""
+    upsampled = signal.resample_poly(np.atleast_2d(audio), 16, 1, axis=-1)
+    return float(20 * np.log10(np.max(np.abs(upsampled))))
+
+
+def _stream(audio: np.ndarray, chunk: int, **kwargs) -> np.ndarray:
+    normalizer = StreamingLoudnessNormalizer(SR, **kwargs)
+    pieces = [normalizer.process(audio[..., i:i + chunk]) for i in range(0, audio.shape[-1], chunk)]
+    pieces.append(normalizer.flush())
+    return np.concatenate(pieces, axis=-1)
+
+
+@pytest.mark.parametrize("stereo", [False, True])
+def test_output_independent_of_chunk_size(stereo):
+    audio = _program()
+    if stereo:
+        audio = np.stack([audio, 0.5 * audio[::-1]])
+    reference = _stream(audio, SR)
+    for chunk_seconds in (0.037, 0.4, 2.3):
+        output = _stream(audio, int(chunk_seconds * SR))
+        assert output.shape == audio.shape
+        np.testing.assert_allclose(output, reference, atol=1e-5)
+
+
+@pytest.mark.parametrize("kind", ["program", "noise", "clicks"])
+@pytest.mark.parametrize("sr", [16000, 22050, 48000])
+def test_true_peak_below_ceiling(kind, sr):
+    # 需要限幅器工作的响亮信号：削波的节目信号、满频带噪声和孤立脉冲
+    rng = np.random.default_rng(1)
+    if kind == "program":
+        audio = np.clip(_program() * 8.0, -1.0, 1.0)
+    elif kind == "noise":
+        audio = np.clip(0.5 * rng.standard_normal(8 * sr), -1.0, 1.0)
+    else:
+        audio = (rng.random(8 * sr) < 0.001) * rng.choice([-1.0, 1.0], 8 * sr)
+    output = normalize_loudness(audio.astype(np.float32), sr, target_lufs=-8.0)
+    assert _true_peak_db(output) <= -1.0
+
+
+def test_reaches_target_loudness():
+    output = normalize_loudness(_program(step=False), SR)
+    assert abs(measure_integrated_loudness(output, SR) - (-16.0)) < 0.5
+
+
+def test_leading_silence_latency_is_bounded():
+    """开头20秒静音时，输出落后输入不超过一个测量块加限幅器前瞻"""
+    audio = np.concatenate([np.zeros(20 * SR, dtype=np.float32), _program(4.0)])
+    normalizer = StreamingLoudnessNormalizer(SR)
+    bound = normalizer._block_size + normalizer.lookahead + normalizer._tp_delay
+
+    chunk, fed, emitted = 1000, 0, 0
+    for i in range(0, len(audio), chunk):
+        emitted += normalizer.process(audio[i:i + chunk]).shape[-1]
+        fed += len(audio[i:i + chunk])
+        assert fed - emitted <= bound
+    assert emitted + normalizer.flush().shape[-1] == len(audio)
+
+
+def test_polyphase_true_peak_matches_zero_stuffed_filter():
+    """多相估计与补零上采样后直接滤波一致；筛掉的位置只返回不超过上限的估计"""
+    normalizer = StreamingLoudnessNormalizer(SR)
+    rng = np.random.default_rng(0)
+    audio = np.stack([_program(2.0), 0.9 * np.clip(rng.standard_normal(2 * SR), -1, 1)]).astype(np.float32)
+    chunks = [audio[:, :777], audio[:, 777:SR], audio[:, SR:]]
+    peaks = np.concatenate([normalizer._true_peak(chunk) for chunk in chunks])
+
+    os_ = normalizer.oversample
+    fir = (signal.firwin(24 * os_ + 1, 1.0 / os_, window=("kaiser", 5.0)) * os_).astype(np.float32)
+    upsampled = np.zeros((2, audio.shape[1] * os_), dtype=np.float32)
+    upsampled[:, ::os_] = audio
+    reference = np.abs(signal.lfilter(fir, [1.0], upsampled, axis=-1)).reshape(2, -1, os_).max(axis=(0, 2))
+
+    exact = reference > normalizer.ceiling
+    assert exact.any()
+    np.testing.assert_allclose(peaks[exact], reference[exact], rtol=1e-5)
+    assert np.all(peaks[~exact] <= normalizer.ceiling) and np.all(peaks >= reference - 1e-6)
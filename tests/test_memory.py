@@ -0,0 +1,79 @@
+import tracemalloc
+import numpy as np
+import librosa
+import pytest
+from dsp_utils import as_float32
+
+SR = 16000
+SECONDS = 10.0
+
+
+def _noisy_clip() -> np.ndarray:
+    """固定的测试片段：调幅谐波信号加白噪声"""
+    rng = np.random.default_rng(0)
+    t = np.arange(int(SR * SECONDS)) / SR
+    voiced = sum(np.sin(2 * np.pi * 150 * k * t) / k for k in range(1, 8))
+    envelope = np.clip(np.sin(2 * np.pi * 4 * t), 0, None) ** 2
+    return as_float32(0.3 * voiced * envelope + 0.02 * rng.standard_normal(len(t)))
+
+
+def _peak_mb_per_second(fn, *args) -> float:
+    """fn执行期间的Python/NumPy峰值分配（MB/秒音频）"""
+    tracemalloc.start()
+    try:
+        fn(*args)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return peak / 2 ** 20 / SECONDS
+
+
+def _legacy_speechbrain(audio, sr):
+    """float32改造前的实现：float64输入，angle/exp在complex128中往返"""
+    stft = librosa.stft(np.asarray(audio, dtype=np.float64), n_fft=1024, hop_length=256)
+    magnitude = np.abs(stft)
+    phase = np.angle(stft)
+    enhanced_magnitude = np.clip(magnitude * 1.1, 0, magnitude.max() * 1.5)
+    return librosa.istft(enhanced_magnitude * np.exp(1j * phase), hop_length=256)
+
+
+def _legacy_blend(ai_enhanced, traditional_enhanced, blend_ratio):
+    return blend_ratio * ai_enhanced + (1 - blend_ratio) * traditional_enhanced
+
+
+def test_speechbrain_peak_allocation_below_legacy():
+    from ai_models import ai_enhancer
+    assert ai_enhancer.download_and_load_model("speechbrain_enhance")
+    entry = ai_enhancer.get_model_entry("speechbrain_enhance")
+    audio = _noisy_clip()
+
+    legacy = _peak_mb_per_second(_legacy_speechbrain, audio.astype(np.float64), SR)
+    current = _peak_mb_per_second(entry["processor"], entry["model"], audio, SR)
+    assert current < 0.6 * legacy, f"{current:.2f} MB/s vs 旧实现 {legacy:.2f} MB/s"
+
+
+def test_blend_peak_allocation_below_legacy():
+    pytest.importorskip("app")
+    from hybrid_enhancer import hybrid_enhancer
+    audio = _noisy_clip()
+    other = as_float32(audio[::-1].copy())
+
+    legacy = _peak_mb_per_second(_legacy_blend, audio.astype(np.float64), other.astype(np.float64), 0.3)
+    current = _peak_mb_per_second(hybrid_enhancer.blend_results, audio, other, 0.3)
+    assert current < 0.6 * legacy, f"{current:.2f} MB/s vs 旧实现 {legacy:.2f} MB/s"
+    np.testing.assert_allclose(hybrid_enhancer.blend_results(audio, other, 0.3),
+                               _legacy_blend(audio, other, 0.3), atol=1e-6)
+
+
+@pytest.mark.parametrize("enhancement_level", ["basic", "medium", "advanced"])
+def test_traditional_only_leaves_input_unchanged(enhancement_level):
+    """process_traditional_only不再预先复制输入，依赖传统处理器不原地修改输入"""
+    pytest.importorskip("app")
+    from hybrid_enhancer import hybrid_enhancer
+    audio = _noisy_clip()
+    stereo = np.stack([audio, audio[::-1].copy()])
+
+    for signal in (audio, stereo):
+        original = signal.copy()
+        hybrid_enhancer.process_traditional_only(signal, SR, enhancement_level)
+        np.testing.assert_array_equal(signal, original)
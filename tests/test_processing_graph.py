@@ -0,0 +1,133 @@
+import threading
+import pytest
+import numpy as np
+from processing_graph import GraphExecutor, ProcessingGraph
+
+SR = 16000
+
+
+class _FakeModels:
+    def __init__(self):
+        self.version = 1
+
+    def is_model_loaded(self, model_name):
+        return True
+
+    def model_version(self, model_name):
+        return self.version, (("hop_length", 256),)
+
+
+class _SlowEnhancer:
+    """只实现图执行所需接口的增强器，记录每次传统处理调用"""
+
+    def __init__(self, barrier: threading.Barrier = None):
+        self.barrier = barrier
+        self.calls = []
+        self.ai_enhancer = _FakeModels()
+
+    def process_traditional_only(self, audio, sr, level):
+        self.calls.append(level)
+        if self.barrier is not None:
+            self.barrier.wait(timeout=5)
+        return audio if level == "none" else audio * 0.5
+
+    def process_ai_only(self, audio, sr, model):
+        self.calls.append(model)
+        return audio
+
+    def blend_results(self, a, b, ratio):
+        return a * ratio + b * (1 - ratio)
+
+
+def _blend_graph():
+    g = ProcessingGraph()
+    x = g.source
+    return g.blend(g.traditional(x, "light"), g.traditional(x, "strong"), 0.5)
+
+
+def test_cache_bounded_by_bytes():
+    audio = np.ones(SR, dtype=np.float32)
+    executor = GraphExecutor(_SlowEnhancer(), cache_size=3 * audio.nbytes)
+    for i in range(5):
+        g = ProcessingGraph()
+        executor.run(g.traditional(g.source, "medium"), audio + i, SR)
+    assert len(executor._cache) == 3
+    assert executor._cache_bytes == 3 * audio.nbytes
+
+
+def test_large_input_skips_fingerprint_and_cache(monkeypatch):
+    audio = np.ones(SR, dtype=np.float32)
+    executor = GraphExecutor(_SlowEnhancer(), max_cacheable_bytes=audio.nbytes - 1)
+    monkeypatch.setattr(GraphExecutor, "fingerprint",
+                        staticmethod(lambda *args: (_ for _ in ()).throw(AssertionError("不应计算指纹"))))
+    g = ProcessingGraph()
+    executor.run(g.traditional(g.source, "medium"), audio, SR)
+    assert not executor._cache
+
+
+def test_zero_cache_size_disables_cache():
+    executor = GraphExecutor(_SlowEnhancer(), cache_size=0)
+    audio = np.ones(SR, dtype=np.float32)
+    for _ in range(2):
+        g = ProcessingGraph()
+        _, stats = executor.run(g.traditional(g.source, "medium"), audio, SR)
+        assert not stats["cache_hits"]
+    assert executor.enhancer.calls == ["medium", "medium"]
+
+
+def test_concurrent_requests_run_branches_in_parallel():
+    """两个并发请求的四个分支必须同时运行（共享2线程池时会在屏障处超时）"""
+    enhancer = _SlowEnhancer(barrier=threading.Barrier(4))
+    executor = GraphExecutor(enhancer, cache_size=0)
+    errors = []
+
+    def request(seed):
+        try:
+            executor.run(_blend_graph(), np.full(SR, seed, dtype=np.float32), SR)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=request, args=(i,)) for i in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10)
+    assert not errors
+    assert sorted(enhancer.calls) == ["light", "light", "strong", "strong"]
+
+
+def test_pass_through_node_does_not_freeze_caller_array():
+    executor = GraphExecutor(_SlowEnhancer())
+    audio = np.ones(SR, dtype=np.float32)
+    for run in range(2):
+        g = ProcessingGraph()
+        result, stats = executor.run(g.ai(g.traditional(g.source, "none"), "rnnoise"), audio.copy(), SR)
+        assert len(stats["cache_hits"]) == (0 if run == 0 else 2)
+    audio *= 2
+    g = ProcessingGraph()
+    executor.run(g.traditional(g.source, "none"), audio, SR)
+    audio *= 2
+
+
+def test_ai_cache_invalidated_by_model_version():
+    enhancer = _SlowEnhancer()
+    executor = GraphExecutor(enhancer)
+    audio = np.ones(SR, dtype=np.float32)
+
+    def run():
+        g = ProcessingGraph()
+        return executor.run(g.ai(g.source, "rnnoise"), audio, SR)[1]["cache_hits"]
+
+    assert run() == [] and run() != []
+    enhancer.ai_enhancer.version = 2
+    assert run() == []
+    assert enhancer.calls == ["rnnoise", "rnnoise"]
+
+
+def test_custom_pass_through_chain_keeps_input_writable():
+    pytest.importorskip("app")
+    from hybrid_enhancer import hybrid_enhancer
+
+    audio = (0.1 * np.sin(np.linspace(0, 2000, SR))).astype(np.float32)
+    hybrid_enhancer.enhance_audio(audio, SR, [{"op": "traditional", "level": "none"}], normalization="none")
+    audio *= 2
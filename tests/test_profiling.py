@@ -0,0 +1,56 @@
+import os
+import threading
+import numpy as np
+import pytest
+from profiling import RequestProfiler
+
+
+def test_zero_sample_rate_never_profiles():
+    profiler = RequestProfiler(sample_rate=0.0)
+    assert not any(profiler.should_profile() for _ in range(1000))
+    assert profiler.should_profile(True)
+    assert not RequestProfiler(sample_rate=1.0).should_profile(False)
+
+
+def test_concurrent_profile_is_skipped(tmp_path):
+    profiler = RequestProfiler(output_dir=str(tmp_path), sample_rate=0.0)
+    entered, release = threading.Event(), threading.Event()
+    outer = {}
+
+    def _hold():
+        with profiler.profile("outer") as info:
+            outer["info"] = info
+            entered.set()
+            release.wait(10)
+
+    thread = threading.Thread(target=_hold)
+    thread.start()
+    assert entered.wait(10)
+    try:
+        with profiler.profile("inner") as info:
+            assert info is None
+    finally:
+        release.set()
+        thread.join()
+
+    assert outer["info"] is not None and os.path.exists(outer["info"]["summary"])
+    assert len(os.listdir(tmp_path)) == 3
+
+
+def test_profiled_enhance_call_writes_all_outputs(monkeypatch, tmp_path):
+    pytest.importorskip("app")
+    from hybrid_enhancer import hybrid_enhancer
+    from profiling import request_profiler
+
+    monkeypatch.setattr(request_profiler, "output_dir", str(tmp_path))
+    t = np.arange(16000) / 16000
+    audio = (0.3 * np.sin(2 * np.pi * 220 * t)).astype(np.float32)
+    _, metadata = hybrid_enhancer.enhance_audio(audio, 16000, "traditional_only", profile=True)
+
+    info = metadata["profile"]
+    assert info["pstats"].endswith(".prof")
+    assert info["chrome_trace"].endswith(".trace.json")
+    assert info["summary"].endswith(".txt")
+    for key in ("pstats", "chrome_trace", "summary"):
+        assert os.path.getsize(info[key]) > 0
+    assert info["wall_time"] > 0
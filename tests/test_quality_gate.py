@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+from quality_gate import QualityGate
+
+SR = 16000
+
+
+def _speech_like(seconds: float, seed: int = 0) -> np.ndarray:
+    """有明显停顿的调幅谐波信号（停顿处接近静音，代理评分高）"""
+    t = np.arange(int(SR * seconds)) / SR
+    voiced = sum(np.sin(2 * np.pi * 150 * k * t) / k for k in range(1, 8))
+    envelope = np.clip(np.sin(2 * np.pi * 2 * t + seed), 0, None) ** 2
+    return (0.3 * voiced * envelope).astype(np.float32)
+
+
+def _noisy(audio: np.ndarray, level: float = 0.1, seed: int = 1) -> np.ndarray:
+    return (audio + level * np.random.default_rng(seed).standard_normal(len(audio))).astype(np.float32)
+
+
+def test_excerpts_span_the_whole_file():
+    gate = QualityGate()
+    audio = np.arange(120 * SR, dtype=np.float32)
+    excerpts = gate._excerpts(audio, SR)
+    assert len(excerpts) == gate.num_excerpts
+    assert sum(len(excerpt) for excerpt in excerpts) <= gate.max_seconds * SR
+    assert excerpts[0][0] == 0 and excerpts[-1][-1] == len(audio) - 1
+
+
+def test_short_audio_scored_whole():
+    gate = QualityGate()
+    audio = _speech_like(4.0)
+    assert len(gate._excerpts(audio, SR)) == 1
+
+
+def test_noise_after_clean_opening_is_not_skipped():
+    """开头10秒干净、之后带噪的长音频，评分应与带噪部分一致而不是开头"""
+    gate = QualityGate()
+    clean = _speech_like(60.0)
+    mixed = np.concatenate([clean[:10 * SR], _noisy(clean[10 * SR:])])
+
+    clean_score = gate.score(clean, SR)
+    noisy_score = gate.score(_noisy(clean), SR)
+    assert clean_score - noisy_score > 1.0
+    assert gate.score(mixed, SR) <= noisy_score + 0.2
+
+
+def test_batch_scores_match_individual_scores():
+    gate = QualityGate()
+    audios = [_speech_like(30.0), _noisy(_speech_like(5.0, seed=1)), _speech_like(1.0, seed=2)]
+    batch = gate.score_batch(audios, SR)
+    np.testing.assert_allclose(batch, [gate.score(audio, SR) for audio in audios], atol=1e-5)
+
+
+def test_independent_stereo_is_gated_jointly(monkeypatch):
+    pytest.importorskip("app")
+    pytest.importorskip("gradio")
+    import app_hybrid
+
+    calls = []
+    monkeypatch.setattr(app_hybrid.hybrid_enhancer, "enhance_audio",
+                        lambda audio, sr, *args, **kwargs: calls.append(kwargs) or (audio, {"success": True}))
+
+    clean = _speech_like(12.0)
+    stereo = np.stack([clean, _noisy(_speech_like(12.0, seed=2), seed=3)])
+    settings = ("traditional_only", "rnnoise", "medium", 0.5)
+    _, metadata = app_hybrid._enhance_stereo(stereo, SR, settings, {"quality_threshold": 3.0})
+
+    assert metadata["channel_shortcut"] == "none"
+    scores = {kwargs["quality_score"] for kwargs in calls}
+    assert len(calls) == 2 and len(scores) == 1
+    assert scores.pop() == pytest.approx(float(app_hybrid.hybrid_enhancer.quality_gate.score_batch(stereo, SR).min()))
@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("app")
+pytest.importorskip("gradio")
+import replay
+
+
+@pytest.fixture(autouse=True)
+def _instant_service(monkeypatch):
+    monkeypatch.setattr(replay.app_hybrid, "process_audio_hybrid", lambda *args: ("out.wav", "ok"))
+
+
+def _trace(timestamps):
+    return [{"timestamp": t, "args": ()} for t in timestamps]
+
+
+def test_trace_replay_offered_rate_counts_every_interval():
+    # 4条请求、间隔0.05秒：提供负载应为20请求/秒，而不是4/0.15
+    row = replay.run_load(_trace([0.0, 0.05, 0.1, 0.15]), concurrency=2)
+    assert row["offered_rate"] == pytest.approx(20.0, rel=0.2)
+
+
+def test_cyclic_replay_keeps_interval_between_cycles():
+    row = replay.run_load(_trace([0.0, 0.05]), concurrency=2, num_requests=4)
+    assert row["offered_rate"] == pytest.approx(20.0, rel=0.2)
+
+
+def test_single_request_trace_is_not_saturated():
+    row = replay.run_load(_trace([0.0]), concurrency=1)
+    assert np.isnan(row["offered_rate"])
+    assert not replay.is_saturated(row)
+    row["saturated"], row["saturation_rate"] = False, None
+    assert "所有负载均已饱和" in replay.format_report([row])
@@ -0,0 +1,104 @@
+import contextlib
+import os
+import numpy as np
+import pytest
+import torch
+
+pytest.importorskip("app")
+from hybrid_enhancer import hybrid_enhancer  # noqa: E402
+from segment_parallel import enhance_long_audio, plan_segments, stft_alignment  # noqa: E402
+
+SAMPLE_RATES = [16000, 22050, 44100, 48000]
+
+
+def _clip(sr: int, seconds: float = 14.0) -> np.ndarray:
+    rng = np.random.default_rng(0)
+    t = np.arange(int(sr * seconds)) / sr
+    voiced = 0.3 * np.sin(2 * np.pi * 200 * t) * np.clip(np.sin(2 * np.pi * 3 * t), 0, None)
+    return (voiced + 0.05 * rng.standard_normal(len(t))).astype(np.float32)
+
+
+@pytest.mark.parametrize("sr", SAMPLE_RATES)
+def test_segment_positions_are_hop_aligned(sr):
+    align = stft_alignment()
+    for segment in plan_segments(int(sr * 95.3), sr, segment_seconds=30.0, crossfade_seconds=0.5):
+        for key in ("start", "fade_start", "fade_in", "fade_out"):
+            assert segment[key] % align == 0, (key, segment)
+
+
+@pytest.mark.parametrize("sr", SAMPLE_RATES)
+def test_segmented_output_matches_sequential(sr):
+    """分段并行处理与整段顺序处理的结果一致（RNNoise，相对RMS误差）
+
+    帧网格错位时误差约为7e-3，对齐后只剩RNN状态在预热区内未完全收敛的差异。
+    """
+    # RNNoise为随机初始化的演示模型，固定权重保证结果可复现
+    hybrid_enhancer.ai_enhancer.unload_model("rnnoise")
+    torch.manual_seed(0)
+    assert hybrid_enhancer.load_ai_model("rnnoise")
+    audio = _clip(sr)
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        hybrid_enhancer.graph_executor.clear_cache()
+        sequential, _ = hybrid_enhancer.enhance_audio(audio, sr, "ai_only", "rnnoise",
+                                                      normalization="none", profile=False)
+        segmented, metadata = enhance_long_audio(audio, sr, "ai_only", "rnnoise", normalization="none",
+                                                 segment_seconds=3.0, num_workers=2)
+
+    assert metadata["segments"] > 2
+    error = np.sqrt(np.mean((segmented - sequential) ** 2)) / np.sqrt(np.mean(sequential ** 2))
+    assert error < 1e-3
+
+
+def test_thread_backend_caps_operator_threads(monkeypatch):
+    """线程池后端按线程数均分核心，结束后恢复原来的线程数"""
+    import segment_parallel
+    observed = []
+
+    def fake_enhance(audio, sr, *args, **kwargs):
+        observed.append(torch.get_num_threads())
+        return audio, {"success": True}
+
+    monkeypatch.setattr(segment_parallel.hybrid_enhancer, "enhance_audio", fake_enhance)
+    monkeypatch.setattr(os, "cpu_count", lambda: 8)
+    before = torch.get_num_threads()
+    _, metadata = enhance_long_audio(_clip(16000), 16000, "traditional_only", normalization="none",
+                                     segment_seconds=3.0, num_workers=4)
+
+    assert metadata["parallel_backend"] == "thread_pool"
+    assert observed and set(observed) == {2}
+    assert torch.get_num_threads() == before
+
+
+def test_single_process_app_routes_long_audio_through_segments(monkeypatch):
+    pytest.importorskip("gradio")
+    import app_hybrid
+
+    calls = []
+    monkeypatch.setattr(app_hybrid, "worker_pool", None)
+    monkeypatch.setattr(app_hybrid, "LONG_AUDIO_SECONDS", 10.0)
+    monkeypatch.setattr(app_hybrid, "enhance_long_audio",
+                        lambda audio, sr, *args, **kwargs: calls.append(kwargs) or (audio, {"success": True}))
+    settings = ("traditional_only", "rnnoise", "medium", 0.5)
+    app_hybrid._enhance_channels([_clip(16000)], 16000, [settings], [{}])
+    assert len(calls) == 1 and calls[0]["worker_pool"] is None
+
+
+def test_alignment_is_lcm_of_model_hops(monkeypatch):
+    monkeypatch.setitem(hybrid_enhancer.ai_enhancer.stft_params, "rnnoise",
+                        {"n_fft": 1024, "hop_length": 320, "win_length": 768})
+    monkeypatch.setitem(hybrid_enhancer.ai_enhancer.stft_params, "speechbrain_enhance",
+                        {"n_fft": 1024, "hop_length": 256, "win_length": 1024})
+    assert stft_alignment() == 1280
+    for segment in plan_segments(16000 * 95, 16000, segment_seconds=20.0):
+        for key in ("start", "fade_start", "fade_in", "fade_out"):
+            assert segment[key] % 1280 == 0
+
+
+def test_segment_seconds_tuned_per_backend(monkeypatch):
+    import segment_parallel
+    monkeypatch.setattr(segment_parallel, "host_profile",
+                        {"segment_seconds": {"thread_pool": 20.0, "process_pool": 60.0}})
+    assert segment_parallel.tuned_segment_seconds("thread_pool") == 20.0
+    assert segment_parallel.tuned_segment_seconds("process_pool") == 60.0
+    monkeypatch.setattr(segment_parallel, "host_profile", {})
+    assert segment_parallel.tuned_segment_seconds("process_pool") == segment_parallel.DEFAULT_SEGMENT_SECONDS
@@ -0,0 +1,124 @@
+import multiprocessing as mp
+import os
+import time
+import numpy as np
+import pytest
+
+pytest.importorskip("app")
+import worker_pool
+from job_queue import JobCancelled, JobManager
+
+SR = 16000
+REAL_SETTINGS = {"processing_mode": "traditional_only", "enhancement_level": "light", "normalization": "none"}
+
+
+def _fake_task(audio, sr, args, kwargs):
+    """分叉出的初始工作进程继承的测试任务：按action休眠、崩溃或返回加倍的音频"""
+    action = kwargs.get("action")
+    if action == "sleep":
+        time.sleep(kwargs.get("seconds", 30))
+    elif action == "crash":
+        os._exit(3)
+    return audio * 2, {"pid": os.getpid()}
+
+
+@pytest.fixture
+def make_pool(monkeypatch):
+    monkeypatch.setattr(worker_pool, "_enhance_task", _fake_task)
+    pools = []
+
+    def make(num_workers):
+        pool = worker_pool.EnhancementWorkerPool(num_workers)
+        pool.start()
+        pools.append(pool)
+        return pool
+
+    yield make
+    for pool in pools:
+        pool.shutdown()
+
+
+def _audio():
+    return np.linspace(-0.5, 0.5, SR // 2, dtype=np.float32)
+
+
+def test_start_forks_all_workers_synchronously(make_pool):
+    before = len(mp.active_children())
+    pool = make_pool(2)
+    assert len(mp.active_children()) - before == 2
+    assert pool.respawn_method != "fork"
+
+
+def test_dispatch_spreads_tasks_over_workers(make_pool):
+    pool = make_pool(2)
+    tasks = [pool.submit(_audio(), SR, action="sleep", seconds=0.5) for _ in range(4)]
+    results = [task.get(timeout=30) for task in tasks]
+    for enhanced, _ in results:
+        np.testing.assert_allclose(enhanced, _audio() * 2)
+    assert len({metadata["pid"] for _, metadata in results}) == 2
+
+
+def test_cancel_terminates_worker_and_respawns(make_pool):
+    pool = make_pool(1)
+    methods = []
+    spawn = pool._spawn
+    pool._spawn = lambda ctx: methods.append(ctx.get_start_method()) or spawn(ctx)
+    task = pool.submit(_audio(), SR, action="sleep")
+    time.sleep(0.5)
+    start = time.monotonic()
+    task.cancel()
+    with pytest.raises(JobCancelled):
+        task.get(timeout=10)
+    assert time.monotonic() - start < 5
+    # 替代进程不能从已启动分发线程的父进程直接fork
+    assert methods == [pool.respawn_method] and "fork" not in methods
+
+    # 替代进程不继承测试任务，执行真实的增强
+    enhanced, metadata = pool.enhance_audio(_audio(), SR, **REAL_SETTINGS)
+    assert enhanced.shape == _audio().shape and metadata.get("success", True)
+
+
+def test_crash_reports_error_and_respawns(make_pool):
+    pool = make_pool(1)
+    with pytest.raises(RuntimeError, match="exitcode=3"):
+        pool.submit(_audio(), SR, action="crash").get(timeout=30)
+    enhanced, _ = pool.submit(_audio(), SR, **REAL_SETTINGS).get(timeout=120)
+    assert enhanced.shape == _audio().shape
+
+
+def test_cancelled_before_dispatch_is_skipped(make_pool):
+    pool = make_pool(1)
+    running = pool.submit(_audio(), SR, action="sleep", seconds=1.0)
+    queued = pool.submit(_audio(), SR)
+    queued.cancel()
+    with pytest.raises(JobCancelled):
+        queued.get(timeout=10)
+    running.get(timeout=10)
+
+
+def test_cancelling_job_stops_its_worker_task(make_pool):
+    pool = make_pool(1)
+    manager = JobManager(max_concurrency=1, max_pending=0)
+    job = manager.submit(pool.enhance_audio, _audio(), SR, action="sleep")
+    while job.status != "running":
+        time.sleep(0.01)
+    time.sleep(0.3)
+    start = time.monotonic()
+    job.cancel()
+    assert job.wait(10)
+    assert job.status == "cancelled"
+    assert time.monotonic() - start < 5
+    manager.shutdown()
+
+
+def test_job_deadline_stops_its_worker_task(make_pool):
+    pool = make_pool(1)
+    manager = JobManager(max_concurrency=1, max_pending=0)
+    job = manager.submit(pool.enhance_audio, _audio(), SR, action="sleep", timeout=1.0)
+    assert job.wait(10)
+    assert job.status == "expired"
+    assert job.finished_at - job.created_at < 5
+    # 过期任务所在的工作进程已被替换，池仍可继续处理
+    enhanced, _ = pool.submit(_audio(), SR, **REAL_SETTINGS).get(timeout=120)
+    assert enhanced.shape == _audio().shape
+    manager.shutdown()
@@ -0,0 +1,321 @@
+import gc
+import os
+import contextlib
+import queue
+import threading
+import time
+import multiprocessing as mp
+import numpy as np
+import torch
+import torch.nn as nn
+from typing import List, Optional, Tuple
+from ai_models import ai_enhancer
+from hybrid_enhancer import hybrid_enhancer
+from job_queue import JobCancelled, current_job
+from profiling import request_profiler
+import warnings
+warnings.filterwarnings("ignore")
+
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:  # threadpoolctl为可选依赖
+    threadpool_limits = None
+
+# 等待工作进程结果时检查取消/截止时间的间隔（秒）
+CANCEL_POLL_INTERVAL = 0.5
+
+# limit_threads的嵌套/并发状态：(生效中的调用数, 进入前的线程数, 当前上限)
+_thread_limit_lock = threading.Lock()
+_thread_limit_state = [0, None, None]
+
+
+def compute_threads_per_worker(num_workers: int, cpu_count: Optional[int] = None) -> int:
+    """根据CPU核心数计算每个工作进程的线程数，避免线程超额订阅"""
+    cpu_count = cpu_count or os.cpu_count() or 1
+    return max(1, cpu_count // max(1, num_workers))
+
+
+def configure_threads(num_threads: int):
+    """设置当前进程的torch/OpenMP/BLAS线程数"""
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[var] = str(num_threads)
+    torch.set_num_threads(num_threads)
+    if threadpool_limits is not None:
+        # 环境变量对已初始化的BLAS无效，需通过threadpoolctl调整
+        threadpool_limits(limits=num_threads)
+
+
+@contextlib.contextmanager
+def limit_threads(num_threads: int):
+    """在with块内把本进程的torch/BLAS线程数限制为num_threads，结束后恢复
+
+    线程数是进程级设置：多个请求同时使用时取最小的上限，最后一个退出时恢复原值。
+    """
+    with _thread_limit_lock:
+        depth, previous, current = _thread_limit_state
+        if depth == 0:
+            previous, current = torch.get_num_threads(), num_threads
+        else:
+            current = min(current, num_threads)
+        _thread_limit_state[:] = [depth + 1, previous, current]
+        torch.set_num_threads(current)
+    limiter = threadpool_limits(limits=current) if threadpool_limits is not None else contextlib.nullcontext()
+    try:
+        with limiter:
+            yield
+    finally:
+        with _thread_limit_lock:
+            depth, previous, current = _thread_limit_state
+            if depth == 1:
+                torch.set_num_threads(previous)
+                _thread_limit_state[:] = [0, None, None]
+            else:
+                _thread_limit_state[0] = depth - 1
+
+
+def share_model_memory():
+    """将已加载的torch模型权重移到共享内存，供所有子进程复用"""
+    for model_name, entry in list(ai_enhancer.models.items()):
+        model = entry.get("model")
+        if isinstance(model, nn.Module) and next(model.parameters(), torch.empty(0)).device.type == "cpu":
+            model.share_memory()
+            print(f"🔗 模型 {model_name} 权重已放入共享内存")
+
+
+def _worker_settings() -> dict:
+    """父进程启动后修改的运行时配置，传给非fork方式启动的工作进程"""
+    return {"profile_sample": request_profiler.sample_rate, "profile_dir": request_profiler.output_dir}
+
+
+def _worker_initializer(num_threads: int, preload_models: List[str], settings: Optional[dict] = None):
+    """工作进程初始化：设置线程数，必要时加载模型（非fork启动方式）"""
+    if settings:
+        request_profiler.sample_rate = settings["profile_sample"]
+        request_profiler.output_dir = settings["profile_dir"]
+    configure_threads(num_threads)
+    for model_name in preload_models:
+        if not ai_enhancer.is_model_loaded(model_name):
+            ai_enhancer.download_and_load_model(model_name)
+    print(f"👷 工作进程 {os.getpid()} 就绪，线程数: {num_threads}")
+
+
+def _enhance_task(audio: np.ndarray, sr: int, args: tuple, kwargs: dict) -> Tuple[np.ndarray, dict]:
+    """在工作进程中执行单声道增强"""
+    return hybrid_enhancer.enhance_audio(audio, sr, *args, **kwargs)
+
+
+def _worker_main(conn, num_threads: int, preload_models: List[str], settings: Optional[dict] = None):
+    """工作进程主循环：逐个接收任务并回传结果，收到None时退出"""
+    _worker_initializer(num_threads, preload_models, settings)
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            break
+        if task is None:
+            break
+        try:
+            conn.send((True, _enhance_task(*task)))
+        except Exception as e:
+            conn.send((False, RuntimeError(f"{type(e).__name__}: {e}")))
+    conn.close()
+
+
+class WorkerTask:
+    """提交到工作进程池的单个任务，接口与AsyncResult的get/ready一致，并支持取消"""
+
+    def __init__(self, payload: tuple):
+        self.payload = payload
+        self.result = None
+        self.error = None
+        self._cancel_event = threading.Event()
+        self._done_event = threading.Event()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel_event.is_set()
+
+    def cancel(self):
+        """取消任务：未开始的不再分发，正在运行的由所在工作进程被终止并替换"""
+        self._cancel_event.set()
+
+    def ready(self) -> bool:
+        return self._done_event.is_set()
+
+    def _finish(self, result=None, error: Optional[Exception] = None):
+        self.result, self.error = result, error
+        self._done_event.set()
+
+    def get(self, timeout: Optional[float] = None):
+        """等待结果；超时抛出multiprocessing.TimeoutError，任务失败或取消时抛出对应异常"""
+        if not self._done_event.wait(timeout):
+            raise mp.TimeoutError("工作进程任务尚未完成")
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+    def wait(self):
+        """在当前任务上下文中等待结果：按截止时间限时等待，期间检查取消，终止时回收工作进程"""
+        job = current_job()
+        if job is None:
+            return self.get()
+        while True:
+            timeout = CANCEL_POLL_INTERVAL
+            if job.deadline is not None:
+                timeout = max(0.0, min(timeout, job.deadline - time.monotonic()))
+            if self._done_event.wait(timeout):
+                return self.get()
+            try:
+                job.raise_if_cancelled()
+            except JobCancelled:
+                self.cancel()
+                raise
+
+
+class EnhancementWorkerPool:
+    """预分叉工作进程池 - 父进程加载一次模型，子进程通过写时复制/共享内存复用权重
+
+    所有工作进程在start()中同步分叉，之后才启动父进程中的分发线程（每个进程一个）。
+    任务被取消、超过截止时间或工作进程崩溃时，替代进程从forkserver/spawn上下文启动：
+    此时父进程已是多线程，再fork可能继承被其他线程持有的锁而死锁。
+    """
+
+    def __init__(self, num_workers: Optional[int] = None,
+                 preload_models: Optional[List[str]] = None):
+        self.num_workers = max(1, num_workers or os.cpu_count() or 1)
+        self.threads_per_worker = compute_threads_per_worker(self.num_workers)
+        self.preload_models = list(preload_models or [])
+        methods = mp.get_all_start_methods()
+        self.start_method = "fork" if "fork" in methods else "spawn"
+        self.respawn_method = "forkserver" if "forkserver" in methods else "spawn"
+        self._ctx = mp.get_context(self.start_method)
+        self._respawn_ctx = mp.get_context(self.respawn_method)
+        self._tasks = queue.Queue()
+        self._dispatchers = []
+        self._running = False
+
+    @property
+    def is_running(self) -> bool:
+        """检查进程池是否已启动"""
+        return self._running
+
+    def start(self):
+        """在父进程加载模型后分叉工作进程"""
+        if self._running:
+            return
+
+        for model_name in self.preload_models:
+            if not ai_enhancer.is_model_loaded(model_name):
+                print(f"⏳ 父进程预加载AI模型: {model_name}")
+                ai_enhancer.download_and_load_model(model_name)
+
+        if self.start_method == "fork":
+            share_model_memory()
+            # 冻结现有对象，避免子进程中的GC触发写时复制
+            gc.collect()
+            gc.freeze()
+        else:
+            print("⚠️ 当前平台不支持fork，每个工作进程将单独加载模型")
+
+        # 先同步分叉全部工作进程，再启动任何分发线程
+        workers = [self._spawn(self._ctx) for _ in range(self.num_workers)]
+        if self.respawn_method == "forkserver":
+            # forkserver进程以fork+exec启动，预先导入本模块，替代进程无需重复导入torch
+            self._respawn_ctx.set_forkserver_preload([__name__])
+
+        self._running = True
+        for i, (process, conn) in enumerate(workers):
+            thread = threading.Thread(target=self._dispatch, args=(process, conn),
+                                      name=f"audiohd-worker-{i}", daemon=True)
+            thread.start()
+            self._dispatchers.append(thread)
+        print(f"🚀 工作进程池已启动: {self.num_workers} 个进程 × {self.threads_per_worker} 线程 ({self.start_method})")
+
+    def _spawn(self, ctx):
+        """用指定的多进程上下文启动一个工作进程，返回 (进程, 父端连接)"""
+        parent_conn, child_conn = ctx.Pipe()
+        settings = None if ctx.get_start_method() == "fork" else _worker_settings()
+        process = ctx.Process(target=_worker_main, daemon=True,
+                              args=(child_conn, self.threads_per_worker, self.preload_models, settings))
+        process.start()
+        child_conn.close()
+        return process, parent_conn
+
+    def _respawn(self):
+        """替换被终止或崩溃的工作进程（不从多线程的父进程直接fork）"""
+        return self._spawn(self._respawn_ctx)
+
+    def _dispatch(self, process, conn):
+        """分发线程：把队列中的任务交给自己的工作进程，等待期间响应取消"""
+        task = None
+        try:
+            while True:
+                task = self._tasks.get()
+                if task is None:
+                    conn.send(None)
+                    process.join(5)
+                    return
+                if task.cancelled:
+                    task._finish(error=JobCancelled("任务已取消"))
+                    continue
+
+                conn.send(task.payload)
+                while not conn.poll(CANCEL_POLL_INTERVAL / 5):
+                    if task.cancelled:
+                        break
+                    if not process.is_alive():
+                        break
+
+                reply = None
+                if conn.poll():
+                    try:
+                        reply = conn.recv()
+                    except EOFError:
+                        # 工作进程退出时管道关闭，poll同样返回True
+                        pass
+                if reply is not None:
+                    ok, value = reply
+                    task._finish(value if ok else None, None if ok else value)
+                elif task.cancelled:
+                    # 终止正在处理已取消任务的工作进程，并启动一个新的替代它
+                    print(f"🛑 终止工作进程 {process.pid}（任务已取消）")
+                    process.terminate()
+                    process.join()
+                    conn.close()
+                    task._finish(error=JobCancelled("任务已取消"))
+                    process, conn = self._respawn()
+                else:
+                    process.join()
+                    exitcode = process.exitcode
+                    conn.close()
+                    task._finish(error=RuntimeError(f"工作进程异常退出 (exitcode={exitcode})"))
+                    process, conn = self._respawn()
+        except Exception as e:
+            print(f"❌ 工作进程分发线程异常退出: {str(e)}")
+            if task is not None and not task.ready():
+                task._finish(error=RuntimeError(f"工作进程分发失败: {str(e)}"))
+            if process.is_alive():
+                process.terminate()
+
+    def submit(self, audio: np.ndarray, sr: int, *args, **kwargs) -> WorkerTask:
+        """异步提交一个单声道增强任务，参数同enhance_audio，返回WorkerTask"""
+        if not self._running:
+            self.start()
+        task = WorkerTask((audio, sr, args, kwargs))
+        self._tasks.put(task)
+        return task
+
+    def enhance_audio(self, audio: np.ndarray, sr: int, *args, **kwargs) -> Tuple[np.ndarray, dict]:
+        """与HybridAudioEnhancer.enhance_audio接口一致的同步调用（在任务中运行时响应取消）"""
+        return self.submit(audio, sr, *args, **kwargs).wait()
+
+    def shutdown(self):
+        """关闭进程池：等待已提交的任务完成后退出各工作进程"""
+        if self._running:
+            for _ in self._dispatchers:
+                self._tasks.put(None)
+            for thread in self._dispatchers:
+                thread.join()
+            self._dispatchers = []
+            self._running = False
+            print("🛑 工作进程池已关闭")